@@ -1,4 +1,5 @@
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from json import JSONDecodeError
 from urllib.error import HTTPError
@@ -14,10 +15,19 @@ AUDIT_LOG = "/audit-log/"
 VOUNDRABILITIES = "/vulnerabilities/"
 WARNING_QUOTA = 75
 CRITICAL_QUOTA = 85
-LAST_VULNERABILITY_STAMP = 0
-LAST_AUDIT_LOG_STAMP = 0
-AUDIT_LOG_LAST_RUN = 0
-VULNERABILITY_LAST_RUN = 0
+PAGE_SIZE = 100
+VULNERABILITY_SEVERITIES = ("High", "Critical")
+AUDIT_LOG_CHECKPOINT = "audit_log_checkpoint"
+VULNERABILITY_CHECKPOINT = "vulnerability_checkpoint"
+# Default number of seconds between two collections of each endpoint group, 0 collects on every check run
+ENDPOINT_INTERVALS = {"usage": 0, "entitlements": 0, "audit_log": 300, "vulnerabilities": 300}
+MAX_BACKOFF = 3600
+
+
+class RateLimitedError(CheckException):
+    def __init__(self, message, retry_after=None):
+        super(RateLimitedError, self).__init__(message)
+        self.retry_after = retry_after
 
 
 def audit_log_resp_good():
@@ -81,9 +91,20 @@ class CloudsmithCheck(AgentCheck):
         self.base_url = self.instance.get("url")
         self.api_key = self.instance.get("cloudsmith_api_key")
         self.org = self.instance.get("organization")
+        self.page_size = self.instance.get("page_size", PAGE_SIZE)
+
+        self.intervals = {
+            group: self.instance.get("{}_interval".format(group), interval)
+            for group, interval in ENDPOINT_INTERVALS.items()
+        }
 
         self.validate_config()
 
+        # per endpoint group scheduling state and last collected result
+        self.next_run = {group: 0 for group in ENDPOINT_INTERVALS}
+        self.rate_limited_count = {group: 0 for group in ENDPOINT_INTERVALS}
+        self.results = {}
+
         self.log.debug("Cloudsmith monitoring starting on %s", self.base_url)
 
         self.tags = self.instance.get("tags", [])
@@ -100,20 +121,28 @@ class CloudsmithCheck(AgentCheck):
         if not self.base_url:
             raise ConfigurationError("Configuration error, please specify Cloudsmith url in conf.yaml")
 
+        if not isinstance(self.page_size, int) or self.page_size < 1:
+            raise ConfigurationError("Configuration error, page_size must be a positive integer.")
+
+        for group, interval in self.intervals.items():
+            if not isinstance(interval, (int, float)) or interval < 0:
+                raise ConfigurationError("Configuration error, {}_interval must be a positive number.".format(group))
+
     def get_full_path(self, path):
         url = self.base_url.rstrip("/") + path + self.org
         return url
 
     def convert_time(self, time):
-        return int(datetime.strptime(time, "%Y-%m-%dT%H:%M:%S.%fZ").timestamp())
+        # sub-second precision, records logged in the same second as the checkpoint are not skipped
+        return datetime.strptime(time, "%Y-%m-%dT%H:%M:%S.%fZ").timestamp()
 
     # Get stats from REST API as json
-    def get_api_json(self, url):
+    def get_api_json(self, url, params=None):
 
         try:
             key = self.api_key
             headers = {"X-Api-Key": key, "content-type": "application/json"}
-            response = self.http.get(url, headers=headers)
+            response = self.http.get(url, headers=headers, params=params)
         except Timeout as e:
             error_message = "Request timeout: {}, {}".format(url, e)
             self.log.warning(error_message)
@@ -154,6 +183,20 @@ class CloudsmithCheck(AgentCheck):
         if response.status_code == 401 and ("audit-log" in url or "vulnerabilities" in url):
             return None
 
+        # the API answers 404 for a page past the last one
+        if response.status_code == 404 and params and params.get("page", 1) > 1:
+            return []
+
+        if response.status_code == 429:
+            error_message = "Rate limited by the Cloudsmith API for url {}".format(url)
+            self.log.warning(error_message)
+            self.service_check("can_connect", AgentCheck.WARNING, message=error_message)
+            try:
+                retry_after = int(response.headers.get("Retry-After"))
+            except (TypeError, ValueError):
+                retry_after = None
+            raise RateLimitedError(error_message, retry_after)
+
         if response.status_code != 200:
             error_message = f"""Expected status code 200 for url {url}, but got status code:
             {response.status_code} check your config information"""
@@ -175,20 +218,43 @@ class CloudsmithCheck(AgentCheck):
         response_json = self.get_api_json(url)
         return response_json
 
-    def get_audit_log_info(self):
+    def get_audit_log_info(self, page=1):
         url = self.get_full_path(AUDIT_LOG)
-        response_json = self.get_api_json(url)
-        if not response_json:
+        response_json = self.get_api_json(url, params={"page": page, "page_size": self.page_size})
+        if not response_json and page == 1:
             response_json = audit_log_resp_good()
         return response_json
 
-    def get_vulnerabilities_info(self):
+    def get_vulnerabilities_info(self, page=1):
         url = self.get_full_path(VOUNDRABILITIES)
-        response_json = self.get_api_json(url)
-        if not response_json:
+        response_json = self.get_api_json(url, params={"page": page, "page_size": self.page_size})
+        if not response_json and page == 1:
             response_json = vulnerabilitiy_resp_json()
         return response_json
 
+    def get_checkpoint(self, key):
+        checkpoint = self.read_persistent_cache(key)
+        return float(checkpoint) if checkpoint else None
+
+    def set_checkpoint(self, key, checkpoint):
+        self.write_persistent_cache(key, repr(checkpoint))
+
+    def iter_new_records(self, get_page, parse, time_key, checkpoint):
+        # Collections are listed newest first, so paging stops at the first record that is not newer than
+        # the checkpoint. Without a checkpoint (first run) only the latest page is read, not the whole history.
+        page = 1
+        while True:
+            # a page the API refused is empty, there is nothing to read past it
+            records = get_page(page) or []
+            for record in records:
+                parsed = parse(record)
+                if checkpoint is not None and parsed[time_key] <= checkpoint:
+                    return
+                yield parsed
+            if checkpoint is None or len(records) < self.page_size:
+                return
+            page += 1
+
     def get_parsed_entitlement_info(self):
         token_count = -1
         bandwidth_total = -1
@@ -275,58 +341,116 @@ class CloudsmithCheck(AgentCheck):
         }
         return usage_info
 
-    def get_parsed_audit_log_info(self):
-        response_json = self.get_audit_log_info()
-
-        new_dict = []
-
-        if len(response_json) == 0:
-            self.log.warning("Error when parsing JSON for audit log information")
-        else:
-            for i in response_json:
-                new_dict.append(
-                    {
-                        "actor": i["actor"],
-                        "actor_kind": i["actor_kind"],
-                        "city": i["actor_location"]["city"],
-                        "event": i["event"],
-                        "event_at": self.convert_time(i["event_at"]),
-                        "object": i["object"],
-                        "object_slug_perm": i["object_slug_perm"],
-                    }
-                )
-
-        return new_dict
-
-    def filter_vulnerabilities(self, response_json, severity_list):
-        filtered_results = []
-        for result in response_json:
-            if "max_severity" in result and result["max_severity"] in severity_list:
-                filtered_results.append(result)
-                response_json = filtered_results
-        return response_json
+    def parse_audit_log(self, i):
+        return {
+            "actor": i["actor"],
+            "actor_kind": i["actor_kind"],
+            "city": i["actor_location"]["city"],
+            "event": i["event"],
+            "event_at": self.convert_time(i["event_at"]),
+            "object": i["object"],
+            "object_slug_perm": i["object_slug_perm"],
+        }
 
-    def get_parsed_vulnerabilities_info(self):
-        # only show high or critical vulnerabilities
-        response_json = self.filter_vulnerabilities(self.get_vulnerabilities_info(), ["High", "Critical"])
+    def parse_vulnerability(self, i):
+        return {
+            "package_name": i["package"]["name"],
+            "package_version": i["package"]["version"],
+            "package_url": i["package"]["url"],
+            "severity": i.get("max_severity"),
+            "num_vulnerabilities": i["num_vulnerabilities"],
+            "created_at": self.convert_time(i["created_at"]),
+        }
 
-        new_dict = []
-        if len(response_json) == 0:
-            self.log.warning("Error when parsing JSON for vulnerabilities information")
+    def get_new_audit_log_events(self):
+        # only create an event for records newer than the checkpoint of the previous run
+        checkpoint = self.get_checkpoint(AUDIT_LOG_CHECKPOINT)
+        newest = checkpoint
+        events = []
+        for a in self.iter_new_records(self.get_audit_log_info, self.parse_audit_log, "event_at", checkpoint):
+            newest = max(newest or 0, a["event_at"])
+            events.append(
+                {
+                    "timestamp": int(a["event_at"]),
+                    "event_type": "audit logs",
+                    "api_key": self.api_key,
+                    "msg_title": "{} on Object: {} (Object Slug: {}".format(
+                        a["event"], a["object"], a["object_slug_perm"]
+                    ),
+                    "msg_text": "Actor: {} ({}) from {}".format(a["actor"], a["actor_kind"], a["city"]),
+                    "aggregation_key": "audit_log",
+                    "tags": self.tags,
+                }
+            )
+        return AUDIT_LOG_CHECKPOINT, events, newest
+
+    def get_new_vulnerability_events(self):
+        checkpoint = self.get_checkpoint(VULNERABILITY_CHECKPOINT)
+        newest = checkpoint
+        events = []
+        for v in self.iter_new_records(
+            self.get_vulnerabilities_info, self.parse_vulnerability, "created_at", checkpoint
+        ):
+            newest = max(newest or 0, v["created_at"])
+            # only show high or critical vulnerabilities
+            if v["severity"] not in VULNERABILITY_SEVERITIES:
+                continue
+            events.append(
+                {
+                    "timestamp": int(v["created_at"]),
+                    "event_type": "vulnerabilities",
+                    "api_key": self.api_key,
+                    "msg_title": "{} vulnerability found in package: {} Version: {}".format(
+                        v["severity"], v["package_name"], v["package_version"]
+                    ),
+                    "msg_text": "Number of vulnerabilities: {}. Package URL: {}".format(
+                        v["num_vulnerabilities"], v["package_url"]
+                    ),
+                    "aggregation_key": "vulnerabilities",
+                    "tags": self.tags,
+                }
+            )
+        return VULNERABILITY_CHECKPOINT, events, newest
+
+    def submit_new_events(self, new_events):
+        checkpoint_key, events, checkpoint = new_events
+        for event in events:
+            self.event(event)
+        if checkpoint is not None:
+            self.set_checkpoint(checkpoint_key, checkpoint)
+
+    def get_due_endpoint_groups(self, now):
+        return [group for group in ENDPOINT_INTERVALS if now >= self.next_run[group]]
+
+    def schedule(self, group, now, error=None):
+        if isinstance(error, RateLimitedError):
+            # exponential backoff, unless the API told when to come back
+            self.rate_limited_count[group] += 1
+            backoff = max(self.intervals[group], 60) * 2 ** (self.rate_limited_count[group] - 1)
+            delay = error.retry_after if error.retry_after is not None else min(backoff, MAX_BACKOFF)
+            self.log.warning("Collection of %s is rate limited, retrying in %s seconds", group, delay)
         else:
-            for i in response_json:
-                new_dict.append(
-                    {
-                        "package_name": i["package"]["name"],
-                        "package_version": i["package"]["version"],
-                        "package_url": i["package"]["url"],
-                        "severity": i["max_severity"],
-                        "num_vulnerabilities": i["num_vulnerabilities"],
-                        "created_at": self.convert_time(i["created_at"]),
-                    }
-                )
-
-        return new_dict
+            self.rate_limited_count[group] = 0
+            delay = self.intervals[group]
+        self.next_run[group] = now + delay
+
+    def collect_endpoint_groups(self, groups):
+        # endpoint groups are independent of each other, fetch them concurrently
+        fetchers = {
+            "usage": self.get_parsed_usage_info,
+            "entitlements": self.get_parsed_entitlement_info,
+            "audit_log": self.get_new_audit_log_events,
+            "vulnerabilities": self.get_new_vulnerability_events,
+        }
+        if not groups:
+            return {}
+        with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+            futures = {group: executor.submit(fetchers[group]) for group in groups}
+        results = {}
+        for group, future in futures.items():
+            error = future.exception()
+            results[group] = future.result() if error is None else error
+        return results
 
     def check(self, _):
 
@@ -345,49 +469,29 @@ class CloudsmithCheck(AgentCheck):
             "token_download_total": -1,
         }
 
-        audit_log_info = [
-            {
-                "actor": CloudsmithCheck.UNKNOWN,
-                "actor_kind": CloudsmithCheck.UNKNOWN,
-                "city": CloudsmithCheck.UNKNOWN,
-                "event": CloudsmithCheck.UNKNOWN,
-                "event_at": -1,
-                "object": CloudsmithCheck.UNKNOWN,
-                "object_slug_perm": CloudsmithCheck.UNKNOWN,
-            }
-        ]
-
-        vulnerabilities_info = [
-            {
-                "package_name": CloudsmithCheck.UNKNOWN,
-                "package_version": CloudsmithCheck.UNKNOWN,
-                "package_url": CloudsmithCheck.UNKNOWN,
-                "severity": CloudsmithCheck.UNKNOWN,
-                "num_vulnerabilities": -1,
-                "created_at": -1,
-            }
-        ]
-
-        global LAST_AUDIT_LOG_STAMP
-        global LAST_VULNERABILITY_STAMP
-        global AUDIT_LOG_LAST_RUN
-        global VULNERABILITY_LAST_RUN
-
-        usage_info = self.get_parsed_usage_info()
-        entitlement_info = self.get_parsed_entitlement_info()
-
-        # Only run audit log and vulnerability checks if the last check was more than 5 minutes ago
-        # This will prevent the check from running too often and hitting the rate limit
-
-        if (time.time() - AUDIT_LOG_LAST_RUN) > 300:
-            audit_log_info = self.get_parsed_audit_log_info()
-            AUDIT_LOG_LAST_RUN = time.time()
-
-        if (time.time() - VULNERABILITY_LAST_RUN) > 300:
-            vulnerabilities_info = self.get_parsed_vulnerabilities_info()
-            VULNERABILITY_LAST_RUN = time.time()
-
-        vulnerabilities_info = self.get_parsed_vulnerabilities_info()
+        # Each endpoint group is only collected once its own interval has elapsed, with a backoff
+        # when the API rate limits it. This prevents the check from hitting the rate limit.
+        now = time.time()
+        error = None
+        for group, result in self.collect_endpoint_groups(self.get_due_endpoint_groups(now)).items():
+            if isinstance(result, RateLimitedError):
+                self.schedule(group, now, result)
+                continue
+            if isinstance(result, Exception):
+                # retried on the next run
+                error = error or result
+                continue
+            self.schedule(group, now)
+            if group in ("audit_log", "vulnerabilities"):
+                self.submit_new_events(result)
+            else:
+                self.results[group] = result
+        if error is not None:
+            raise error
+
+        # usage and entitlements not collected on this run are reported from their last collection
+        usage_info = self.results.get("usage", usage_info)
+        entitlement_info = self.results.get("entitlements", entitlement_info)
 
         # This is how you submit metrics
         # There are different types of metrics that you can submit (gauge, event).
@@ -407,47 +511,6 @@ class CloudsmithCheck(AgentCheck):
             tags=self.tags,
         )
 
-        # only create an event if the timestamp is newer than the last event
-        # this is to prevent duplicate events as we pull down the entire audit log
-
-        if LAST_AUDIT_LOG_STAMP < audit_log_info[0]["event_at"]:
-            for a in audit_log_info:
-                if a["event_at"] > LAST_AUDIT_LOG_STAMP:
-                    self.event(
-                        {
-                            "timestamp": a["event_at"],
-                            "event_type": "audit logs",
-                            "api_key": self.api_key,
-                            "msg_title": "{} on Object: {} (Object Slug: {}".format(
-                                a["event"], a["object"], a["object_slug_perm"]
-                            ),
-                            "msg_text": "Actor: {} ({}) from {}".format(a["actor"], a["actor_kind"], a["city"]),
-                            "aggregation_key": "audit_log",
-                            "tags": self.tags,
-                        }
-                    )
-            LAST_AUDIT_LOG_STAMP = audit_log_info[0]["event_at"]
-
-        if LAST_VULNERABILITY_STAMP < vulnerabilities_info[0]["created_at"]:
-            for v in vulnerabilities_info:
-                if v["created_at"] > LAST_VULNERABILITY_STAMP:
-                    self.event(
-                        {
-                            "timestamp": v["created_at"],
-                            "event_type": "vulnerabilities",
-                            "api_key": self.api_key,
-                            "msg_title": "{} vulnerability found in package: {} Version: {}".format(
-                                v["severity"], v["package_name"], v["package_version"]
-                            ),
-                            "msg_text": "Number of vulnerabilities: {}. Package URL: {}".format(
-                                v["num_vulnerabilities"], v["package_url"]
-                            ),
-                            "aggregation_key": "vulnerabilities",
-                            "tags": self.tags,
-                        }
-                    )
-            LAST_VULNERABILITY_STAMP = vulnerabilities_info[0]["created_at"]
-
         storage_msg = "Percentage storage used: {}%".format(usage_info["storage_used"])
         self.service_check(
             "storage",
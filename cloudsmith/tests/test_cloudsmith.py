@@ -1,8 +1,10 @@
+import mock
 import pytest
 from mock import MagicMock
 
 from datadog_checks.base import ConfigurationError
 from datadog_checks.cloudsmith import CloudsmithCheck
+from datadog_checks.cloudsmith.check import RateLimitedError
 from datadog_checks.dev.utils import get_metadata_metrics
 
 
@@ -36,12 +38,14 @@ def test_check(
     usage_resp_good,
     entitlements_test_json,
     audit_log_resp_good,
+    vulnerabilitiy_resp_json,
 ):
 
     check = CloudsmithCheck('cloudsmith', {}, [instance_good])
     check.get_usage_info = MagicMock(return_value=usage_resp_good)
     check.get_entitlement_info = MagicMock(return_value=entitlements_test_json)
     check.get_audit_log_info = MagicMock(return_value=audit_log_resp_good)
+    check.get_vulnerabilities_info = MagicMock(return_value=vulnerabilitiy_resp_json)
 
     check.check(None)
 
@@ -58,6 +62,8 @@ def test_check(
 
 def test_check_bad_usage(aggregator, instance_good, usage_resp_warning, usage_resp_critical, entitlements_test_json):
     check = CloudsmithCheck('cloudsmith', {}, [instance_good])
+    check.get_new_audit_log_events = MagicMock(return_value=("audit_log_checkpoint", [], None))
+    check.get_new_vulnerability_events = MagicMock(return_value=("vulnerability_checkpoint", [], None))
 
     # Check for usage warning
     check.get_usage_info = MagicMock(return_value=usage_resp_warning)
@@ -81,6 +87,8 @@ def test_check_bad_usage(aggregator, instance_good, usage_resp_warning, usage_re
 
 def test_check_badly_formatted_json(aggregator, instance_good, entitlements_test_bad_json, usage_resp_bad_json):
     check = CloudsmithCheck('cloudsmith', {}, [instance_good])
+    check.get_new_audit_log_events = MagicMock(return_value=("audit_log_checkpoint", [], None))
+    check.get_new_vulnerability_events = MagicMock(return_value=("vulnerability_checkpoint", [], None))
 
     # Check for results if json usage doesn't have the expected keys
     check.get_usage_info = MagicMock(return_value=usage_resp_bad_json)
@@ -94,3 +102,170 @@ def test_check_badly_formatted_json(aggregator, instance_good, entitlements_test
     aggregator.assert_metric("cloudsmith.token_bandwidth_total", -1, count=1)
     aggregator.assert_metric("cloudsmith.token_count", -1, count=1)
     aggregator.assert_metric("cloudsmith.token_download_total", -1, count=1)
+
+
+def _audit_log_record(event_at):
+    return {
+        "actor": "test user",
+        "actor_kind": "user",
+        "actor_location": {"city": "XXX"},
+        "event": "action.login",
+        "event_at": event_at,
+        "object": "test",
+        "object_slug_perm": "msle0eeRYz0",
+    }
+
+
+@pytest.mark.unit
+def test_audit_log_checkpoint(aggregator, datadog_agent, instance_good):
+    instance_good['page_size'] = 2
+    check = CloudsmithCheck('cloudsmith', {}, [instance_good])
+    check.get_audit_log_info = MagicMock(
+        return_value=[
+            _audit_log_record("2023-01-10T12:00:02.000000Z"),
+            _audit_log_record("2023-01-10T12:00:01.000000Z"),
+        ]
+    )
+
+    # without checkpoint only the latest page is read
+    check.submit_new_events(check.get_new_audit_log_events())
+    check.get_audit_log_info.assert_called_once_with(1)
+    assert len(aggregator.events) == 2
+
+    # the checkpoint survives a restart, only new records are requested
+    aggregator.reset()
+    pages = {
+        1: [_audit_log_record("2023-01-10T12:00:05.000000Z"), _audit_log_record("2023-01-10T12:00:04.000000Z")],
+        2: [_audit_log_record("2023-01-10T12:00:03.000000Z"), _audit_log_record("2023-01-10T12:00:02.000000Z")],
+        3: [_audit_log_record("2023-01-10T12:00:01.000000Z")],
+    }
+    check = CloudsmithCheck('cloudsmith', {}, [instance_good])
+    check.get_audit_log_info = MagicMock(side_effect=pages.get)
+    check.submit_new_events(check.get_new_audit_log_events())
+    assert [call[0][0] for call in check.get_audit_log_info.call_args_list] == [1, 2]
+    assert [event['timestamp'] for event in aggregator.events] == [
+        int(check.convert_time("2023-01-10T12:00:05.000000Z")),
+        int(check.convert_time("2023-01-10T12:00:04.000000Z")),
+        int(check.convert_time("2023-01-10T12:00:03.000000Z")),
+    ]
+
+    # nothing new
+    aggregator.reset()
+    check.get_audit_log_info = MagicMock(side_effect=pages.get)
+    check.submit_new_events(check.get_new_audit_log_events())
+    check.get_audit_log_info.assert_called_once_with(1)
+    assert len(aggregator.events) == 0
+
+    # a record logged in the same second as the checkpoint is still new
+    pages[1].insert(0, _audit_log_record("2023-01-10T12:00:05.250000Z"))
+    check.get_audit_log_info = MagicMock(side_effect=pages.get)
+    check.submit_new_events(check.get_new_audit_log_events())
+    assert len(aggregator.events) == 1
+    assert check.get_checkpoint("audit_log_checkpoint") == check.convert_time("2023-01-10T12:00:05.250000Z")
+
+
+@pytest.mark.unit
+def test_audit_log_refused_page(aggregator, datadog_agent, instance_good):
+    instance_good['page_size'] = 1
+    check = CloudsmithCheck('cloudsmith', {}, [instance_good])
+    check.set_checkpoint("audit_log_checkpoint", check.convert_time("2023-01-10T12:00:01.000000Z"))
+    # get_api_json returns None when the API answers 401 for the following pages
+    pages = {1: [_audit_log_record("2023-01-10T12:00:02.000000Z")], 2: None}
+    check.get_audit_log_info = MagicMock(side_effect=pages.get)
+
+    check.submit_new_events(check.get_new_audit_log_events())
+    assert [call[0][0] for call in check.get_audit_log_info.call_args_list] == [1, 2]
+    assert len(aggregator.events) == 1
+
+
+@pytest.mark.unit
+def test_vulnerability_checkpoint(aggregator, datadog_agent, instance_good, vulnerabilitiy_resp_json):
+    check = CloudsmithCheck('cloudsmith', {}, [instance_good])
+    medium = dict(vulnerabilitiy_resp_json[0], created_at="2023-03-06T18:18:39.546636Z", max_severity="Medium")
+    check.get_vulnerabilities_info = MagicMock(return_value=[medium] + vulnerabilitiy_resp_json)
+
+    check.submit_new_events(check.get_new_vulnerability_events())
+    assert len(aggregator.events) == 2
+
+    # the checkpoint also moves past filtered out records
+    aggregator.reset()
+    check.submit_new_events(check.get_new_vulnerability_events())
+    assert len(aggregator.events) == 0
+    assert check.get_checkpoint("vulnerability_checkpoint") == check.convert_time(medium["created_at"])
+
+
+@pytest.mark.unit
+def test_page_size_invalid(instance_good):
+    instance_good['page_size'] = 0
+    with pytest.raises(ConfigurationError):
+        CloudsmithCheck('cloudsmith', {}, [instance_good])
+
+
+@pytest.mark.unit
+def test_endpoint_intervals(aggregator, instance_good, usage_resp_good, entitlements_test_json):
+    instance_good['entitlements_interval'] = 600
+    check = CloudsmithCheck('cloudsmith', {}, [instance_good])
+    check.get_usage_info = MagicMock(return_value=usage_resp_good)
+    check.get_entitlement_info = MagicMock(return_value=entitlements_test_json)
+    check.get_new_audit_log_events = MagicMock(return_value=("audit_log_checkpoint", [], None))
+    check.get_new_vulnerability_events = MagicMock(return_value=("vulnerability_checkpoint", [], None))
+
+    with mock.patch('datadog_checks.cloudsmith.check.time.time', return_value=1000):
+        check.check(None)
+    with mock.patch('datadog_checks.cloudsmith.check.time.time', return_value=1200):
+        check.check(None)
+
+    assert check.get_usage_info.call_count == 2
+    assert check.get_entitlement_info.call_count == 1
+    assert check.get_new_audit_log_events.call_count == 1
+    assert check.get_new_vulnerability_events.call_count == 1
+    # entitlements are reported from their last collection in between
+    aggregator.assert_metric("cloudsmith.token_count", 119, count=2)
+
+    with mock.patch('datadog_checks.cloudsmith.check.time.time', return_value=1600):
+        check.check(None)
+    assert check.get_entitlement_info.call_count == 2
+    assert check.get_new_audit_log_events.call_count == 2
+
+
+@pytest.mark.unit
+def test_rate_limit_backoff(aggregator, instance_good, usage_resp_good, entitlements_test_json):
+    check = CloudsmithCheck('cloudsmith', {}, [instance_good])
+    check.get_usage_info = MagicMock(return_value=usage_resp_good)
+    check.get_entitlement_info = MagicMock(return_value=entitlements_test_json)
+    check.get_new_audit_log_events = MagicMock(side_effect=RateLimitedError("rate limited"))
+    check.get_new_vulnerability_events = MagicMock(side_effect=RateLimitedError("rate limited", retry_after=30))
+
+    with mock.patch('datadog_checks.cloudsmith.check.time.time', return_value=1000):
+        check.check(None)
+        check.next_run['audit_log'] = 1000
+        check.check(None)
+
+    # rate limited groups do not fail the check run
+    aggregator.assert_metric("cloudsmith.storage_used", 0.914, count=2)
+    assert check.next_run['audit_log'] == 1000 + 600
+    assert check.next_run['vulnerabilities'] == 1000 + 30
+
+    check.get_new_audit_log_events = MagicMock(return_value=("audit_log_checkpoint", [], None))
+    with mock.patch('datadog_checks.cloudsmith.check.time.time', return_value=1600):
+        check.check(None)
+    assert check.next_run['audit_log'] == 1600 + 300
+    assert check.rate_limited_count['audit_log'] == 0
+
+
+@pytest.mark.unit
+def test_rate_limited_response(aggregator, instance_good):
+    check = CloudsmithCheck('cloudsmith', {}, [instance_good])
+    response = MagicMock(status_code=429, headers={'Retry-After': '120'})
+    with mock.patch('datadog_checks.base.utils.http.RequestsWrapper.get', return_value=response):
+        with pytest.raises(RateLimitedError) as e:
+            check.get_usage_info()
+    assert e.value.retry_after == 120
+    aggregator.assert_service_check('cloudsmith.can_connect', CloudsmithCheck.WARNING)
+
+
+@pytest.mark.unit
+def test_interval_invalid(instance_good):
+    instance_good['usage_interval'] = -1
+    with pytest.raises(ConfigurationError):
+        CloudsmithCheck('cloudsmith', {}, [instance_good])
@@ -1,19 +1,36 @@
 # (C) Calastone Ltd. 2018
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
-import copy
 import datetime
-import fnmatch
 import re
-from collections import defaultdict
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
 import requests
 
 from datadog_checks.base import AgentCheck
 from datadog_checks.base.errors import CheckException
 
+from .json_path import MISSING, JsonPathIndex
 from .metrics import ALL_METRICS
 
+TIMEDELTA_RE = re.compile(r'^(\d+):(\d\d):(\d\d):(\d\d).(\d+)$')
+
+
+class CompiledMetric(object):
+    """A metric definition prepared once: its value converter, submission method and tag templates"""
+
+    __slots__ = ('json_path', 'metric_name', 'metric_type', 'convert', 'submit', 'tags')
+
+    def __init__(self, json_path, metric_name, metric_type, convert, submit, tags):
+        self.json_path = json_path
+        self.metric_name = metric_name
+        self.metric_type = metric_type
+        self.convert = convert
+        self.submit = submit
+        # list of (tag name or None to derive it from the path, split tag path, index of its wildcard or None)
+        self.tags = tags
+
 
 class EventStoreCheck(AgentCheck):
 
@@ -30,6 +47,14 @@ class EventStoreCheck(AgentCheck):
         },
     }
 
+    def __init__(self, *args, **kwargs):
+        super(EventStoreCheck, self).__init__(*args, **kwargs)
+        # endpoint -> compiled metric definitions, reused across runs
+        self.metric_plans = {
+            endpoint: self.compile_metrics(metrics)
+            for endpoint, metrics in self.init_config.get('metric_definitions', ALL_METRICS).items()
+        }
+
     def check(self, instance):
         """Main method"""
         endpoints_def = instance.get('endpoints')
@@ -38,21 +63,79 @@ class EventStoreCheck(AgentCheck):
         if not isinstance(endpoints_def, (list, tuple)):
             raise CheckException('Incorrect value specified for the list of metric endpoints')
 
-        metric_def = self.init_config.get('metric_definitions', ALL_METRICS)
         for endpoint in endpoints_def:
-            metrics = metric_def.get(endpoint)
-            if metrics is None:
+            if endpoint not in self.metric_plans:
                 raise CheckException('Unknown metric endpoint: {}'.format(endpoint))
-            self.check_endpoint(instance, endpoint, metrics)
 
-    def check_endpoint(self, instance, endpoint, metrics):
-        """Process metrics from an API endpoint"""
-        base_url = instance.get('url', '')
-        url = base_url + endpoint
-        tag_by_url = instance.get('tag_by_url', False)
-        name_tag = instance.get('name', url)
-        metric_def = copy.deepcopy(metrics)
+        # Fetch every endpoint first, a failing or slow endpoint does not prevent the others from being processed
+        errors = []
+        for endpoint, (parsed_api, error) in zip(endpoints_def, self.fetch_endpoints(instance, endpoints_def)):
+            if error is not None:
+                self.log.warning('Unable to collect metrics from endpoint %s: %s', endpoint, error)
+                errors.append(error)
+                continue
+            self.check_endpoint(instance, endpoint, self.metric_plans[endpoint], parsed_api)
+        if errors:
+            raise errors[0]
+
+    def fetch_endpoints(self, instance, endpoints):
+        """Fetch the payloads of all the endpoints concurrently, returns a (payload, error) pair per endpoint"""
+
+        def fetch(endpoint):
+            try:
+                return self.fetch_endpoint(instance, endpoint), None
+            except CheckException as e:
+                return None, e
+
+        pool = ThreadPool(len(endpoints))
+        try:
+            return pool.map(fetch, endpoints)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def compile_metrics(self, metrics):
+        """Prepare the metric definitions of an endpoint"""
+        return [self.compile_metric(metric) for metric in metrics]
+
+    def compile_metric(self, metric):
+        json_path = metric.get('json_path', '')
+        tags = []
+        for tag in metric.get('tag_by', {}):
+            tag_name = None
+            if ':' in tag:
+                # example: projection:projections.*.effectiveName
+                tag_name, tag = tag.rsplit(':', 1)
+            elif '*' not in tag.split('.')[-1]:
+                # example: projections.*.effectiveName
+                tag_name = self.format_tag(tag.split('.')[-1])
+            tag_split = tag.split('.')
+            wildcard_index = tag_split.index('*') if '*' in tag_split else None
+            tags.append((tag_name, tag_split, wildcard_index))
 
+        submit = {'gauge': self.gauge, 'histogram': self.histogram}.get(metric['metric_type'])
+        return CompiledMetric(
+            json_path, metric['metric_name'], metric['metric_type'], self.get_converter(metric), submit, tags
+        )
+
+    def get_converter(self, metric):
+        """Returns the function formatting a raw value as specified by the metric"""
+        data_type = metric['json_type']
+        if data_type == 'float':
+            return self.convert_float
+        elif data_type == 'int':
+            return self.convert_int
+        elif data_type == 'datetime':
+            return self.convert_datetime
+        elif data_type == 'str':
+            return self.get_str_converter(metric)
+        elif data_type == 'bool':
+            return self.convert_bool
+        return self.convert_none
+
+    def fetch_endpoint(self, instance, endpoint):
+        """Returns the deserialized payload of an API endpoint"""
+        url = instance.get('url', '') + endpoint
         try:
             r = self.http.get(url)
         except requests.exceptions.Timeout:
@@ -69,72 +152,73 @@ class EventStoreCheck(AgentCheck):
             parsed_api = r.json()
         except Exception as e:
             raise CheckException('{} returned an unserializable payload: {}'.format(url, e))
+        return parsed_api
+
+    def check_endpoint(self, instance, endpoint, metrics, parsed_api):
+        """Process metrics from an API endpoint"""
+        base_url = instance.get('url', '')
+        url = base_url + endpoint
+        tag_by_url = instance.get('tag_by_url', False)
+        name_tag = instance.get('name', url)
 
         eventstore_paths = self.walk(parsed_api)
-        self.log.debug("Event Store Paths:")
-        self.log.debug(eventstore_paths)
-
-        # Flatten the self.init_config definitions into valid metric definitions
-        metric_definitions = defaultdict(list)
-        for metric in metric_def:
-            self.log.debug("metric %s", metric)
-            json_path = metric.get('json_path', '')
-            self.log.debug("json_path %s", json_path)
-            tags = metric.get('tag_by', {})
-            self.log.debug("tags %s", tags)
-            paths = self.get_json_path(json_path, eventstore_paths)
-            self.log.debug("paths %s", paths)
-
-            for path in paths:
-                # Deep copy needed else it will overwrite previous metric data
-                metric_builder = copy.deepcopy(metric)
-                metric_builder['json_path'] = path
-                tag_builder = []
-                if tag_by_url:
-                    tag_builder.append('instance:{}'.format(url))
-                tag_builder.append('name:{}'.format(name_tag))
-                for tag in tags:
-                    if ':' in tag:
-                        # example: projection:projections.*.effectiveName
-                        tag_name, tag = tag.rsplit(':', 1)
-                        tag_path = self.get_tag_path(tag, path, eventstore_paths)
-                    else:
-                        # example: projections.*.effectiveName
-                        tag_path = self.get_tag_path(tag, path, eventstore_paths)
-                        tag_name = self.format_tag(tag_path.split('.')[-1])
-                    tag_value = self.get_value(parsed_api, tag_path)
-                    tag_builder.append('{}:{}'.format(tag_name, tag_value))
-                metric_builder['tag_by'] = tag_builder
-                metric_definitions[path].append(metric_builder)
+        self.log.debug("Event Store Paths: %s", eventstore_paths.paths)
+
+        base_tags = []
+        if tag_by_url:
+            base_tags.append('instance:{}'.format(url))
+        base_tags.append('name:{}'.format(name_tag))
 
         # Find metrics to check:
-        metrics_to_check = {}
+        paths_to_check = OrderedDict()
         for metric in instance['json_path']:
-            self.log.debug("metric: %s", metric)
-            paths = self.get_json_path(metric, eventstore_paths)
-            self.log.debug("paths: %s", paths)
-            for path in paths:
-                self.log.debug("path: %s", path)
-                try:
-                    metrics_to_check[path] = metric_definitions[path]
-                    self.log.debug("metrics_to_check: %s", metric_definitions[path])
-                except KeyError:
-                    self.log.info("Skipping metric: %s as it is not defined", path)
+            for path in self.get_json_path(metric, eventstore_paths):
+                paths_to_check[path] = []
+
+        # Attach the metric definitions to the paths to check
+        for metric in metrics:
+            for path in self.get_json_path(metric.json_path, eventstore_paths):
+                if path in paths_to_check:
+                    tags = base_tags + self.get_tags(metric, path, eventstore_paths)
+                    paths_to_check[path].append((metric, tags))
 
         # Now we need to get the metrics from the endpoint
         # Get the value for a given key
-        self.log.debug("parsed_api:")
-        self.log.debug(parsed_api)
-        for path, metrics in metrics_to_check.items():
-            raw_value = self.get_value(parsed_api, path)
-            for metric in metrics:
-                metric_value = self.convert_value(raw_value, metric)
+        for path, path_metrics in paths_to_check.items():
+            if not path_metrics:
+                continue
+            raw_value = self.get_value(eventstore_paths, path)
+            for metric, tags in path_metrics:
+                metric_value = metric.convert(raw_value)
                 if metric_value is not None:
-                    self.dispatch_metric(metric_value, metric)
+                    self.dispatch_metric(metric_value, metric, tags)
                 else:
-                    # self.dispatch_metric(0, metric)
                     self.log.debug("Metric %s did not return a value, skipping", path)
 
+    def get_tags(self, metric, path, eventstore_paths):
+        """Resolve the tag templates of a metric for one of its paths"""
+        tags = []
+        path_split = None
+        for tag_name, tag_split, wildcard_index in metric.tags:
+            if wildcard_index is not None:
+                # the wildcard of the tag takes the value of the same segment of the metric path
+                if path_split is None:
+                    path_split = path.split('.')
+                tag_split = list(tag_split)
+                try:
+                    tag_split[wildcard_index] = path_split[wildcard_index]
+                except IndexError:
+                    pass
+            tag_paths = self.get_json_path('.'.join(tag_split), eventstore_paths)
+            if not tag_paths:
+                self.log.warning('No tag value found for %s, path %s', '.'.join(tag_split), path)
+                continue
+            tag_path = tag_paths[0]
+            if tag_name is None:
+                tag_name = self.format_tag(tag_path.split('.')[-1])
+            tags.append('{}:{}'.format(tag_name, self.get_value(eventstore_paths, tag_path)))
+        return tags
+
     @classmethod
     def format_tag(cls, name):
         """Converts the string to snake case from camel case"""
@@ -142,126 +226,57 @@ class EventStoreCheck(AgentCheck):
         s1 = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
         return re.sub('([a-z0-9])([A-Z])', r'\1_\2', s1).lower()
 
-    def walk(self, json_obj, p=None, es_paths=None):
-        """Walk a JSON tree and return the json paths in a list"""
-        if p is None:
-            p = []
-        if es_paths is None:
-            es_paths = []
-
-        if isinstance(json_obj, list):
-            json_obj = {str(k): v for k, v in enumerate(json_obj)}
-
-        for key, value in json_obj.items():
-            if isinstance(value, (dict, list)):
-                # We add the instance to the path global variable to build up a map
-                p.append(key)
-                self.walk(value, p, es_paths)
-                # Once we have finished with this path we remove it from the global variable
-                p.pop()
-            else:
-                p.append(key)
-                tmp = "{}".format(".".join(p))
-                p.pop()
-                # Add the full key name to the "flat" global variable
-                if tmp not in es_paths:
-                    es_paths.append(tmp)
-        return es_paths
-
-    def get_tag_path(self, tag, metric_json_path, eventstore_paths):
-        """Returns the paths for the given tags"""
-        # This function will return the tag as a validated path,
-        # if the tag has a wildcard it will return
-        try:
-            # Wildcard
-            tag_split = tag.split('.')
-            wildcard_index = tag.split('.').index('*')
-            json_path_split = metric_json_path.split('.')
-            tag_split[wildcard_index] = json_path_split[wildcard_index]
-            tag_path = '.'.join(tag_split)
-            return self.get_json_path(tag_path, eventstore_paths)[0]
-        except ValueError:
-            # No wildcard
-            return self.get_json_path(tag, eventstore_paths)[0]
-        except IndexError:
-            self.log.warning('No tag value found for %s, path %s', tag, metric_json_path)
+    def walk(self, json_obj):
+        """Walk a JSON tree and return the index of its json paths"""
+        return JsonPathIndex(json_obj)
 
     def get_json_path(self, json_path, eventstore_paths):
         """Find all the possible keys for a given path"""
-        self.log.debug("json paths: %s", json_path)
-        self.log.debug("eventstore_paths: %s", eventstore_paths)
-        response = []
-        self.log.debug("response: %s", response)
-        try:
-            match = eventstore_paths.index(json_path)
-            self.log.debug("match: %s", match)
-            if match is not None:
-                response.append(json_path)
-                self.log.debug("match json path: %s", json_path)
-        except ValueError:
-            # Loop through all possible keys to find matches
-            # Value Error means it didn't find it, so it must be
-            # a wildcard
-            self.log.debug("value error")
-            for path in eventstore_paths:
-                self.log.debug("path: %s", path)
-                match = fnmatch.fnmatch(path, json_path)
-                self.log.debug("match ve: %s", match)
-                if match:
-                    response.append(path)
-                    self.log.debug("path ve: %s", path)
+        response = eventstore_paths.find(json_path)
+        self.log.debug("json path: %s, response: %s", json_path, response)
         return response
 
     # Fill out eventstore_paths using walk of json
 
-    def get_value(self, json_obj, metric_path, index=0):
+    def get_value(self, eventstore_paths, metric_path):
         """Returns the value for the supplied metric path"""
-        split = metric_path.split('.')
-        key = split[index]
-        if isinstance(json_obj, list):
-            json_obj = {str(k): v for k, v in enumerate(json_obj)}
-        try:
-            v = json_obj[key]
-            if isinstance(v, (dict, list)):
-                index += 1
-                v = self.get_value(v, metric_path, index=index)
-            else:
-                v = str(v)
-            if len(v) == 0:
-                v = 'N/A'
-            return v
-        except KeyError:
+        value = eventstore_paths.get(metric_path, MISSING)
+        if value is MISSING or isinstance(value, (dict, list)):
             self.log.info('No value found for Metric: %s', metric_path)
+            return None
+        # null leaves are converted like the other values, from their str
+        value = str(value)
+        if len(value) == 0:
+            value = 'N/A'
+        return value
 
-    def convert_value(self, value, metric):
-        """Returns the metric formatted in the specified value"""
-        data_type = metric['json_type']
-        v = None
-        if data_type == 'float':
-            try:
-                v = float(value)
-            except ValueError:
-                v = None
-        elif data_type == 'int':
-            try:
-                v = int(value)
-            except ValueError:
-                v = None
-        elif data_type == 'datetime':
-            dt = self.convert_to_timedelta(value)
-            if dt:
-                v = float(dt.total_seconds())
-            else:
-                v = float(0)
-            # Convert to MS
-        elif data_type == 'str':
-            v = self.convert_str_to_gauge(value, metric)
-        elif data_type == 'bool':
-            v = 1 if value else 0
-        return v
+    def convert_float(self, value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    def convert_int(self, value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    def convert_datetime(self, value):
+        # Converted to seconds
+        dt = self.convert_to_timedelta(value)
+        if dt:
+            return float(dt.total_seconds())
+        return float(0)
+
+    def convert_bool(self, value):
+        return 1 if value else 0
+
+    def convert_none(self, value):
+        return None
 
-    def convert_str_to_gauge(self, value, metric):
-        v = None
+    def get_str_converter(self, metric):
+        """Returns the function converting the str metric to a gauge, checked against a set built once"""
         match = metric.get('match')
         mismatch = metric.get('mismatch')
         if match and mismatch:
@@ -270,32 +285,31 @@ class EventStoreCheck(AgentCheck):
                 metric['json_path'],
                 metric['metric_name'],
             )
+            return self.convert_none
         elif not match and not mismatch:
             self.log.info(
                 'Match or mismatch should be specified to convert the str metric to a gauge for: %s %s',
                 metric['json_path'],
                 metric['metric_name'],
             )
+            return self.convert_none
+
+        checklist = match or mismatch
+        if isinstance(checklist, (frozenset, list, set, tuple)):
+            checklist = frozenset(checklist)
         else:
-            checklist = match or mismatch
-            if isinstance(checklist, (frozenset, list, set, tuple)):
-                checklist = frozenset(checklist)
-            else:
-                checklist = frozenset((checklist,))
-            if match:
-                v = 1 if value in checklist else 0
-            elif mismatch:
-                v = 0 if value in checklist else 1
-        return v
+            checklist = frozenset((checklist,))
+        if match:
+            return lambda value: 1 if value in checklist else 0
+        return lambda value: 0 if value in checklist else 1
 
     def convert_to_timedelta(self, string):
         """
         Returns a time delta for strings in a format of: 0:00:00:00.0000
         Using RegEx to not introduce a dependency on another package
         """
-        dt_re = re.compile(r'^(\d+):(\d\d):(\d\d):(\d\d).(\d+)$')
-        tmp = dt_re.match(string)
         try:
+            tmp = TIMEDELTA_RE.match(string)
             days = self._regex_number_to_int(tmp, 1)
             hours = self._regex_number_to_int(tmp, 2)
             mins = self._regex_number_to_int(tmp, 3)
@@ -316,16 +330,12 @@ class EventStoreCheck(AgentCheck):
         except AttributeError:
             return 0
 
-    def dispatch_metric(self, value, metric):
-        """Formats the metric into the correct type with relevant tags"""
-        metric_type = metric['metric_type']
-        tags = metric['tag_by']
-        metric_name = metric['metric_name']
-        if metric_type == 'gauge':
-            self.log.debug("Sending gauge %s v: %s t: %s", metric_name, value, tags)
-            self.gauge(metric_name, value, tags)
-        elif metric_type == 'histogram':
-            self.log.debug("Sending histogram %s v: %s t: %s", metric_name, value, tags)
-            self.histogram(metric_name, value, tags)
+    def dispatch_metric(self, value, metric, tags):
+        """Submits the metric with its type and relevant tags"""
+        if metric.submit is not None:
+            self.log.debug("Sending %s %s v: %s t: %s", metric.metric_type, metric.metric_name, value, tags)
+            metric.submit(metric.metric_name, value, tags)
         else:
-            self.log.info('Unable to send metric %s due to invalid metric type of %s', metric_name, metric_type)
+            self.log.info(
+                'Unable to send metric %s due to invalid metric type of %s', metric.metric_name, metric.metric_type
+            )
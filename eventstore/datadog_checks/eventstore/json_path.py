@@ -0,0 +1,151 @@
+# (C) Calastone Ltd. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+import bisect
+import fnmatch
+import re
+from collections import defaultdict
+
+WILDCARD_CHARS = re.compile(r'[*?\[]')
+
+# Marks a path segment which does not exist in the document
+MISSING = object()
+
+# Compiled glob patterns, shared by every response
+_GLOB_CACHE = {}
+
+
+def compile_glob(pattern):
+    """Returns the compiled regex matching the same paths as `fnmatch.fnmatch` for the pattern"""
+    regex = _GLOB_CACHE.get(pattern)
+    if regex is None:
+        regex = _GLOB_CACHE[pattern] = re.compile(fnmatch.translate(pattern))
+    return regex
+
+
+class JsonPathIndex(object):
+    """
+    Index of the leaf paths of a JSON document, built in a single traversal
+
+    Paths are dotted keys, list items are keyed by their position. A glob pattern matches the same paths as
+    `fnmatch`, but only the paths under its literal leading segments and ending with its literal last segment
+    are tested against it.
+    """
+
+    def __init__(self, json_obj):
+        self.paths = []
+        self._path_set = set()
+        # last segment of the paths -> sorted positions in `paths`
+        self._by_leaf = defaultdict(list)
+        # key -> [start, end, children] where paths[start:end] are the leaves under the key
+        self._trie = {}
+        self._dotted_keys = False
+        self._matches = {}
+        # path prefix -> resolved dict or list, shared by the lookups of sibling paths
+        self._containers = {'': json_obj}
+        self._walk(json_obj, '', self._trie)
+
+    def _walk(self, json_obj, prefix, children):
+        items = enumerate(json_obj) if isinstance(json_obj, list) else json_obj.items()
+        for key, value in items:
+            key = str(key)
+            if '.' in key:
+                self._dotted_keys = True
+            path = prefix + key
+            if isinstance(value, (dict, list)):
+                node = [len(self.paths), None, {}]
+                self._walk(value, path + '.', node[2])
+                node[1] = len(self.paths)
+                children[key] = node
+            elif path not in self._path_set:
+                self._path_set.add(path)
+                self._by_leaf[path.rsplit('.', 1)[-1]].append(len(self.paths))
+                self.paths.append(path)
+
+    def _subtree(self, segments):
+        """Returns the range of the paths under the literal leading segments of a pattern"""
+        start, end = 0, len(self.paths)
+        # keys containing dots do not map to a single segment, every path has to be tested then
+        if self._dotted_keys:
+            return start, end
+        children = self._trie
+        for segment in segments[:-1]:
+            if WILDCARD_CHARS.search(segment):
+                break
+            node = children.get(segment)
+            if node is None:
+                return 0, 0
+            start, end, children = node
+        return start, end
+
+    def find(self, pattern):
+        """Returns the paths matching the pattern, in document order"""
+        matches = self._matches.get(pattern)
+        if matches is not None:
+            return matches
+
+        if pattern in self._path_set:
+            matches = [pattern]
+        elif '[' in pattern:
+            # a character class may match dots, do not narrow the search
+            regex = compile_glob(pattern)
+            matches = [path for path in self.paths if regex.match(path)]
+        else:
+            segments = pattern.split('.')
+            start, end = self._subtree(segments)
+            if len(segments) > 1 and not WILDCARD_CHARS.search(segments[-1]):
+                leaves = self._by_leaf.get(segments[-1], [])
+                first, last = bisect.bisect_left(leaves, start), bisect.bisect_left(leaves, end)
+                candidates = leaves[first:last]
+            else:
+                candidates = range(start, end)
+            regex = compile_glob(pattern)
+            paths = self.paths
+            matches = [paths[i] for i in candidates if regex.match(paths[i])]
+
+        self._matches[pattern] = matches
+        return matches
+
+    @staticmethod
+    def _child(container, key):
+        """Returns the item of a dict or list for a path segment, MISSING if there is none"""
+        if isinstance(container, list):
+            # only the positions as written by `_walk` address list items
+            if not key.isdigit() or (len(key) > 1 and key[0] == '0'):
+                return MISSING
+            index = int(key)
+            return container[index] if index < len(container) else MISSING
+        if isinstance(container, dict):
+            return container.get(key, MISSING)
+        return MISSING
+
+    def _container(self, prefix):
+        """Returns the dict or list at the path prefix, resolving and caching its missing ancestors"""
+        container = self._containers.get(prefix)
+        if container is not None:
+            return container
+
+        # find the deepest ancestor already resolved, then walk down from it
+        pending = []
+        parent = prefix
+        while container is None:
+            parent, _, key = parent.rpartition('.')
+            pending.append(key)
+            container = self._containers.get(parent)
+        for key in reversed(pending):
+            container = self._child(container, key)
+            if not isinstance(container, (dict, list)):
+                return MISSING
+            parent = parent + '.' + key if parent else key
+            self._containers[parent] = container
+        return container
+
+    def get(self, path, default=None):
+        """Returns the value at the path, `default` if the path does not exist"""
+        prefix, _, key = path.rpartition('.')
+        container = self._container(prefix)
+        value = self._child(container, key)
+        return default if value is MISSING else value
+
+    def __contains__(self, path):
+        return path in self._path_set
@@ -6,3 +6,39 @@ from datadog_checks.dev import get_docker_hostname, get_here
 HERE = get_here()
 HOST = get_docker_hostname()
 PORT = '2113'
+
+
+def make_projections_payload(num_projections):
+    """Returns a synthetic `/projections/all-non-transient` payload"""
+    return {
+        'projections': [
+            {
+                'coreProcessingTime': i,
+                'version': 1,
+                'epoch': -1,
+                'effectiveName': 'projection-{}'.format(i),
+                'writesInProgress': 0,
+                'readsInProgress': 0,
+                'partitionsCached': 1,
+                'status': 'Running' if i % 2 else 'Stopped',
+                'stateReason': '',
+                'name': 'projection-{}'.format(i),
+                'mode': 'Continuous',
+                'position': 'C:0/P:0',
+                'progress': 100.0,
+                'lastCheckpoint': 'C:0/P:0',
+                'eventsProcessedAfterRestart': i * 10,
+                'statusUrl': 'http://localhost:2113/projection/projection-{}'.format(i),
+                'stateUrl': 'http://localhost:2113/projection/projection-{}/state'.format(i),
+                'resultUrl': 'http://localhost:2113/projection/projection-{}/result'.format(i),
+                'queryUrl': 'http://localhost:2113/projection/projection-{}/query?config=yes'.format(i),
+                'enableCommandUrl': 'http://localhost:2113/projection/projection-{}/command/enable'.format(i),
+                'disableCommandUrl': 'http://localhost:2113/projection/projection-{}/command/disable'.format(i),
+                'checkpointStatus': '',
+                'bufferedEvents': 0,
+                'writePendingEventsBeforeCheckpoint': 0,
+                'writePendingEventsAfterCheckpoint': 0,
+            }
+            for i in range(num_projections)
+        ]
+    }
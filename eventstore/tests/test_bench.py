@@ -0,0 +1,46 @@
+# (C) Calastone Ltd. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+import mock
+import pytest
+
+from datadog_checks.eventstore import EventStoreCheck
+from datadog_checks.eventstore.json_path import JsonPathIndex
+from datadog_checks.eventstore.metrics import ALL_METRICS
+
+from .common import make_projections_payload
+
+NUM_PROJECTIONS = 5000
+PROJECTIONS_ENDPOINT = '/projections/all-non-transient'
+PROJECTIONS_PAYLOAD = make_projections_payload(NUM_PROJECTIONS)
+
+
+def _find_projection_paths(payload):
+    index = JsonPathIndex(payload)
+    for metric in ALL_METRICS[PROJECTIONS_ENDPOINT]:
+        index.find(metric['json_path'])
+    return index
+
+
+@pytest.mark.benchmark(group='projections-paths')
+def test_bench_projection_paths(benchmark):
+    index = benchmark(_find_projection_paths, PROJECTIONS_PAYLOAD)
+    assert len(index.find('projections.*.status')) == NUM_PROJECTIONS
+
+
+@pytest.mark.benchmark(group='projections-check')
+def test_bench_projections_check(benchmark, aggregator):
+    instance = {
+        'url': 'http://localhost:2113',
+        'endpoints': [PROJECTIONS_ENDPOINT],
+        'name': 'bench',
+        'json_path': ['*.*.*'],
+    }
+    c = EventStoreCheck('eventstore', {}, [instance])
+    response = mock.MagicMock(status_code=200)
+    response.json.return_value = PROJECTIONS_PAYLOAD
+
+    with mock.patch('datadog_checks.base.utils.http.RequestsWrapper.get', return_value=response):
+        benchmark.pedantic(c.check, args=(instance,), rounds=3)
+
+    assert len(aggregator.metrics('eventstore.projection.running')) == 3 * NUM_PROJECTIONS
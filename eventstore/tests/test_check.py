@@ -2,6 +2,7 @@
 # All rights reserved
 # Licensed under a 3-clause BSD style license (see LICENSE)
 
+import mock
 import pytest
 
 from datadog_checks.base.errors import CheckException
@@ -64,3 +65,102 @@ def test_integration(aggregator, instance):
             aggregator.assert_metric(metric['metric_name'], tags=[])
 
     aggregator.assert_all_metrics_covered()
+
+
+@pytest.mark.unit
+def test_check_endpoint(aggregator):
+    payload = [
+        {'eventStreamId': 'orders', 'groupName': 'billing', 'status': 'Live', 'totalItemsProcessed': 42},
+        {'eventStreamId': 'users', 'groupName': 'mailer', 'status': 'Paused', 'totalItemsProcessed': 'N/A'},
+    ]
+    instance = {
+        'url': 'http://localhost:2113',
+        'endpoints': ['/subscriptions'],
+        'name': 'testInstance',
+        'json_path': ['*.status', '*.totalItemsProcessed'],
+    }
+    c = EventStoreCheck('eventstore', {}, [instance])
+    response = mock.MagicMock(status_code=200)
+    response.json.return_value = payload
+
+    with mock.patch('datadog_checks.base.utils.http.RequestsWrapper.get', return_value=response):
+        c.check(instance)
+        c.check(instance)
+
+    tags = ['name:testInstance', 'event_stream_id:orders', 'group_name:billing']
+    aggregator.assert_metric('eventstore.subscription.live', value=1, tags=tags, count=2)
+    aggregator.assert_metric('eventstore.subscription.items_processed', value=42, tags=tags, count=2)
+    tags = ['name:testInstance', 'event_stream_id:users', 'group_name:mailer']
+    aggregator.assert_metric('eventstore.subscription.live', value=0, tags=tags, count=2)
+    aggregator.assert_metric('eventstore.subscription.items_processed', tags=tags, count=0)
+    aggregator.assert_all_metrics_covered()
+
+
+@pytest.mark.unit
+def test_convert_to_timedelta():
+    c = EventStoreCheck('eventstore', {}, [{}])
+    metric = c.compile_metric(
+        {'json_path': 'a', 'json_type': 'datetime', 'metric_name': 'eventstore.a', 'metric_type': 'gauge'}
+    )
+    assert metric.convert('1:02:03:04.5') == 93784.000005
+    assert metric.convert('invalid') == 0.0
+
+
+@pytest.mark.unit
+def test_null_values(aggregator):
+    payload = {
+        'es': {
+            'queue': {
+                'MainQueue': {
+                    'queueName': 'MainQueue',
+                    'groupName': None,
+                    'currentIdleTime': None,
+                    'currentItemProcessingTime': '0:00:00:01.5',
+                },
+            },
+        },
+    }
+    instance = {
+        'url': 'http://localhost:2113',
+        'endpoints': ['/stats'],
+        'name': 'testInstance',
+        'json_path': ['es.queue.*.currentIdleTime', 'es.queue.*.currentItemProcessingTime'],
+    }
+    c = EventStoreCheck('eventstore', {}, [instance])
+    response = mock.MagicMock(status_code=200)
+    response.json.return_value = payload
+
+    with mock.patch('datadog_checks.base.utils.http.RequestsWrapper.get', return_value=response):
+        c.check(instance)
+
+    tags = ['name:testInstance', 'queue_name:MainQueue', 'group_name:None']
+    aggregator.assert_metric('eventstore.es.queue.current_idle_time', value=0, tags=tags, count=1)
+    aggregator.assert_metric('eventstore.es.queue.current_processing_time', value=1.000005, tags=tags, count=1)
+    assert c.convert_to_timedelta(None) is None
+
+
+@pytest.mark.unit
+def test_endpoint_failure_isolation(aggregator):
+    instance = {
+        'url': 'http://localhost:2113',
+        'endpoints': ['/projections/all-non-transient', '/gossip'],
+        'name': 'testInstance',
+        'json_path': ['*.*.*'],
+    }
+    c = EventStoreCheck('eventstore', {}, [instance])
+    gossip = mock.MagicMock(status_code=200)
+    gossip.json.return_value = {'members': [{'isAlive': True, 'httpEndPointIp': '10.0.0.1', 'httpEndPointPort': 2113}]}
+    responses = {
+        'http://localhost:2113/projections/all-non-transient': mock.MagicMock(status_code=503),
+        'http://localhost:2113/gossip': gossip,
+    }
+
+    with mock.patch('datadog_checks.base.utils.http.RequestsWrapper.get', side_effect=lambda url: responses[url]):
+        with pytest.raises(CheckException, match='^Invalid Status Code.+projections'):
+            c.check(instance)
+
+    aggregator.assert_metric(
+        'eventstore.cluster.member_alive',
+        value=1,
+        tags=['name:testInstance', 'http_end_point_ip:10.0.0.1', 'http_end_point_port:2113'],
+    )
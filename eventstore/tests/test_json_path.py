@@ -0,0 +1,106 @@
+# (C) Calastone Ltd. 2018
+# All rights reserved
+# Licensed under a 3-clause BSD style license (see LICENSE)
+import fnmatch
+
+import pytest
+
+from datadog_checks.eventstore.json_path import JsonPathIndex
+
+from .common import make_projections_payload
+
+DOCUMENT = {
+    'proc': {'cpu': 1.5, 'tcp': {'connections': 3, 'receivingSpeed': 0.1}, 'empty': {}},
+    'es': {'queue': {'MainQueue': {'length': 0, 'queueName': 'MainQueue'}, 'Worker #1': {'length': 2}}},
+    'members': [{'isAlive': True, 'httpEndPointIp': '10.0.0.1'}, {'isAlive': False, 'httpEndPointIp': '10.0.0.2'}],
+    'state': 'leader',
+}
+
+
+def _legacy_walk(json_obj, p=None, es_paths=None):
+    p = [] if p is None else p
+    es_paths = [] if es_paths is None else es_paths
+    if isinstance(json_obj, list):
+        json_obj = {str(k): v for k, v in enumerate(json_obj)}
+    for key, value in json_obj.items():
+        p.append(key)
+        if isinstance(value, (dict, list)):
+            _legacy_walk(value, p, es_paths)
+        elif '.'.join(p) not in es_paths:
+            es_paths.append('.'.join(p))
+        p.pop()
+    return es_paths
+
+
+def _legacy_find(pattern, paths):
+    if pattern in paths:
+        return [pattern]
+    return [path for path in paths if fnmatch.fnmatch(path, pattern)]
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    'document',
+    [DOCUMENT, make_projections_payload(3), [{'a.b': 1, 'a': {'b': 2, 'c': 3}}]],
+    ids=['stats', 'projections', 'dotted_keys'],
+)
+@pytest.mark.parametrize(
+    'pattern',
+    [
+        '*',
+        '*.*',
+        '*.*.*',
+        'proc.cpu',
+        'proc.tcp.*',
+        'proc.*',
+        'es.queue.*.*',
+        'es.queue.*.length',
+        'members.*.isAlive',
+        'members.?.httpEndPointIp',
+        'members.[01].isAlive',
+        'projections.*.status',
+        'projections.1.effectiveName',
+        '*.status',
+        '*.a.b',
+        '0.a.*',
+        'proc.unknown.*',
+        'state.*',
+    ],
+)
+def test_find_matches_fnmatch(document, pattern):
+    index = JsonPathIndex(document)
+    paths = _legacy_walk(document)
+    assert index.paths == paths
+    assert index.find(pattern) == _legacy_find(pattern, paths)
+
+
+@pytest.mark.unit
+def test_get_resolves_paths():
+    index = JsonPathIndex(DOCUMENT)
+    assert index.get('proc.cpu') == 1.5
+    assert index.get('proc.tcp.connections') == 3
+    assert index.get('es.queue.Worker #1.length') == 2
+    assert index.get('members.1.httpEndPointIp') == '10.0.0.2'
+    assert index.get('state') == 'leader'
+    assert index.get('proc.empty') == {}
+    # sibling lookups reuse the resolved parent
+    assert index._containers['members.1'] is DOCUMENT['members'][1]
+
+    for path in ['proc.unknown', 'proc.unknown.cpu', 'members.2.isAlive', 'members.01.isAlive', 'members.-1.isAlive']:
+        assert index.get(path) is None
+    assert index.get('state.leader', 'N/A') == 'N/A'
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    'document',
+    [DOCUMENT, make_projections_payload(3)],
+    ids=['stats', 'projections'],
+)
+def test_get_matches_walk(document):
+    index = JsonPathIndex(document)
+    for path in index.paths:
+        value = document
+        for key in path.split('.'):
+            value = value[int(key)] if isinstance(value, list) else value[key]
+        assert index.get(path) == value
@@ -4,6 +4,7 @@
 
 # stdlib
 import errno
+import fnmatch
 import json
 import os
 import re
@@ -171,11 +172,21 @@ class FilebeatCheckInstanceConfig:
 
         self._ignore_registry = instance.get("ignore_registry", False)
 
+        self._registry_stat_changed_only = is_affirmative(instance.get("registry_stat_changed_only", False))
+
+        self._registry_source_patterns = instance.get("registry_source_patterns", [])
+
         if not isinstance(self._only_metrics, list):
             raise Exception(
                 "If given, filebeat's only_metrics must be a list of regexes, got %s" % (self._only_metrics,)
             )
 
+        if not isinstance(self._registry_source_patterns, list):
+            raise Exception(
+                "If given, filebeat's registry_source_patterns must be a list of glob patterns, got %s"
+                % (self._registry_source_patterns,)
+            )
+
     @property
     def registry_file_path(self):
         return self._registry_file_path
@@ -188,6 +199,14 @@ class FilebeatCheckInstanceConfig:
     def ignore_registry(self):
         return self._ignore_registry
 
+    @property
+    def registry_stat_changed_only(self):
+        return self._registry_stat_changed_only
+
+    @property
+    def registry_source_patterns(self):
+        return self._registry_source_patterns
+
     def should_keep_metric(self, metric_name):
 
         if not self._only_metrics:
@@ -212,6 +231,151 @@ class FilebeatCheckInstanceConfig:
         return compiled_regexes
 
 
+class FilebeatRegistrySource:
+    """
+    What is known of a file harvested by filebeat, kept in between runs so that its tags are only built once
+    and, if configured so, the file is only stat'ed again when its registry state changes
+    """
+
+    def __init__(self, source, tags, patterns):
+        self.tags = tags + ["source:{0}".format(source)]
+        # first pattern matching the source, its unprocessed bytes are summed with the other files matching it
+        self.pattern = next((pattern for pattern in patterns if fnmatch.fnmatch(source, pattern)), None)
+        self.offset = None
+        self.unprocessed_bytes = None
+
+
+class FilebeatRegistryReader:
+    """
+    Reads a filebeat registry, keeping its contents in between runs.
+
+    Since filebeat 7, the registry is an op-log where every change to a file state is appended as a new line; only
+    the lines appended since the previous run are read, and applied to the states already known. When the op-log
+    gets truncated or replaced, which filebeat does each time it checkpoints it, it is read again from the start.
+    Older registries are a single JSON document, only parsed again when the file changes.
+    """
+
+    def __init__(self, registry_file_path):
+        self._registry_file_path = registry_file_path
+        # (device, inode) of the registry file read so far
+        self._file_id = None
+        # None until the format is known, the registry being empty
+        self._is_op_log = None
+        # number of bytes already read from the registry file
+        self._offset = 0
+        self._mtime = None
+        # first line of the op-log and last line read, which change when filebeat rewrites it
+        self._first_line = None
+        self._last_line = None
+        # op of the last op-log entry, applied on the next line
+        self._op = None
+        # op-log key -> file state
+        self._states = {}
+        self._contents = []
+
+    @property
+    def registry_file_path(self):
+        return self._registry_file_path
+
+    def read(self):
+        with open(self._registry_file_path, "rb") as registry_file:
+            stats = os.fstat(registry_file.fileno())
+            file_id = (stats.st_dev, stats.st_ino)
+            if file_id != self._file_id or self._is_rewritten(registry_file, stats):
+                # first read, or the registry has been rotated or truncated
+                self._reset(file_id, registry_file)
+
+            if self._is_op_log is None:
+                # empty, filebeat has just truncated it, its format is detected again on the next read
+                self._file_id = None
+                return []
+
+            if self._is_op_log:
+                if not self._read_op_log(registry_file):
+                    # the op-log has been rewritten without changing the lines checked above, read it again
+                    self._reset(file_id, registry_file)
+                    self._read_op_log(registry_file)
+                return list(self._states.values())
+
+            if stats.st_size != self._offset or stats.st_mtime != self._mtime:
+                registry_file.seek(0)
+                try:
+                    contents = json.loads(registry_file.read().decode("utf-8"))
+                except ValueError:
+                    # an op-log whose first line was still being written, or a document being written
+                    self._file_id = None
+                    return []
+                if isinstance(contents, dict):
+                    # filebeat version < 5
+                    contents = list(contents.values())
+                self._contents = contents
+                self._offset = stats.st_size
+                self._mtime = stats.st_mtime
+            return self._contents
+
+    def _is_rewritten(self, registry_file, stats):
+        if stats.st_size < self._offset:
+            return True
+        if not self._is_op_log or not self._offset:
+            return False
+
+        # a truncated op-log can grow past the offset read so far before the next run, in which case the line
+        # ending at the offset, or the first line, is not the one read anymore
+        registry_file.seek(self._offset - len(self._last_line))
+        if registry_file.read(len(self._last_line)) != self._last_line:
+            return True
+        registry_file.seek(0)
+        return registry_file.readline() != self._first_line
+
+    def _reset(self, file_id, registry_file):
+        self._file_id = file_id
+        self._offset = 0
+        self._mtime = None
+        self._op = None
+        self._last_line = None
+        self._states = {}
+        self._contents = []
+
+        registry_file.seek(0)
+        self._first_line = registry_file.readline()
+        if not self._first_line:
+            self._is_op_log = None
+            return
+        try:
+            first_entry = json.loads(self._first_line.decode("utf-8"))
+        except ValueError:
+            first_entry = None
+        self._is_op_log = isinstance(first_entry, dict) and "op" in first_entry
+
+    def _read_op_log(self, registry_file):
+        """Applies the lines appended since the previous read, returns False if one of them cannot be decoded"""
+        from_start = self._offset == 0
+        registry_file.seek(self._offset)
+        for line in registry_file:
+            if not line.endswith(b"\n"):
+                # filebeat is still writing this line, read it on the next run
+                break
+            try:
+                entry = json.loads(line.decode("utf-8"))
+            except ValueError:
+                if not from_start:
+                    return False
+                # skip a corrupted line rather than failing on it every run
+                entry = {}
+            self._offset += len(line)
+            self._last_line = line
+
+            if not entry:
+                self._op = None
+            elif "op" in entry:
+                self._op = entry["op"]
+            elif self._op == "remove":
+                self._states.pop(entry.get("k"), None)
+            elif "v" in entry:
+                self._states[entry.get("k")] = entry["v"]
+        return True
+
+
 class FilebeatCheck(AgentCheck):
 
     SERVICE_CHECK_NAME = 'can_connect'
@@ -237,42 +401,62 @@ class FilebeatCheck(AgentCheck):
         if instance_key in self.instance_cache:
             config = self.instance_cache[instance_key]["config"]
             profiler = self.instance_cache[instance_key]["profiler"]
+            registry = self.instance_cache[instance_key]["registry"]
+            sources = self.instance_cache[instance_key]["sources"]
         else:
             config = FilebeatCheckInstanceConfig(instance)
             profiler = FilebeatCheckHttpProfiler(config, self.http)
-            self.instance_cache[instance_key] = {"config": config, "profiler": profiler}
+            registry = FilebeatRegistryReader(config.registry_file_path)
+            sources = {}
+            self.instance_cache[instance_key] = {
+                "config": config,
+                "profiler": profiler,
+                "registry": registry,
+                "sources": sources,
+            }
 
         if not config.ignore_registry:
-            self._process_registry(config)
+            self._process_registry(config, registry, sources)
 
         self._gather_http_profiler_metrics(config, profiler, normalize_metrics)
 
-    def _process_registry(self, config):
-        registry_contents = self._parse_registry_file(config.registry_file_path)
+    def _process_registry(self, config, registry, sources):
+        current_sources = {}
+        unprocessed_bytes_by_pattern = {}
+
+        for item in self._parse_registry_file(registry):
+            file_state_os = item["FileStateOS"]
+            # a rotated file can stay in the registry next to the new one with the same source
+            key = (item["source"], file_state_os["device"], file_state_os["inode"])
+            source = sources.get(key)
+            if source is None:
+                source = FilebeatRegistrySource(item["source"], self.tags, config.registry_source_patterns)
+            current_sources[key] = source
+
+            unprocessed_bytes = self._process_registry_item(item, source, config.registry_stat_changed_only)
+            if unprocessed_bytes is None:
+                continue
+            if source.pattern is None:
+                self.gauge("registry.unprocessed_bytes", unprocessed_bytes, tags=source.tags)
+            else:
+                unprocessed_bytes_by_pattern[source.pattern] = (
+                    unprocessed_bytes_by_pattern.get(source.pattern, 0) + unprocessed_bytes
+                )
 
-        if isinstance(registry_contents, dict):
-            # filebeat version < 5
-            registry_contents = registry_contents.values()
+        # forget the files which are not in the registry anymore
+        sources.clear()
+        sources.update(current_sources)
 
-        for item in registry_contents:
-            self._process_registry_item(item)
+        for pattern, unprocessed_bytes in iteritems(unprocessed_bytes_by_pattern):
+            tags = self.tags + ["source_pattern:{0}".format(pattern)]
+            self.gauge("registry.unprocessed_bytes", unprocessed_bytes, tags=tags)
 
-    def _parse_registry_file(self, registry_file_path):
+    def _parse_registry_file(self, registry):
         try:
-            with open(registry_file_path) as registry_file:
-                return json.load(registry_file)
-
-        except ValueError:
-            contents = []
-            with open(registry_file_path) as registry_file:
-                for line in registry_file:
-                    content = json.loads(line)
-                    if 'op' not in content.keys():
-                        contents.append(content['v'])
-            return contents
+            return registry.read()
 
         except IOError as ex:
-            self.log.error("Cannot read the registry log file at %s: %s", registry_file_path, ex)
+            self.log.error("Cannot read the registry log file at %s: %s", registry.registry_file_path, ex)
 
             if ex.errno == errno.EACCES:
                 self.log.error(
@@ -281,22 +465,24 @@ class FilebeatCheck(AgentCheck):
 
             return []
 
-    def _process_registry_item(self, item):
-        source = item["source"]
+    def _process_registry_item(self, item, source, stat_changed_only):
         offset = item["offset"]
-        tags = self.tags + ["source:{0}".format(source)]
+        if stat_changed_only and offset == source.offset:
+            return source.unprocessed_bytes
 
+        source.offset = offset
+        source.unprocessed_bytes = None
         try:
-            stats = os.stat(source)
+            stats = os.stat(item["source"])
 
             if self._is_same_file(stats, item["FileStateOS"]):
-                unprocessed_bytes = stats.st_size - offset
-
-                self.gauge("registry.unprocessed_bytes", unprocessed_bytes, tags=tags)
+                source.unprocessed_bytes = stats.st_size - offset
             else:
-                self.log.debug("Filebeat source %s appears to have changed", source)
+                self.log.debug("Filebeat source %s appears to have changed", item["source"])
         except OSError:
-            self.log.debug("Unable to get stats on filebeat source %s", source)
+            self.log.debug("Unable to get stats on filebeat source %s", item["source"])
+
+        return source.unprocessed_bytes
 
     def _is_same_file(self, stats, file_state_os):
         return stats.st_dev == file_state_os["device"] and stats.st_ino == file_state_os["inode"]
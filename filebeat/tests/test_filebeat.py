@@ -2,6 +2,7 @@
 # All rights reserved
 # Licensed under Simplified BSD License (see LICENSE)
 
+import json
 import os
 import re
 from collections import namedtuple
@@ -112,6 +113,189 @@ def test_registry_happy_path_with_new_style_format(aggregator):
     )
 
 
+def _op_log_lines(*entries):
+    lines = []
+    for op, source, offset, inode in entries:
+        lines.append(json.dumps({"op": op, "id": len(lines) // 2 + 1}))
+        entry = {"k": "filebeat::logs::{}".format(source)}
+        if op == "set":
+            entry["v"] = {"source": source, "offset": offset, "FileStateOS": {"inode": inode, "device": 51713}}
+        lines.append(json.dumps(entry))
+    return "".join(line + "\n" for line in lines)
+
+
+@pytest.mark.unit
+def test_registry_op_log_is_read_incrementally(aggregator, tmpdir):
+    registry = tmpdir.join("log.json")
+    registry.write(_op_log_lines(("set", "/var/log/a.log", 100, 1), ("set", "/var/log/b.log", 200, 2)))
+    config = {"registry_file_path": str(registry)}
+    check = FilebeatCheck("filebeat", {}, [config])
+    file_stats = {
+        "/var/log/a.log": mocked_file_stats(1000, 1, 51713),
+        "/var/log/b.log": mocked_file_stats(1000, 2, 51713),
+    }
+
+    with mocked_os_stat(file_stats):
+        check.check(config)
+        aggregator.assert_metric("filebeat.registry.unprocessed_bytes", value=900, tags=["source:/var/log/a.log"])
+        aggregator.assert_metric("filebeat.registry.unprocessed_bytes", value=800, tags=["source:/var/log/b.log"])
+        aggregator.reset()
+
+        # only the appended lines are parsed
+        registry.write(_op_log_lines(("set", "/var/log/a.log", 400, 1), ("remove", "/var/log/b.log", None, 2)), "a")
+        with mock.patch.object(json, "loads", wraps=json.loads) as loads:
+            check.check(config)
+        assert loads.call_count == 4
+        aggregator.assert_metric("filebeat.registry.unprocessed_bytes", value=600, tags=["source:/var/log/a.log"])
+        aggregator.assert_metric("filebeat.registry.unprocessed_bytes", count=1)
+        aggregator.reset()
+
+        # a line still being written is left for the next run
+        registry.write('{"op":"set","id":3}\n{"k":"filebeat::logs::/var/log/a.log","v":{"source"', "a")
+        check.check(config)
+        aggregator.assert_metric("filebeat.registry.unprocessed_bytes", value=600, tags=["source:/var/log/a.log"])
+        aggregator.reset()
+
+        # the truncated op-log is read again from the start
+        registry.write(_op_log_lines(("set", "/var/log/b.log", 700, 2)))
+        check.check(config)
+        aggregator.assert_metric("filebeat.registry.unprocessed_bytes", value=300, tags=["source:/var/log/b.log"])
+        aggregator.assert_metric("filebeat.registry.unprocessed_bytes", count=1)
+
+
+@pytest.mark.unit
+def test_registry_op_log_regrown_past_offset(aggregator, tmpdir):
+    registry = tmpdir.join("log.json")
+    registry.write(_op_log_lines(("set", "/var/log/a.log", 100, 1)))
+    config = {"registry_file_path": str(registry)}
+    check = FilebeatCheck("filebeat", {}, [config])
+    file_stats = {
+        "/var/log/a.log": mocked_file_stats(1000, 1, 51713),
+        "/var/log/b.log": mocked_file_stats(1000, 2, 51713),
+    }
+
+    with mocked_os_stat(file_stats):
+        check.check(config)
+        aggregator.reset()
+
+        # truncated in place, then grown past the previous offset before the next run
+        registry.write(_op_log_lines(("set", "/var/log/b.log", 200, 2), ("set", "/var/log/a.log", 300, 1)))
+        for _ in range(2):
+            check.check(config)
+            aggregator.assert_metric("filebeat.registry.unprocessed_bytes", value=700, tags=["source:/var/log/a.log"])
+            aggregator.assert_metric("filebeat.registry.unprocessed_bytes", value=800, tags=["source:/var/log/b.log"])
+            aggregator.reset()
+
+        # a line is only applied once its newline is written
+        registry.write(_op_log_lines(("set", "/var/log/a.log", 600, 1)).rstrip("\n"), "a")
+        check.check(config)
+        aggregator.assert_metric("filebeat.registry.unprocessed_bytes", value=700, tags=["source:/var/log/a.log"])
+        aggregator.reset()
+
+        registry.write("\n", "a")
+        check.check(config)
+        aggregator.assert_metric("filebeat.registry.unprocessed_bytes", value=400, tags=["source:/var/log/a.log"])
+
+
+@pytest.mark.unit
+def test_registry_op_log_truncated_to_empty(aggregator, tmpdir):
+    registry = tmpdir.join("log.json")
+    registry.write("")
+    config = {"registry_file_path": str(registry)}
+    check = FilebeatCheck("filebeat", {}, [config])
+    file_stats = {"/var/log/a.log": mocked_file_stats(1000, 1, 51713)}
+
+    with mocked_os_stat(file_stats):
+        # nothing written yet
+        check.check(config)
+        aggregator.assert_metric("filebeat.registry.unprocessed_bytes", count=0)
+
+        registry.write(_op_log_lines(("set", "/var/log/a.log", 100, 1)))
+        check.check(config)
+        aggregator.assert_metric("filebeat.registry.unprocessed_bytes", value=900, tags=["source:/var/log/a.log"])
+        aggregator.reset()
+
+        # truncated to empty on the same inode when filebeat checkpoints
+        registry.write("")
+        check.check(config)
+        aggregator.assert_metric("filebeat.registry.unprocessed_bytes", count=0)
+
+        # the first line is still being written
+        line = _op_log_lines(("set", "/var/log/a.log", 400, 1))
+        registry.write(line[:10], "a")
+        check.check(config)
+        aggregator.assert_metric("filebeat.registry.unprocessed_bytes", count=0)
+
+        registry.write(line[10:], "a")
+        check.check(config)
+        aggregator.assert_metric("filebeat.registry.unprocessed_bytes", value=600, tags=["source:/var/log/a.log"])
+
+
+@pytest.mark.unit
+def test_registry_stat_changed_only(aggregator, tmpdir):
+    registry = tmpdir.join("log.json")
+    registry.write(_op_log_lines(("set", "/var/log/a.log", 100, 1), ("set", "/var/log/b.log", 200, 2)))
+    config = {"registry_file_path": str(registry), "registry_stat_changed_only": True}
+    check = FilebeatCheck("filebeat", {}, [config])
+    file_stats = {
+        "/var/log/a.log": mocked_file_stats(1000, 1, 51713),
+        "/var/log/b.log": mocked_file_stats(1000, 2, 51713),
+    }
+
+    with mocked_os_stat(file_stats) as stat:
+        check.check(config)
+        assert stat.call_count == 2
+        aggregator.reset()
+
+        # nothing changed in the registry, the previous values are reported again
+        file_stats["/var/log/a.log"] = mocked_file_stats(5000, 1, 51713)
+        check.check(config)
+        assert stat.call_count == 2
+        aggregator.assert_metric("filebeat.registry.unprocessed_bytes", value=900, tags=["source:/var/log/a.log"])
+        aggregator.assert_metric("filebeat.registry.unprocessed_bytes", value=800, tags=["source:/var/log/b.log"])
+        aggregator.reset()
+
+        registry.write(_op_log_lines(("set", "/var/log/a.log", 1000, 1)), "a")
+        check.check(config)
+        assert stat.call_count == 3
+        aggregator.assert_metric("filebeat.registry.unprocessed_bytes", value=4000, tags=["source:/var/log/a.log"])
+        aggregator.assert_metric("filebeat.registry.unprocessed_bytes", value=800, tags=["source:/var/log/b.log"])
+
+
+@pytest.mark.unit
+def test_registry_source_patterns(aggregator, tmpdir):
+    registry = tmpdir.join("log.json")
+    registry.write(
+        _op_log_lines(
+            ("set", "/var/log/nginx/access.log", 100, 1),
+            ("set", "/var/log/nginx/error.log", 200, 2),
+            ("set", "/var/log/syslog", 300, 3),
+        )
+    )
+    config = {
+        "registry_file_path": str(registry),
+        "registry_source_patterns": ["/var/log/nginx/*", "/var/log/*"],
+        "tags": ["foo:bar"],
+    }
+    check = FilebeatCheck("filebeat", {}, [config])
+    file_stats = {
+        "/var/log/nginx/access.log": mocked_file_stats(1000, 1, 51713),
+        "/var/log/nginx/error.log": mocked_file_stats(1000, 2, 51713),
+        "/var/log/syslog": mocked_file_stats(1000, 3, 51713),
+    }
+
+    with mocked_os_stat(file_stats):
+        check.check(config)
+
+    aggregator.assert_metric(
+        "filebeat.registry.unprocessed_bytes", value=1700, tags=["foo:bar", "source_pattern:/var/log/nginx/*"]
+    )
+    aggregator.assert_metric(
+        "filebeat.registry.unprocessed_bytes", value=700, tags=["foo:bar", "source_pattern:/var/log/*"]
+    )
+    aggregator.assert_metric("filebeat.registry.unprocessed_bytes", count=2)
+
+
 def test_bad_config():
     check = FilebeatCheck("filebeat", {}, {})
     with pytest.raises(Exception) as excinfo:
@@ -476,6 +660,14 @@ def test_port_not_an_int():
     _assert_config_raises({"port": "foo"}, "must be an integer")
 
 
+def test_registry_source_patterns_not_a_list():
+    config = _build_instance("empty")
+    config["registry_source_patterns"] = "/var/log/*"
+    check = FilebeatCheck("filebeat", {}, [config])
+    with pytest.raises(Exception, match="must be a list of glob patterns"):
+        check.check(config)
+
+
 def test_only_metrics_not_a_list():
     _assert_config_raises({"port": 82, "only_metrics": r"truncated$"}, "must be a list of regexes")
 
@@ -1,4 +1,6 @@
 # stdlib
+import re
+import time
 from collections import namedtuple
 from distutils.version import LooseVersion
 
@@ -7,11 +9,63 @@ from six import iteritems
 from six.moves.urllib.parse import urljoin, urlparse
 
 # project
-from datadog_checks.base import AgentCheck
+from datadog_checks.base import AgentCheck, ConfigurationError, is_affirmative
 
 EVENT_TYPE = SOURCE_TYPE_NAME = 'logstash'
 
-LogstashInstanceConfig = namedtuple('LogstashInstanceConfig', ['service_check_tags', 'tags', 'url'])
+LogstashInstanceConfig = namedtuple(
+    'LogstashInstanceConfig',
+    [
+        'service_check_tags',
+        'tags',
+        'url',
+        'pipeline_filter',
+        'plugin_filter',
+        'plugins_top_n',
+        'plugin_raw_metrics',
+        'derive_plugin_throughput',
+    ],
+)
+
+# How long the version of a Logstash node is trusted, unless the node stats report another node or version
+DEFAULT_NODE_INFO_TTL = 600
+
+
+# Plugin types, with the tag naming their plugins and the path of the time spent in each of them
+PLUGIN_TYPES = (
+    ('inputs', 'input_name', ('events', 'queue_push_duration_in_millis')),
+    ('filters', 'filter_name', ('events', 'duration_in_millis')),
+    ('outputs', 'output_name', ('events', 'duration_in_millis')),
+)
+PLUGIN_DURATION_KEYS = {plugin_type: keys for plugin_type, _, keys in PLUGIN_TYPES}
+# Plugin types counting the events they process, their throughput can be derived
+THROUGHPUT_PLUGIN_TYPES = ('filters', 'outputs')
+EVENTS_IN = ('events', 'in')
+
+
+def get_value(data, keys):
+    """Returns the value at the path of keys in the nested dictionaries, None if there is none"""
+    value = data
+    for key in keys:
+        if value is None:
+            break
+        value = value.get(key, None)
+    return value
+
+
+def compile_patterns(instance, name):
+    patterns = instance.get(name, [])
+    if not isinstance(patterns, list):
+        raise ConfigurationError("If given, {} must be a list of regexes, got {}".format(name, patterns))
+    try:
+        return [re.compile(pattern) for pattern in patterns]
+    except re.error as e:
+        raise ConfigurationError("Invalid regex in {}: {}".format(name, e))
+
+
+def compile_metrics(metrics):
+    """Returns the (metric, type, keys) of the metrics, keys being the path of their value in the stats"""
+    return [(metric, xtype, tuple(path.split('.'))) for metric, (xtype, path) in iteritems(metrics)]
 
 
 class LogstashCheck(AgentCheck):
@@ -116,6 +170,27 @@ class LogstashCheck(AgentCheck):
         "logstash.pipeline.plugins.filters.events.duration_in_millis": ("gauge", "events.duration_in_millis"),
     }
 
+    def __init__(self, *args, **kwargs):
+        super(LogstashCheck, self).__init__(*args, **kwargs)
+        self._stats_metrics = compile_metrics(self.STATS_METRICS)
+        self._pipeline_metrics = compile_metrics(self.PIPELINE_METRICS)
+        self._multi_pipeline_metrics = compile_metrics(dict(self.PIPELINE_METRICS, **self.PIPELINE_QUEUE_METRICS))
+        self._pipeline_plugins_metrics = {
+            'inputs': compile_metrics(self.PIPELINE_INPUTS_METRICS),
+            'filters': compile_metrics(self.PIPELINE_FILTERS_METRICS),
+            'outputs': compile_metrics(self.PIPELINE_OUTPUTS_METRICS),
+        }
+        # (kind, name) -> whether the pipeline or plugin is included by the filters of the instance
+        self._included = {}
+        # (pipeline name, plugin type, plugin id) -> (timestamp, events in, duration in millis) of the last run
+        self._plugin_samples = {}
+        self._current_plugin_samples = {}
+
+        # (id, version) reported by the node stats when the version was last fetched
+        self._node_info = None
+        self._node_info_expiry = 0
+        self._logstash_version = None
+
     def get_instance_config(self, instance):
         url = instance.get('url')
         if url is None:
@@ -138,10 +213,28 @@ class LogstashCheck(AgentCheck):
         tags = ['url:%s' % url]
         tags.extend(custom_tags)
 
+        try:
+            plugins_top_n = int(instance.get('plugins_top_n', 0))
+        except (TypeError, ValueError):
+            plugins_top_n = -1
+        if plugins_top_n < 0:
+            raise ConfigurationError("plugins_top_n must be a non-negative integer")
+
         config = LogstashInstanceConfig(
             service_check_tags=service_check_tags,
             tags=tags,
             url=url,
+            pipeline_filter=(
+                compile_patterns(instance, 'pipelines_include'),
+                compile_patterns(instance, 'pipelines_exclude'),
+            ),
+            plugin_filter=(
+                compile_patterns(instance, 'plugins_include'),
+                compile_patterns(instance, 'plugins_exclude'),
+            ),
+            plugins_top_n=plugins_top_n,
+            plugin_raw_metrics=is_affirmative(instance.get('plugin_raw_metrics', True)),
+            derive_plugin_throughput=is_affirmative(instance.get('derive_plugin_throughput', False)),
         )
         return config
 
@@ -175,11 +268,24 @@ class LogstashCheck(AgentCheck):
                 self.DEFAULT_VERSION,
             )
             version = self.DEFAULT_VERSION
+            # try again on the next run
+            self._node_info_expiry = 0
 
         self.service_metadata('version', version)
         self.log.debug("Logstash version is %s", version)
         return version
 
+    def _get_node_version(self, config, stats_data, node_info_ttl):
+        """Get the version of logstash, only fetched again once expired or when the node stats report a different
+        node or version"""
+        node_info = (stats_data.get('id'), stats_data.get('version'))
+        now = time.time()
+        if self._logstash_version is None or node_info != self._node_info or now >= self._node_info_expiry:
+            self._node_info = node_info
+            self._node_info_expiry = now + node_info_ttl
+            self._logstash_version = self._get_logstash_version(config)
+        return self._logstash_version
+
     def _is_multi_pipeline(self, version):
         """Reusable version checker"""
         return version and LooseVersion(version) >= LooseVersion("6.0.0")
@@ -187,61 +293,87 @@ class LogstashCheck(AgentCheck):
     def check(self, instance):
         config = self.get_instance_config(instance)
 
-        logstash_version = self._get_logstash_version(config)
-
         stats_url = urljoin(config.url, '/_node/stats')
         stats_data = self._get_data(stats_url, config)
 
-        for metric, desc in iteritems(self.STATS_METRICS):
-            self._process_metric(stats_data, metric, *desc, tags=config.tags)
+        node_info_ttl = float(instance.get('node_info_ttl', DEFAULT_NODE_INFO_TTL))
+        logstash_version = self._get_node_version(config, stats_data, node_info_ttl)
+
+        for metric, xtype, keys in self._stats_metrics:
+            self._process_metric(stats_data, metric, xtype, keys, tags=config.tags)
 
         if not self._is_multi_pipeline(logstash_version):
-            self._process_pipeline_data(stats_data['pipeline'], config.tags, logstash_version)
+            self._process_pipeline_data(stats_data['pipeline'], config.tags, self._pipeline_metrics, config)
         elif 'pipelines' in stats_data:
             for pipeline_name, pipeline_data in iteritems(stats_data['pipelines']):
                 if pipeline_name.startswith('.'):
                     # skip internal pipelines like '.monitoring_logstash'
                     continue
+                if not self._is_included(config.pipeline_filter, 'pipeline', pipeline_name):
+                    continue
                 metric_tags = list(config.tags)
                 metric_tags.append(u'pipeline_name:{}'.format(pipeline_name))
-                self._process_pipeline_data(pipeline_data, metric_tags, logstash_version)
+                self._process_pipeline_data(
+                    pipeline_data, metric_tags, self._multi_pipeline_metrics, config, pipeline_key=pipeline_name
+                )
+
+        # forget the plugins which are gone
+        self._plugin_samples, self._current_plugin_samples = self._current_plugin_samples, {}
 
         self.service_check(self.SERVICE_CHECK_CONNECT_NAME, AgentCheck.OK, tags=config.service_check_tags)
 
     def _process_stats_data(self, data, stats_metrics, config):
-        for metric, desc in iteritems(stats_metrics):
-            self._process_metric(data, metric, *desc, tags=config.tags)
+        for metric, xtype, keys in compile_metrics(stats_metrics):
+            self._process_metric(data, metric, xtype, keys, tags=config.tags)
 
-    def _process_pipeline_data(self, pipeline_data, tags, logstash_version):
+    def _process_pipeline_data(self, pipeline_data, tags, pipeline_metrics, config, pipeline_key=None):
         """
         Simple interface to run multiple metric submissions for pipeline top level,
         plugin inputs, outputs, and filters
         """
-        self._process_top_level_pipeline_data(pipeline_data, tags, logstash_version)
-        self._process_pipeline_plugins_data(
-            pipeline_data['plugins'], self.PIPELINE_INPUTS_METRICS, tags, 'inputs', 'input_name'
-        )
-        self._process_pipeline_plugins_data(
-            pipeline_data['plugins'], self.PIPELINE_OUTPUTS_METRICS, tags, 'outputs', 'output_name'
-        )
-        self._process_pipeline_plugins_data(
-            pipeline_data['plugins'], self.PIPELINE_FILTERS_METRICS, tags, 'filters', 'filter_name'
-        )
+        self._process_top_level_pipeline_data(pipeline_data, tags, pipeline_metrics)
+        for plugin_type, tag_name, _ in PLUGIN_TYPES:
+            self._process_pipeline_plugins_data(
+                pipeline_data['plugins'],
+                self._pipeline_plugins_metrics[plugin_type],
+                tags,
+                plugin_type,
+                tag_name,
+                config,
+                pipeline_key=pipeline_key,
+            )
+
+    def _is_included(self, patterns, kind, name):
+        """Whether the name matches one of the include patterns, if any, and none of the exclude patterns"""
+        included = self._included.get((kind, name))
+        if included is None:
+            include, exclude = patterns
+            included = (not include or any(regex.search(name) for regex in include)) and not any(
+                regex.search(name) for regex in exclude
+            )
+            self._included[(kind, name)] = included
+        return included
 
-    def _process_top_level_pipeline_data(self, pipeline_data, tags, logstash_version):
+    def _process_top_level_pipeline_data(self, pipeline_data, tags, pipeline_metrics):
         """
-        If multipipeline, also process metrics associated with multi-pipeline versions.
+        pipeline_metrics also holds the queue metrics for multi-pipeline versions.
         """
-        pipeline_metrics = self.PIPELINE_METRICS
-        if self._is_multi_pipeline(logstash_version):
-            pipeline_metrics.update(self.PIPELINE_QUEUE_METRICS)
-        for metric, metric_desc in iteritems(pipeline_metrics):
-            self._process_metric(pipeline_data, metric, *metric_desc, tags=tags)
+        for metric, xtype, keys in pipeline_metrics:
+            self._process_metric(pipeline_data, metric, xtype, keys, tags=tags)
 
     def _process_pipeline_plugins_data(
-        self, pipeline_plugins_data, pipeline_plugins_metrics, tags, plugin_type, tag_name, pipeline_name=None
+        self,
+        pipeline_plugins_data,
+        pipeline_plugins_metrics,
+        tags,
+        plugin_type,
+        tag_name,
+        config,
+        pipeline_name=None,
+        pipeline_key=None,
     ):
-        for plugin_data in pipeline_plugins_data.get(plugin_type, []):
+        plugins = pipeline_plugins_data.get(plugin_type, [])
+        for plugin_data, _, sample in self._select_plugins(plugins, plugin_type, config, pipeline_key):
             plugin_name = plugin_data.get('name')
             plugin_conf_id = plugin_data.get('id')
 
@@ -256,22 +388,78 @@ class LogstashCheck(AgentCheck):
             if plugin_conf_id:
                 metrics_tags.append(u"plugin_conf_id:{}".format(plugin_conf_id))
 
-            for metric, desc in iteritems(pipeline_plugins_metrics):
-                self._process_metric(plugin_data, metric, *desc, tags=metrics_tags)
+            if config.plugin_raw_metrics:
+                for metric, xtype, keys in pipeline_plugins_metrics:
+                    self._process_metric(plugin_data, metric, xtype, keys, tags=metrics_tags)
 
-    def _process_metric(self, data, metric, xtype, path, tags=None, hostname=None):
+            if sample is not None:
+                self._submit_plugin_throughput(plugin_type, sample, metrics_tags)
+
+    def _select_plugins(self, plugins, plugin_type, config, pipeline_key):
+        """Returns the (plugin data, duration, throughput sample) of the plugins of a type to report, duration being the
+        time spent in the plugin since the last run, or since Logstash started for the plugins without a previous sample
+        """
+        duration_keys = PLUGIN_DURATION_KEYS[plugin_type]
+        derive_throughput = config.derive_plugin_throughput and plugin_type in THROUGHPUT_PLUGIN_TYPES
+        track_samples = derive_throughput or config.plugins_top_n
+        now = time.time()
+
+        selected = []
+        for plugin_data in plugins:
+            plugin_name = plugin_data.get('name') or 'unknown'
+            if not self._is_included(config.plugin_filter, 'plugin', u'{}:{}'.format(plugin_type, plugin_name)):
+                continue
+
+            duration = get_value(plugin_data, duration_keys)
+            sample = None
+            has_previous = False
+            plugin_conf_id = plugin_data.get('id')
+            if track_samples and plugin_conf_id and duration is not None:
+                key = (pipeline_key, plugin_type, plugin_conf_id)
+                current = (now, get_value(plugin_data, EVENTS_IN), duration)
+                previous = self._plugin_samples.get(key)
+                self._current_plugin_samples[key] = current
+                # counters going backwards mean Logstash restarted
+                if previous is not None and duration >= previous[2]:
+                    duration -= previous[2]
+                    has_previous = True
+                    if derive_throughput:
+                        sample = (previous, current)
+            selected.append((plugin_data, duration or 0, sample, has_previous))
+
+        if config.plugins_top_n:
+            # the time spent since Logstash started does not compare with the time spent since the last run, new
+            # plugins are only ranked from the next run, unless no plugin has a previous sample, e.g. on the first run
+            if any(plugin[3] for plugin in selected):
+                selected = [plugin for plugin in selected if plugin[3]]
+            top_n = config.plugins_top_n
+            selected.sort(key=lambda plugin: plugin[1], reverse=True)
+            del selected[top_n:]
+        return [(plugin_data, duration, sample) for plugin_data, duration, sample, _ in selected]
+
+    def _submit_plugin_throughput(self, plugin_type, sample, tags):
+        (previous_time, previous_in, previous_duration), (current_time, current_in, current_duration) = sample
+        if previous_in is None or current_in is None or current_in < previous_in:
+            return
+        events = current_in - previous_in
+        elapsed = current_time - previous_time
+        if elapsed > 0:
+            self.gauge(
+                'logstash.pipeline.plugins.{}.events.in_per_second'.format(plugin_type), events / elapsed, tags=tags
+            )
+        if events > 0:
+            self.gauge(
+                'logstash.pipeline.plugins.{}.events.millis_per_event'.format(plugin_type),
+                (current_duration - previous_duration) / float(events),
+                tags=tags,
+            )
+
+    def _process_metric(self, data, metric, xtype, keys, tags=None, hostname=None):
         """data: dictionary containing all the stats
         metric: datadog metric
-        path: corresponding path in data, flattened, e.g. thread_pool.bulk.queue
+        keys: corresponding path in data, e.g. ('thread_pool', 'bulk', 'queue')
         """
-        value = data
-
-        # Traverse the nested dictionaries
-        for key in path.split('.'):
-            if value is not None:
-                value = value.get(key, None)
-            else:
-                break
+        value = get_value(data, keys)
 
         if value is not None:
             if xtype == "gauge":
@@ -279,7 +467,7 @@ class LogstashCheck(AgentCheck):
             else:
                 self.rate(metric, value, tags=tags, hostname=hostname)
         else:
-            self._metric_not_found(metric, path)
+            self._metric_not_found(metric, keys)
 
-    def _metric_not_found(self, metric, path):
-        self.log.debug("Metric not found: %s -> %s", path, metric)
+    def _metric_not_found(self, metric, keys):
+        self.log.debug("Metric not found: %s -> %s", '.'.join(keys), metric)
@@ -14,3 +14,42 @@ BAD_URL = 'http://{}:{}'.format(HOST, BAD_PORT)
 
 GOOD_INSTANCE = {'url': URL, 'tags': TAGS}
 BAD_INSTANCE = {'url': BAD_URL}
+
+
+def make_pipeline_stats(filters=()):
+    """Stats of a pipeline as reported by /_node/stats, filters being (id, name, events_in, duration_in_millis)"""
+    return {
+        'events': {'in': 100, 'out': 100, 'filtered': 100, 'duration_in_millis': 50},
+        'plugins': {
+            'inputs': [
+                {'id': 'dummy_input', 'name': 'beats', 'events': {'out': 100, 'queue_push_duration_in_millis': 5}}
+            ],
+            'filters': [
+                {
+                    'id': plugin_id,
+                    'name': name,
+                    'events': {'in': events_in, 'out': events_in, 'duration_in_millis': duration_in_millis},
+                }
+                for plugin_id, name, events_in, duration_in_millis in filters
+            ],
+            'outputs': [
+                {'id': 'dummy_output', 'name': 'stdout', 'events': {'in': 100, 'out': 100, 'duration_in_millis': 20}}
+            ],
+        },
+        'reloads': {'successes': 0, 'failures': 0},
+        'queue': {'type': 'memory'},
+    }
+
+
+def make_node_stats(node_id='node-1', version='7.10.0', pipelines=None):
+    """Stats of a Logstash node as reported by /_node/stats"""
+    if pipelines is None:
+        pipelines = {'main': make_pipeline_stats([('dummy_filter', 'json', 100, 10)])}
+    return {
+        'id': node_id,
+        'version': version,
+        'jvm': {'threads': {'count': 30, 'peak_count': 31}},
+        'process': {'open_file_descriptors': 80},
+        'reloads': {'successes': 0, 'failures': 0},
+        'pipelines': pipelines,
+    }
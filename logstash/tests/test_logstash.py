@@ -1,11 +1,13 @@
 from distutils.version import LooseVersion
 
+import mock
 import pytest
 import requests
 
+from datadog_checks.base import ConfigurationError
 from datadog_checks.logstash import LogstashCheck
 
-from .common import BAD_INSTANCE, BAD_PORT, GOOD_INSTANCE, HOST, PORT, TAGS, URL
+from .common import BAD_INSTANCE, BAD_PORT, GOOD_INSTANCE, HOST, PORT, TAGS, URL, make_node_stats, make_pipeline_stats
 
 STATS_METRICS = {
     "logstash.process.open_file_descriptors": ("gauge", "process.open_file_descriptors"),
@@ -164,3 +166,163 @@ def test_check(aggregator):
                 aggregator.assert_metric(metric_name, count=1, tags=metric_tags)
 
     aggregator.assert_service_check('logstash.can_connect', tags=good_sc_tags + TAGS, status=LogstashCheck.OK)
+
+
+@pytest.fixture
+def generic_tags(monkeypatch):
+    # the can_connect service check is tagged with host
+    monkeypatch.setenv('DDEV_SKIP_GENERIC_TAGS_CHECK', 'true')
+
+
+def mock_logstash(node_stats):
+    """Answers the requests of the check with the node info and the node stats, the latter read from a list"""
+    responses = {}
+
+    def get(url, *args, **kwargs):
+        if url.endswith('/_node/stats'):
+            data = node_stats[0]
+        else:
+            data = {'id': node_stats[0]['id'], 'version': node_stats[0]['version']}
+        responses.setdefault(url, []).append(data)
+        return mock.MagicMock(status_code=200, json=mock.MagicMock(return_value=data))
+
+    return mock.patch('datadog_checks.base.utils.http.RequestsWrapper.get', side_effect=get), responses
+
+
+def test_node_info_cached(aggregator, generic_tags):
+    instance = {'url': 'http://localhost:9600'}
+    check = LogstashCheck(CHECK_NAME, {}, [instance])
+    node_stats = [make_node_stats()]
+    patch, responses = mock_logstash(node_stats)
+
+    with patch, mock.patch('datadog_checks.logstash.logstash.time.time', return_value=1000):
+        check.check(instance)
+        check.check(instance)
+        assert len(responses['http://localhost:9600']) == 1
+        assert len(responses['http://localhost:9600/_node/stats']) == 2
+
+        # the node got restarted with another version
+        node_stats[0] = make_node_stats(version='7.11.0')
+        check.check(instance)
+        assert len(responses['http://localhost:9600']) == 2
+
+    with patch, mock.patch('datadog_checks.logstash.logstash.time.time', return_value=1000 + 600):
+        check.check(instance)
+        assert len(responses['http://localhost:9600']) == 3
+
+    aggregator.assert_metric('logstash.jvm.threads.count', value=30, count=4)
+    aggregator.assert_metric(
+        'logstash.pipeline.plugins.filters.events.in',
+        value=100,
+        tags=['url:http://localhost:9600', 'pipeline_name:main', 'filter_name:json', 'plugin_conf_id:dummy_filter'],
+        count=4,
+    )
+    aggregator.assert_metric('logstash.pipeline.queue.events', count=0)
+
+
+def test_class_metrics_unchanged(generic_tags):
+    pipeline_metrics = dict(LogstashCheck.PIPELINE_METRICS)
+    instance = {'url': 'http://localhost:9600'}
+    check = LogstashCheck(CHECK_NAME, {}, [instance])
+    patch, _ = mock_logstash([make_node_stats()])
+    with patch:
+        check.check(instance)
+
+    assert LogstashCheck.PIPELINE_METRICS == pipeline_metrics
+
+
+def test_pipeline_filter(aggregator, generic_tags):
+    instance = {
+        'url': 'http://localhost:9600',
+        'pipelines_include': ['^ingest_', '^main$'],
+        'pipelines_exclude': ['_test$'],
+    }
+    check = LogstashCheck(CHECK_NAME, {}, [instance])
+    pipelines = {name: make_pipeline_stats() for name in ('main', 'main2', 'ingest_logs', 'ingest_test')}
+    patch, _ = mock_logstash([make_node_stats(pipelines=pipelines)])
+    with patch:
+        check.check(instance)
+
+    reported = {
+        tag
+        for metric in aggregator.metrics('logstash.pipeline.events.in')
+        for tag in metric.tags
+        if tag.startswith('pipeline_name:')
+    }
+    assert reported == {'pipeline_name:main', 'pipeline_name:ingest_logs'}
+
+
+def test_plugins_top_n_throughput(aggregator, generic_tags):
+    instance = {
+        'url': 'http://localhost:9600',
+        'plugins_exclude': [':mutate$'],
+        'plugins_top_n': 1,
+        'plugin_raw_metrics': False,
+        'derive_plugin_throughput': True,
+    }
+    check = LogstashCheck(CHECK_NAME, {}, [instance])
+    filters = [('grok_1', 'grok', 100, 1000), ('mutate_1', 'mutate', 100, 5000), ('json_1', 'json', 100, 500)]
+    node_stats = [make_node_stats(pipelines={'main': make_pipeline_stats(filters)})]
+    patch, _ = mock_logstash(node_stats)
+
+    with patch, mock.patch('datadog_checks.logstash.logstash.time.time', return_value=1000):
+        check.check(instance)
+    # nothing to derive the throughput from yet
+    aggregator.assert_metric('logstash.pipeline.plugins.filters.events.in_per_second', count=0)
+
+    filters = [('grok_1', 'grok', 200, 1100), ('mutate_1', 'mutate', 300, 9000), ('json_1', 'json', 300, 1500)]
+    node_stats[0] = make_node_stats(pipelines={'main': make_pipeline_stats(filters)})
+    with patch, mock.patch('datadog_checks.logstash.logstash.time.time', return_value=1010):
+        check.check(instance)
+
+    # json spent the most time since the last run, mutate is excluded
+    tags = ['url:http://localhost:9600', 'pipeline_name:main', 'filter_name:json', 'plugin_conf_id:json_1']
+    aggregator.assert_metric('logstash.pipeline.plugins.filters.events.in_per_second', value=20, tags=tags, count=1)
+    aggregator.assert_metric('logstash.pipeline.plugins.filters.events.millis_per_event', value=5, tags=tags, count=1)
+    aggregator.assert_metric('logstash.pipeline.plugins.filters.events.in_per_second', count=1)
+    aggregator.assert_metric('logstash.pipeline.plugins.filters.events.in', count=0)
+    aggregator.assert_metric('logstash.pipeline.plugins.outputs.events.in_per_second', value=0, count=1)
+    aggregator.assert_metric('logstash.pipeline.events.in', count=2)
+
+
+def test_plugins_top_n_new_plugin(aggregator, generic_tags):
+    instance = {'url': 'http://localhost:9600', 'plugins_top_n': 1}
+    check = LogstashCheck(CHECK_NAME, {}, [instance])
+    filters = [('grok_1', 'grok', 100, 1000), ('json_1', 'json', 100, 500)]
+    node_stats = [make_node_stats(pipelines={'main': make_pipeline_stats(filters)})]
+    patch, _ = mock_logstash(node_stats)
+
+    with patch:
+        # no previous sample yet, the plugins are ranked by their time spent since Logstash started
+        check.check(instance)
+        aggregator.assert_metric_has_tag('logstash.pipeline.plugins.filters.events.in', 'plugin_conf_id:grok_1')
+        aggregator.assert_metric('logstash.pipeline.plugins.filters.events.in', count=1)
+        aggregator.reset()
+
+        # the lifetime total of a new plugin does not outrank the time spent since the last run by the others
+        filters = [('grok_1', 'grok', 200, 1100), ('json_1', 'json', 200, 800), ('csv_1', 'csv', 100, 50000)]
+        node_stats[0] = make_node_stats(pipelines={'main': make_pipeline_stats(filters)})
+        check.check(instance)
+        aggregator.assert_metric_has_tag('logstash.pipeline.plugins.filters.events.in', 'plugin_conf_id:json_1')
+        aggregator.assert_metric('logstash.pipeline.plugins.filters.events.in', count=1)
+        aggregator.reset()
+
+        filters = [('grok_1', 'grok', 300, 1200), ('json_1', 'json', 300, 1100), ('csv_1', 'csv', 200, 51000)]
+        node_stats[0] = make_node_stats(pipelines={'main': make_pipeline_stats(filters)})
+        check.check(instance)
+        aggregator.assert_metric_has_tag('logstash.pipeline.plugins.filters.events.in', 'plugin_conf_id:csv_1')
+        aggregator.assert_metric('logstash.pipeline.plugins.filters.events.in', count=1)
+
+
+def test_invalid_plugins_top_n():
+    instance = {'url': 'http://localhost:9600', 'plugins_top_n': -1}
+    check = LogstashCheck(CHECK_NAME, {}, [instance])
+    with pytest.raises(ConfigurationError, match='plugins_top_n must be a non-negative integer'):
+        check.check(instance)
+
+
+def test_invalid_plugin_filters():
+    instance = {'url': 'http://localhost:9600', 'plugins_include': 'filters:grok'}
+    check = LogstashCheck(CHECK_NAME, {}, [instance])
+    with pytest.raises(ConfigurationError, match='plugins_include must be a list of regexes'):
+        check.check(instance)
@@ -1,19 +1,37 @@
 import json
+import random
 import time
+from multiprocessing.pool import ThreadPool
 
 from requests import codes
 from requests.exceptions import ConnectionError, HTTPError, InvalidURL, Timeout
+from six.moves.urllib.parse import urlparse
 
 from datadog_checks.base import AgentCheck, ConfigurationError
 
+from .ns1_api_url import NS1_ENDPOINTS, get_endpoint_path
+from .ns1_rate_limit import Ns1RateLimiter
 from .ns1_url_utils import Ns1Url
 
 
+class LazyJson:
+    # serialize a payload only when the log record is actually emitted
+    def __init__(self, payload):
+        self.payload = payload
+
+    def __str__(self):
+        return json.dumps(self.payload)
+
+
 class Ns1Check(AgentCheck):
     NS1_CACHE_KEY = "ns1.cache.key"
+    NS1_REFERENCE_CACHE_KEY = "ns1.reference.cache.key"
     NS1_SERVICE_CHECK = "ns1.can_connect"
     LOG_MSG_PREFIX = "NS1 API"
     MAX_RETRIES_ATTEMPTS_DEFAULT = 5
+    MAX_CONCURRENT_REQUESTS_DEFAULT = 1
+    REFERENCE_CACHE_TTL_DEFAULT = 0
+    DEBUG_TRACE_SAMPLE_RATE_DEFAULT = 0
 
     def __init__(self, name, init_config, instances):
         super(Ns1Check, self).__init__(name, init_config, instances)
@@ -32,7 +50,32 @@ class Ns1Check(AgentCheck):
         if not self.max_retry_attempts:
             self.max_retry_attempts = self.MAX_RETRIES_ATTEMPTS_DEFAULT
 
+        self.max_concurrent_requests = self.instance.get("max_concurrent_requests")
+        if not self.max_concurrent_requests:
+            self.max_concurrent_requests = self.MAX_CONCURRENT_REQUESTS_DEFAULT
+        if not isinstance(self.max_concurrent_requests, int) or self.max_concurrent_requests < 1:
+            raise ConfigurationError('max_concurrent_requests must be a positive integer')
+
+        # networks, scope groups, pulsar apps and zone records are cached for reference_cache_ttl seconds
+        self.reference_cache_ttl = self.instance.get("reference_cache_ttl", self.REFERENCE_CACHE_TTL_DEFAULT)
+        if not isinstance(self.reference_cache_ttl, (int, float)) or self.reference_cache_ttl < 0:
+            raise ConfigurationError('reference_cache_ttl must be a positive number of seconds')
+        self.reference_cache = {}
+        # the persistent cache keys are only available once the check is scheduled
+        self.check_initializations.append(self.get_reference_cache)
+
+        # fraction of API responses logged at debug level, payloads are not logged when 0
+        self.debug_trace_sample_rate = self.instance.get(
+            "debug_trace_sample_rate", self.DEBUG_TRACE_SAMPLE_RATE_DEFAULT
+        )
+        if not isinstance(self.debug_trace_sample_rate, (int, float)) or not 0 <= self.debug_trace_sample_rate <= 1:
+            raise ConfigurationError('debug_trace_sample_rate must be a number between 0 and 1')
+        # (url, duration, response size) of every successful API request of the current run
+        self.api_requests = []
+
         self.headers = {"X-NSONE-Key": self.api_key}
+        # shared by all requests so that concurrent requests stay under the NS1 API rate limit together
+        self.rate_limiter = Ns1RateLimiter()
 
         self.metrics = self.instance.get("metrics")
         if not self.metrics or len(self.metrics) == 0:
@@ -51,40 +94,58 @@ class Ns1Check(AgentCheck):
 
         # get counters from previous run
         self.get_usage_count()
+        self.api_requests = []
 
         # create URLs to query API for all configured metrics
         checkUrl = self.create_url(self.metrics, self.query_params, self.networks)
 
-        for k, v in checkUrl.items():
-            try:
-                url, name, tags, metric_type = v
-                # Query API to get metrics
-                res = self.get_stats(url)
-                msg = '{prefix} Query URL: {url}'.format(prefix=self.LOG_MSG_PREFIX, url=url)
-                self.log.info(msg)
-                msg = '{prefix} result: {result}'.format(prefix=self.LOG_MSG_PREFIX, result=json.dumps(res))
-                self.log.info(msg)
-                if res:
-                    # extract metric from API result.
-                    val, status = self.extract_metric(k, res)
-                    # send metric to datadog if extraction was successful
-                    if status:
-                        self.send_metrics(name, val, tags, metric_type)
-            except Exception:
-                raise
+        for k, v, res in self.get_all_stats(checkUrl):
+            url, name, tags, metric_type = v
+            if res:
+                # extract metric from API result.
+                val, status = self.extract_metric(k, res)
+                # send metric to datadog if extraction was successful
+                if status:
+                    self.send_metrics(name, val, tags, metric_type)
         # save counters for next run
         self.set_usage_count()
+        self.send_api_request_metrics()
         msg = 'NS1 metrics check run for NS1 API endpoint %s was successful' % self.api_endpoint
         self.service_check(self.NS1_SERVICE_CHECK, AgentCheck.OK, message=msg)
 
-    def get_pulsar_job_name_from_id(self, pulsar_job_id):
-        for _, v in self.pulsar_apps.items():
+    def get_all_stats(self, checkUrl):
+        # Query API for all urls, up to max_concurrent_requests at a time.
+        # Results are yielded in the order of checkUrl so that metrics are extracted and submitted
+        # from the check thread only, the first error is raised.
+        items = list(checkUrl.items())
+        if self.max_concurrent_requests <= 1 or len(items) <= 1:
+            for k, v in items:
+                yield k, v, self.get_stats(v[0])
+            return
+
+        pool = ThreadPool(min(self.max_concurrent_requests, len(items)))
+        try:
+            for (k, v), res in zip(items, pool.imap(lambda item: self.get_stats(item[1][0]), items)):
+                yield k, v, res
+        finally:
+            pool.terminate()
+            pool.join()
+
+    @property
+    def pulsar_apps(self):
+        return self._pulsar_apps
+
+    @pulsar_apps.setter
+    def pulsar_apps(self, pulsar_apps):
+        # apps[app["appid"]] = [app["name"], jobs], index job names by job id for extraction
+        self._pulsar_apps = pulsar_apps
+        self.pulsar_job_names = {}
+        for _, v in pulsar_apps.items():
             for job in v[1]:
-                jobid = job["jobid"]
-                if jobid == pulsar_job_id:
-                    jobname = job["name"]
-                    return jobname
-        return ""
+                self.pulsar_job_names.setdefault(job["jobid"], job["name"])
+
+    def get_pulsar_job_name_from_id(self, pulsar_job_id):
+        return self.pulsar_job_names.get(pulsar_job_id, "")
 
     def create_url(self, metrics, query_params, networks):
         # create dictionary with metrics name and url to check for all configured metrics in conf.yaml file
@@ -118,45 +179,73 @@ class Ns1Check(AgentCheck):
         return checkUrl
 
     def get_ddi_scope_groups(self):
-        url = "{apiendpoint}/v1/dhcp/scopegroup".format(apiendpoint=self.api_endpoint)
-        res = self.get_stats(url)
+        def fetch():
+            url = NS1_ENDPOINTS["ddi.scopegroups"].format(apiendpoint=self.api_endpoint)
+            res = self.get_stats(url)
+            # list of [id, name], json would turn integer ids into strings in the persistent cache
+            return [[group["id"], group["name"]] for group in res]
+
         scopegroups = {}
-        for group in res:
-            group_id = group["id"]
-            group_name = group["name"]
+        for group_id, group_name in self.get_reference_data("scopegroups", fetch):
             scopegroups[group_id] = group_name
         return scopegroups
 
     def get_networks(self, networks):
-        url = "{apiendpoint}/v1/networks".format(apiendpoint=self.api_endpoint)
-        res = self.get_stats(url)
-        msg = 'Get networks API Query URL: {url}'.format(url=url)
-        self.log.info(msg)
-        msg = 'Get Networks API result: {result}'.format(result=json.dumps(res))
-        self.log.info(msg)
+        def fetch():
+            url = NS1_ENDPOINTS["networks"].format(apiendpoint=self.api_endpoint)
+            res = self.get_stats(url)
+            # list of [network_id, name], json would turn integer ids into strings in the persistent cache
+            return [[net["network_id"], net["name"]] for net in res]
 
         nets = {}
-        for net in res:
-            network_id = net["network_id"]
+        for network_id, network_name in self.get_reference_data("networks", fetch):
             if network_id in networks:
-                network_name = net["name"]
                 nets[network_id] = network_name
         return nets
 
     def get_zone_records(self, zonename):
-        url = "{apiendpoint}/v1/zones/{zone}".format(apiendpoint=self.api_endpoint, zone=zonename)
-        res = self.get_stats(url)
-        records = res["records"]
-        recmap = {}
-        result = []
-        for r in records:
-            domain = r["domain"]
-            rtype = r["type"]
-            if rtype != "NS":
-                recmap[domain] = rtype
-        if recmap and len(recmap) > 0:
-            result.append(recmap)
-        return result
+        def fetch():
+            url = NS1_ENDPOINTS["zone"].format(apiendpoint=self.api_endpoint, domain=zonename)
+            res = self.get_stats(url)
+            records = res["records"]
+            recmap = {}
+            result = []
+            for r in records:
+                domain = r["domain"]
+                rtype = r["type"]
+                if rtype != "NS":
+                    recmap[domain] = rtype
+            if recmap and len(recmap) > 0:
+                result.append(recmap)
+            return result
+
+        return self.get_reference_data("zone_records.{zone}".format(zone=zonename), fetch)
+
+    def get_reference_data(self, key, fetch):
+        # return slow changing reference data from the cache, or fetch it if it is missing or expired
+        if not self.reference_cache_ttl:
+            return fetch()
+
+        now = time.time()
+        entry = self.reference_cache.get(key)
+        if entry and now - entry[0] < self.reference_cache_ttl:
+            return entry[1]
+
+        value = fetch()
+        self.reference_cache[key] = [now, value]
+        # drop expired entries, for example zones that are not configured anymore
+        for k in list(self.reference_cache):
+            if now - self.reference_cache[k][0] >= self.reference_cache_ttl:
+                del self.reference_cache[k]
+        self.set_reference_cache()
+        return value
+
+    def get_reference_cache(self):
+        cachedata = self.read_persistent_cache(self.NS1_REFERENCE_CACHE_KEY) if self.reference_cache_ttl else None
+        self.reference_cache = json.loads(cachedata) if cachedata else {}
+
+    def set_reference_cache(self):
+        self.write_persistent_cache(self.NS1_REFERENCE_CACHE_KEY, json.dumps(self.reference_cache))
 
     def get_usage_count(self):
         cashedata = self.read_persistent_cache(self.NS1_CACHE_KEY)
@@ -199,14 +288,17 @@ class Ns1Check(AgentCheck):
             return None, False
 
     def get_pulsar_applications(self):
-        url = "{apiendpoint}/v1/pulsar/apps".format(apiendpoint=self.api_endpoint)
-        res = self.get_stats(url)
-        apps = {}
-        for app in res:
-            joburl = url + "/{app_id}/jobs".format(app_id=app["appid"])
-            jobs = self.get_stats(joburl)
-            apps[app["appid"]] = [app["name"], jobs]
-        return apps
+        def fetch():
+            url = NS1_ENDPOINTS["pulsar.apps"].format(apiendpoint=self.api_endpoint)
+            res = self.get_stats(url)
+            apps = {}
+            for app in res:
+                joburl = NS1_ENDPOINTS["pulsar.apps.jobs"].format(apiendpoint=self.api_endpoint, app_id=app["appid"])
+                jobs = self.get_stats(joburl)
+                apps[app["appid"]] = [app["name"], jobs]
+            return apps
+
+        return self.get_reference_data("pulsar_apps", fetch)
 
     def extract_pulsar_count_by_job(self, key, jsonResult):
         try:
@@ -402,9 +494,16 @@ class Ns1Check(AgentCheck):
         retry = 0
         while True:
             try:
+                # wait for the rate limit shared with the other requests instead of hitting a 429
+                self.rate_limiter.acquire()
+                start = time.time()
                 response = self.http.get(url, extra_headers=self.headers, timeout=60)
+                self.rate_limiter.update(response.headers)
                 response.raise_for_status()
+                response_size = len(response.content)
+                self.api_requests.append((url, time.time() - start, response_size))
                 response_json = response.json()
+                self.trace_response(url, response_json)
 
                 return response_json
 
@@ -428,23 +527,16 @@ class Ns1Check(AgentCheck):
                         raise
 
                     else:
-                        # read rate limit headers and caculate the sleep time
-                        ratelimit_period = response.headers['X-RateLimit-Period']
-                        if ratelimit_period is None or ratelimit_period == 0:
-                            ratelimit_period = 300
-
-                        ratelimit_limit = response.headers['X-RateLimit-Limit']
-                        if ratelimit_limit is None or ratelimit_limit == 0:
-                            ratelimit_limit = 100
-
-                        next_request_available_in_seconds = int(ratelimit_period) / int(ratelimit_limit)
+                        # read rate limit headers, all requests will wait for the next available slot
+                        ratelimit_period, ratelimit_limit, next_request_available_in_seconds = (
+                            self.rate_limiter.exhaust(response.headers)
+                        )
                         msg = "Rate limit reached, X-RateLimit-Period: {}, X-RateLimit-Limit: {}, sleeping: {}".format(
                             ratelimit_period, ratelimit_limit, next_request_available_in_seconds
                         )
                         self.log.warning(msg)
 
                         retry += 1
-                        time.sleep(next_request_available_in_seconds)
                         continue
 
                 # Not 429 - notify the error and raise the expection
@@ -473,16 +565,38 @@ class Ns1Check(AgentCheck):
                 )
                 raise
 
+    def trace_response(self, url, response_json):
+        if self.debug_trace_sample_rate and random.random() < self.debug_trace_sample_rate:
+            self.log.debug('%s Query URL: %s, result: %s', self.LOG_MSG_PREFIX, url, LazyJson(response_json))
+
+    def send_api_request_metrics(self):
+        # time spent and payload size per API endpoint queried during the run
+        totals = {}
+        for url, duration, response_size in self.api_requests:
+            endpoint = get_endpoint_path(urlparse(url).path)
+            total = totals.setdefault(endpoint, [0, 0])
+            total[0] += duration
+            total[1] += response_size
+        for endpoint, (duration, response_size) in totals.items():
+            tags = ["endpoint:{endpoint}".format(endpoint=endpoint)]
+            self.gauge('ns1.api.request.duration', duration, tags)
+            self.gauge('ns1.api.response.bytes', response_size, tags)
+        self.api_requests = []
+
     def remove_prefix(self, text, prefix):
         if text.startswith(prefix):
             return text[len(prefix) :]
         return text
 
     def send_metrics(self, metric_name, metric_value, tags, metric_type):
-        msg = '{prefix} Metric: {name}, Value: {value}, Tag: {tag}, Type: {type}'.format(
-            prefix=self.LOG_MSG_PREFIX, name=metric_name, value=metric_value, tag=tags, type=metric_type
+        self.log.debug(
+            '%s Metric: %s, Value: %s, Tag: %s, Type: %s',
+            self.LOG_MSG_PREFIX,
+            metric_name,
+            metric_value,
+            tags,
+            metric_type,
         )
-        self.log.info(msg)
         if metric_name == "billing":
             for k, v in metric_value.items():
                 # {"usage": 1234, "limit": 500000}
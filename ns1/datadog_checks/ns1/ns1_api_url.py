@@ -1,3 +1,5 @@
+import re
+
 # NS1 API endpoints that will be queried to retrieve statistics
 NS1_ENDPOINTS = {
     # qps and usage stats account wide
@@ -36,4 +38,35 @@ NS1_ENDPOINTS = {
     "pulsar.routemap.hit.record": "{apiendpoint}/v1/pulsar/query/routemap/hit/record/{rec_name}/{rec_type}{query}",
     # View route map misses by record
     "pulsar.routemap.miss.record": "{apiendpoint}/v1/pulsar/query/routemap/miss/record/{rec_name}/{rec_type}{query}",
+    # DHCP scope groups
+    "ddi.scopegroups": "{apiendpoint}/v1/dhcp/scopegroup",
+    # networks
+    "networks": "{apiendpoint}/v1/networks",
+    # zone records
+    "zone": "{apiendpoint}/v1/zones/{domain}",
+    # pulsar applications
+    "pulsar.apps": "{apiendpoint}/v1/pulsar/apps",
+    # pulsar jobs of an application
+    "pulsar.apps.jobs": "{apiendpoint}/v1/pulsar/apps/{app_id}/jobs",
 }
+
+
+def _endpoint_path(url_template):
+    # "{apiendpoint}/v1/stats/{key}/{domain}{query}" -> "/v1/stats/:key/:domain"
+    path = url_template.replace("{apiendpoint}", "").replace("{query}", "").split("?")[0]
+    return re.sub(r"\{(\w+)\}", r":\1", path)
+
+
+# (regex, path) of the endpoints, the ones with the fewest placeholders are matched first
+NS1_ENDPOINT_PATHS = [
+    (re.compile("^" + re.sub(r":\w+", "[^/]+", path) + "$"), path)
+    for path in sorted(set(_endpoint_path(url) for url in NS1_ENDPOINTS.values()), key=lambda p: p.count(":"))
+]
+
+
+def get_endpoint_path(path):
+    # bounded tag value for an API request, ids and names in the path are replaced by their placeholder
+    for regex, endpoint_path in NS1_ENDPOINT_PATHS:
+        if regex.match(path):
+            return endpoint_path
+    return "unknown"
@@ -0,0 +1,79 @@
+import threading
+import time
+
+RATELIMIT_LIMIT_DEFAULT = 100
+RATELIMIT_PERIOD_DEFAULT = 300
+
+
+def _header_int(headers, name, default):
+    try:
+        value = int(headers.get(name))
+    except (TypeError, ValueError):
+        return default
+    return value if value > 0 else default
+
+
+class Ns1RateLimiter:
+    # Token bucket shared by every request of the check, fed by the NS1 X-RateLimit-* response headers.
+    # NS1 allows X-RateLimit-Limit requests per X-RateLimit-Period seconds, and X-RateLimit-Remaining
+    # tells how many of them are left. Until a response carrying those headers is received, requests are not throttled.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.limit = None
+        self.period = None
+        self.tokens = None
+        self.last_refill = None
+
+    def refill(self, now):
+        elapsed = now - self.last_refill
+        if elapsed > 0:
+            self.tokens = min(self.limit, self.tokens + elapsed * self.limit / float(self.period))
+            self.last_refill = now
+
+    def acquire(self):
+        # block until the rate limit allows one more request, returns the time spent waiting
+        waited = 0
+        while True:
+            with self.lock:
+                if self.limit is None:
+                    return waited
+                self.refill(time.time())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) * self.period / float(self.limit)
+            time.sleep(wait)
+            waited += wait
+
+    def update(self, headers):
+        # sync the bucket with the rate limit headers of a response
+        if headers.get('X-RateLimit-Limit') is None:
+            return
+        limit = _header_int(headers, 'X-RateLimit-Limit', RATELIMIT_LIMIT_DEFAULT)
+        period = _header_int(headers, 'X-RateLimit-Period', RATELIMIT_PERIOD_DEFAULT)
+        try:
+            remaining = max(0, int(headers.get('X-RateLimit-Remaining')))
+        except (TypeError, ValueError):
+            remaining = limit
+        with self.lock:
+            now = time.time()
+            if self.limit is None:
+                self.tokens = remaining
+            else:
+                # requests still in flight already took their token, so never go above what is left locally
+                self.refill(now)
+                self.tokens = min(self.tokens, remaining)
+            self.limit = limit
+            self.period = period
+            self.last_refill = now
+
+    def exhaust(self, headers):
+        # a request was rejected with a 429, make every worker wait for the bucket to refill
+        limit = _header_int(headers, 'X-RateLimit-Limit', RATELIMIT_LIMIT_DEFAULT)
+        period = _header_int(headers, 'X-RateLimit-Period', RATELIMIT_PERIOD_DEFAULT)
+        with self.lock:
+            self.limit = limit
+            self.period = period
+            self.tokens = 0
+            self.last_refill = time.time()
+        return period, limit, period / float(limit)
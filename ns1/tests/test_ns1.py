@@ -1,11 +1,14 @@
 import json
 import logging
+import re
 
+import mock
 import pytest
 from requests.exceptions import HTTPError
 
 from datadog_checks.base import ConfigurationError
 from datadog_checks.ns1 import Ns1Check
+from datadog_checks.ns1.ns1_api_url import get_endpoint_path
 
 
 def test_empty_instance(aggregator, instance_empty):
@@ -864,3 +867,148 @@ def test_remove_prefix(aggregator, instance_1):
     check = Ns1Check('ns1', {}, [instance_1])
     assert check.remove_prefix("prefix_text", "prefix_") == "text"
     assert check.remove_prefix("text", "noprefix_") == "text"
+
+
+def test_check_concurrent_requests(aggregator, requests_mock):
+    instance = {
+        'api_endpoint': 'https://my.nsone.net',
+        'api_key': 'testkey',
+        'max_concurrent_requests': 3,
+        'metrics': {'qps': None, 'usage': None, 'account': [{'billing': None}]},
+    }
+    check = Ns1Check('ns1', {}, [instance])
+    headers = {'X-RateLimit-Limit': '100', 'X-RateLimit-Period': '1', 'X-RateLimit-Remaining': '99'}
+    requests_mock.get('https://my.nsone.net/v1/stats/qps', json={'qps': 12.5}, headers=headers)
+    requests_mock.get(
+        'https://my.nsone.net/v1/stats/usage?period=1h&expand=false',
+        json=[{'graph': [[1600000000, 10], [1600003600, 20]]}],
+        headers=headers,
+    )
+    requests_mock.get(
+        'https://my.nsone.net/v1/account/billataglance',
+        json={'totals': {'queries': 1234}, 'any': {'query_credit': 500000}},
+        headers=headers,
+    )
+
+    with mock.patch.object(check, 'service_check') as service_check:
+        check.check(instance)
+
+    aggregator.assert_metric('ns1.qps', value=12.5, count=1)
+    aggregator.assert_metric('ns1.usage', value=20, count=1)
+    aggregator.assert_metric('ns1.billing', value=1234, tags=['billing:usage'], count=1)
+    aggregator.assert_metric('ns1.billing', value=500000, tags=['billing:limit'], count=1)
+    assert service_check.call_args[0][:2] == (Ns1Check.NS1_SERVICE_CHECK, Ns1Check.OK)
+    assert check.rate_limiter.limit == 100
+    # requests to the same endpoint are summed, whatever the ids in their path
+    for endpoint in ('/v1/stats/:key', '/v1/account/billataglance'):
+        aggregator.assert_metric('ns1.api.request.duration', tags=['endpoint:' + endpoint], count=1)
+        aggregator.assert_metric('ns1.api.response.bytes', tags=['endpoint:' + endpoint], count=1)
+    usage_size = len(json.dumps([{'graph': [[1600000000, 10], [1600003600, 20]]}]))
+    aggregator.assert_metric(
+        'ns1.api.response.bytes', value=len('{"qps": 12.5}') + usage_size, tags=['endpoint:/v1/stats/:key']
+    )
+
+
+def test_check_concurrent_requests_error(aggregator, requests_mock):
+    instance = {
+        'api_endpoint': 'https://my.nsone.net',
+        'api_key': 'testkey',
+        'max_concurrent_requests': 2,
+        'metrics': {'qps': None, 'account': [{'billing': None}]},
+    }
+    check = Ns1Check('ns1', {}, [instance])
+    requests_mock.get('https://my.nsone.net/v1/stats/qps', json={'qps': 12.5})
+    requests_mock.get('https://my.nsone.net/v1/account/billataglance', status_code=500)
+
+    with pytest.raises(HTTPError):
+        check.check(instance)
+    aggregator.assert_service_check(Ns1Check.NS1_SERVICE_CHECK, Ns1Check.CRITICAL)
+
+
+def test_invalid_max_concurrent_requests(instance_ddi):
+    instance_ddi['max_concurrent_requests'] = -1
+    with pytest.raises(ConfigurationError):
+        Ns1Check('ns1', {}, [instance_ddi])
+
+
+def test_reference_cache(aggregator, datadog_agent, instance_ddi, requests_mock):
+    instance_ddi['reference_cache_ttl'] = 3600
+    check = Ns1Check('ns1', {}, [instance_ddi])
+    url = "{apiendpoint}/v1/dhcp/scopegroup".format(apiendpoint=check.api_endpoint)
+    scopegroups = requests_mock.get(url, json=[{"id": 2, "name": "scope1"}])
+    requests_mock.get(re.compile(r'/v1/stats/'), json={})
+
+    with mock.patch('datadog_checks.ns1.check.time.time', return_value=1000):
+        check.run()
+        check.run()
+    assert scopegroups.call_count == 1
+
+    # restarted agent reads the cache persisted by the check runs, integer ids are preserved
+    check = Ns1Check('ns1', {}, [instance_ddi])
+    with mock.patch('datadog_checks.ns1.check.time.time', return_value=4000):
+        check.run()
+        checkUrl = check.create_url(check.metrics, check.query_params, check.networks)
+    assert scopegroups.call_count == 1
+    assert checkUrl["leases.2"][2] == ["scope_group:scope1"]
+
+    # expired
+    with mock.patch('datadog_checks.ns1.check.time.time', return_value=4600):
+        check.create_url(check.metrics, check.query_params, check.networks)
+    assert scopegroups.call_count == 2
+
+
+def test_reference_cache_disabled(aggregator, datadog_agent, instance_ddi, requests_mock):
+    check = Ns1Check('ns1', {}, [instance_ddi])
+    url = "{apiendpoint}/v1/dhcp/scopegroup".format(apiendpoint=check.api_endpoint)
+    scopegroups = requests_mock.get(url, json=[{"id": 2, "name": "scope1"}])
+
+    check.create_url(check.metrics, check.query_params, check.networks)
+    check.create_url(check.metrics, check.query_params, check.networks)
+    assert scopegroups.call_count == 2
+    assert datadog_agent.read_persistent_cache(check.check_id + Ns1Check.NS1_REFERENCE_CACHE_KEY) == ''
+
+
+def test_pulsar_job_names_index(aggregator, instance):
+    check = Ns1Check('ns1', {}, [instance])
+    assert check.get_pulsar_job_name_from_id("1xtvhvx") == ""
+
+    check.pulsar_apps = {
+        "app1": ["App 1", [{"jobid": "job1", "name": "Job 1"}, {"jobid": "job2", "name": "Job 2"}]],
+        "app2": ["App 2", [{"jobid": "job3", "name": "Job 3"}]],
+    }
+    assert check.pulsar_job_names == {"job1": "Job 1", "job2": "Job 2", "job3": "Job 3"}
+    assert check.get_pulsar_job_name_from_id("job3") == "Job 3"
+    assert check.get_pulsar_job_name_from_id("xxx") == ""
+
+
+def test_debug_trace_sampling(aggregator, instance_1, requests_mock):
+    url = 'https://my.nsone.net/v1/stats/qps'
+    requests_mock.get(url, json={'qps': 12.5})
+
+    check = Ns1Check('ns1', {}, [instance_1])
+    with mock.patch.object(check, 'log') as log:
+        check.get_stats(url)
+    log.debug.assert_not_called()
+
+    instance_1['debug_trace_sample_rate'] = 1
+    check = Ns1Check('ns1', {}, [instance_1])
+    with mock.patch.object(check, 'log') as log:
+        check.get_stats(url)
+    args = log.debug.call_args[0]
+    assert args[2] == url
+    assert str(args[3]) == '{"qps": 12.5}'
+
+
+def test_invalid_debug_trace_sample_rate(instance_1):
+    instance_1['debug_trace_sample_rate'] = 2
+    with pytest.raises(ConfigurationError):
+        Ns1Check('ns1', {}, [instance_1])
+
+
+def test_endpoint_path():
+    path = '/v1/stats/usage/example.com/www.example.com/A'
+    assert get_endpoint_path(path) == '/v1/stats/:key/:domain/:record/:rectype'
+    assert get_endpoint_path('/v1/stats/leases') == '/v1/stats/leases'
+    assert get_endpoint_path('/v1/stats/leases/5') == '/v1/stats/leases/:scope_group_id'
+    assert get_endpoint_path('/v1/pulsar/apps/abc/jobs') == '/v1/pulsar/apps/:app_id/jobs'
+    assert get_endpoint_path('/v1/not/an/endpoint') == 'unknown'
@@ -0,0 +1,62 @@
+import mock
+
+from datadog_checks.ns1.ns1_rate_limit import Ns1RateLimiter
+
+HEADERS = {'X-RateLimit-Limit': '10', 'X-RateLimit-Period': '5', 'X-RateLimit-Remaining': '2'}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_no_throttling_without_headers():
+    limiter = Ns1RateLimiter()
+    with mock.patch('datadog_checks.ns1.ns1_rate_limit.time') as clock:
+        for _ in range(100):
+            assert limiter.acquire() == 0
+        limiter.update({})
+        assert limiter.acquire() == 0
+        clock.sleep.assert_not_called()
+
+
+def test_acquire_waits_when_bucket_is_empty():
+    limiter = Ns1RateLimiter()
+    clock = FakeClock()
+    with mock.patch('datadog_checks.ns1.ns1_rate_limit.time', clock):
+        limiter.update(HEADERS)
+        assert limiter.acquire() == 0
+        assert limiter.acquire() == 0
+        # 10 requests per 5 seconds, one token every 0.5 second
+        assert limiter.acquire() == 0.5
+        assert clock.sleeps == [0.5]
+
+
+def test_update_never_adds_tokens_taken_by_requests_in_flight():
+    limiter = Ns1RateLimiter()
+    clock = FakeClock()
+    with mock.patch('datadog_checks.ns1.ns1_rate_limit.time', clock):
+        limiter.update(HEADERS)
+        limiter.acquire()
+        limiter.acquire()
+        # late response of a request sent before the bucket was emptied
+        limiter.update(dict(HEADERS, **{'X-RateLimit-Remaining': '5'}))
+        assert limiter.tokens == 0
+
+
+def test_exhaust():
+    limiter = Ns1RateLimiter()
+    clock = FakeClock()
+    with mock.patch('datadog_checks.ns1.ns1_rate_limit.time', clock):
+        assert limiter.exhaust(HEADERS) == (5, 10, 0.5)
+        assert limiter.acquire() == 0.5
+        # defaults when the headers are missing
+        assert limiter.exhaust({}) == (300, 100, 3.0)
@@ -1,14 +1,104 @@
 import sys
+import time
 from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
 
 import requests  # SKIP_HTTP_VALIDATION
-from requests.auth import HTTPBasicAuth
 
-from datadog_checks.base import AgentCheck, ConfigurationError
+from datadog_checks.base import AgentCheck, ConfigurationError, is_affirmative
 from datadog_checks.base.errors import CheckException
 
 EVENT_TYPE = SOURCE_TYPE_NAME = 'redisenterprise'
 
+BDB_GAUGES = {
+    stat: 'redisenterprise.{}'.format(stat)
+    for stat in [
+        'avg_latency',
+        'avg_latency_max',
+        'avg_other_latency',
+        'avg_read_latency',
+        'avg_write_latency',
+        'conns',
+        'egress_bytes',
+        'evicted_objects',
+        'expired_objects',
+        'fork_cpu_system',
+        'ingress_bytes',
+        'listener_acc_latency',
+        'main_thread_cpu_system',
+        'main_thread_cpu_system_max',
+        'memory_limit',
+        'no_of_keys',
+        'other_req',
+        'read_hits',
+        'read_misses',
+        'read_req',
+        'shard_cpu_system',
+        'shard_cpu_system_max',
+        'total_req',
+        'total_req_max',
+        'used_memory',
+        'write_hits',
+        'write_misses',
+        'write_req',
+        'bigstore_objs_ram',
+        'bigstore_objs_flash',
+        'bigstore_io_reads',
+        'bigstore_io_writes',
+        'bigstore_throughput',
+        'big_write_ram',
+        'big_write_flash',
+        'big_del_ram',
+        'big_del_flash',
+    ]
+}
+
+CRDT_STATS = {
+    "egress_bytes": "redis_enterprise.crdt_egress_bytes",
+    "egress_bytes_decompressed": "redis_enterprise.crdt_egress_bytes_decompressed",
+    "ingress_bytes": "redis_enterprise.crdt_ingress_bytes",
+    "ingress_bytes_decompressed": "redis_enterprise.crdt_ingress_bytes_decompressed",
+    "local_ingress_lag_time": "redis_enterprise.crdt_local_lag",
+    "pending_local_writes_max": "redis_enterprise.crdt_pending_max",
+    "pending_local_writes_min": "redis_enterprise.crdt_pending_min",
+}
+
+SHARD_GAUGES = {
+    stat: 'redisenterprise.shard.{}'.format(stat)
+    for stat in [
+        'connected_clients',
+        'evicted_objects',
+        'expired_objects',
+        'mem_frag_ratio',
+        'no_of_keys',
+        'read_hits',
+        'read_misses',
+        'shard_cpu_system',
+        'shard_cpu_user',
+        'total_req',
+        'used_memory',
+        'write_hits',
+        'write_misses',
+    ]
+}
+
+NODE_GAUGES = {
+    stat: 'redisenterprise.node.{}'.format(stat)
+    for stat in [
+        'available_memory',
+        'conns',
+        'cpu_idle',
+        'cpu_system',
+        'cpu_user',
+        'egress_bytes',
+        'ephemeral_storage_free',
+        'free_memory',
+        'ingress_bytes',
+        'persistent_storage_free',
+        'total_req',
+    ]
+}
+
 
 class RedisenterpriseCheck(AgentCheck):
     """RedisenterpriseCheck attempts to connect to the cluster and ensure the node is the master node"""
@@ -24,12 +114,19 @@ class RedisenterpriseCheck(AgentCheck):
         super(RedisenterpriseCheck, self).__init__(name, init_config, instances)
         # Set this to two minutes ago which may cause duplicates but we need to get everything in the case of failover
         self.last_event_timestamp_seen = datetime.utcnow() - timedelta(0, 120)
+        self.shard_stats = is_affirmative(self.instance.get('shard_stats', False))
+        self.node_stats = is_affirmative(self.instance.get('node_stats', False))
+        # shard ID to database ID mapping, only refreshed when the databases change
+        self._bdb_dict = None
+        self._shard_dict = None
+        # the leader probe result is reused for this many seconds
+        self.leader_check_ttl = self.instance.get('leader_check_ttl', 60)
+        self._is_leader = None
+        self._is_leader_expiry = 0
 
     def _timestamp(self, date):
         """Allows us to return an epoch time stamp if we use python2 or python3"""
         if sys.version_info[0] < 3 or sys.version_info[1] < 4:
-            import time
-
             return int(time.mktime(date.timetuple()))
         else:
             return int(date.timestamp())
@@ -42,7 +139,8 @@ class RedisenterpriseCheck(AgentCheck):
         password = self.instance.get('password')
         event_limit = self.instance.get('event_limit', 100)
         is_mock = self.instance.get('is_mock', False)
-        service_check_tags = self.instance.get('tags', [])
+        # copy the configured tags, they must not grow with every run
+        service_check_tags = list(self.instance.get('tags', []))
 
         if not host:
             raise ConfigurationError(
@@ -62,19 +160,24 @@ class RedisenterpriseCheck(AgentCheck):
                 self._get_license(host, port, service_check_tags)
 
                 # collect the node data
-                self._get_nodes(host, port, service_check_tags)
+                nodes = self._get_nodes(host, port, service_check_tags)
 
                 # grab the DBD ID to name mapping
                 bdb_dict = self._get_bdb_dict(host, port, service_check_tags)
-                self._get_bdb_stats(host, port, bdb_dict, service_check_tags)
+                db_tags = self._get_db_tags(bdb_dict, service_check_tags)
+                self._get_bdb_stats(host, port, bdb_dict, db_tags, service_check_tags)
                 self._shard_usage(bdb_dict, service_check_tags, host)
 
+                # optionally collect the per shard and per node stats
+                if self.shard_stats or self.node_stats:
+                    self._get_shard_node_stats(host, db_tags, nodes, service_check_tags)
+
                 # collect the events from the API - we set the timeout higher here
                 self._get_events(host, port, username, password, bdb_dict, service_check_tags, event_limit)
 
                 # if there are bdbs with crdt collect those stats
                 for j in [k for k, v in bdb_dict.items() if v['crdt']]:
-                    self._get_crdt_stats(host, port, j, bdb_dict, service_check_tags)
+                    self._get_crdt_stats(host, port, j, db_tags, service_check_tags)
 
                 # update the timestamp if everything else passes
                 self.last_timestamp_seen = datetime.utcnow()
@@ -90,6 +193,8 @@ class RedisenterpriseCheck(AgentCheck):
             self.last_timestamp_seen = datetime.utcnow()
 
         except Exception as e:
+            # the leader may have changed, probe it again on the next run
+            self._is_leader = None
             # if we have issues we want to know when not running in mock
             if not is_mock:
                 self.service_check('redisenterprise.running', self.CRITICAL, message=str(e), tags=service_check_tags)
@@ -102,18 +207,21 @@ class RedisenterpriseCheck(AgentCheck):
         if is_mock:
             return False
 
-        # We are using requests specifically because we do not want to follow redirects
-        r = requests.get(
+        now = time.time()
+        if self._is_leader is not None and now < self._is_leader_expiry:
+            return self._is_leader
+
+        # Redirects must not be followed, the credentials and TLS options come from the HTTP wrapper
+        r = self.http.get(
             'https://{}:{}/v1/cluster'.format(host, port),
-            auth=HTTPBasicAuth(username, password),
-            headers={'Content-Type': 'application/json'},
+            extra_headers={'Content-Type': 'application/json'},
             allow_redirects=False,
-            verify=False,
+            persist=True,
         )
 
-        if r.status_code != 307:
-            return True
-        return False
+        self._is_leader = r.status_code != 307
+        self._is_leader_expiry = now + self.leader_check_ttl
+        return self._is_leader
 
     def _api_fetch_json(self, endpoint, service_check_tags, params=None):
         host = self.instance.get('host')
@@ -121,7 +229,8 @@ class RedisenterpriseCheck(AgentCheck):
         """ Get a Python dictionary back from a Redis Enterprise endpoint """
         headers_sent = {'Content-Type': 'application/json'}
         url = 'https://{}:{}/v1/{}'.format(host, port, endpoint)
-        r = self.http.get(url, extra_headers=headers_sent, params=params)
+        # all the API requests share one pooled session
+        r = self.http.get(url, extra_headers=headers_sent, params=params, persist=True)
         if r.status_code != 200:
             msg = "unexpected status of {0} when fetching stats, response: {1}"
             msg = msg.format(r.status_code, r.text)
@@ -169,8 +278,74 @@ class RedisenterpriseCheck(AgentCheck):
                 'crdt': i['crdt'],
                 'endpoints': endpoint_count,
             }
+
+        # the shard mapping is stale as soon as a database is added, removed or resharded
+        if bdb_dict != self._bdb_dict:
+            self._bdb_dict = bdb_dict
+            self._shard_dict = None
         return bdb_dict
 
+    def _get_db_tags(self, bdb_dict, service_check_tags):
+        """Build the tags of every database once per run"""
+        return {uid: ['database:{}'.format(bdb['name'])] + service_check_tags for uid, bdb in bdb_dict.items()}
+
+    def _api_fetch_all(self, endpoints, service_check_tags):
+        """Fetch several endpoints concurrently, an endpoint returning a 404 is empty"""
+
+        def fetch(endpoint):
+            try:
+                return self._api_fetch_json(endpoint, service_check_tags)
+            except requests.exceptions.HTTPError as e:
+                if e.response is not None and e.response.status_code == 404:
+                    return {}
+                raise
+
+        pool = ThreadPool(len(endpoints))
+        try:
+            return pool.map(fetch, endpoints)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _get_shard_node_stats(self, host, db_tags, nodes, service_check_tags):
+        """Collect the per shard and per node stats"""
+        endpoints = []
+        if self.shard_stats:
+            endpoints.append('shards/stats/last')
+            if self._shard_dict is None:
+                endpoints.append('shards')
+        if self.node_stats:
+            endpoints.append('nodes/stats/last')
+        results = dict(zip(endpoints, self._api_fetch_all(endpoints, service_check_tags)))
+
+        if 'shards' in results:
+            self._shard_dict = {int(x['uid']): int(x['bdb_uid']) for x in results['shards']}
+
+        shard_dict = self._shard_dict or {}
+        for uid, stats in results.get('shards/stats/last', {}).items():
+            bdb = shard_dict.get(int(uid))
+            if bdb in db_tags:
+                tgs = ['shard:{}'.format(uid)] + db_tags[bdb]
+            else:
+                # the shard was created since the mapping was fetched, refresh it on the next run
+                self._shard_dict = None
+                tgs = ['shard:{}'.format(uid)] + service_check_tags
+            for j, value in stats.items():
+                metric = SHARD_GAUGES.get(j)
+                if metric:
+                    self.gauge(metric, value, tags=tgs)
+
+        node_addrs = {int(x['uid']): x.get('addr') for x in nodes}
+        for uid, stats in results.get('nodes/stats/last', {}).items():
+            tgs = ['node:{}'.format(uid)]
+            if node_addrs.get(int(uid)):
+                tgs.append('node_address:{}'.format(node_addrs[int(uid)]))
+            tgs += service_check_tags
+            for j, value in stats.items():
+                metric = NODE_GAUGES.get(j)
+                if metric:
+                    self.gauge(metric, value, tags=tgs)
+
     def _get_events(self, host, port, username, password, bdb_dict, service_check_tags, event_limit):
         """Scrape the LOG endpoint and put all log entries into Datadog events"""
 
@@ -202,78 +377,23 @@ class RedisenterpriseCheck(AgentCheck):
             if ts > self.last_event_timestamp_seen:
                 self.last_event_timestamp_seen = ts + timedelta(0, 1)
 
-    def _get_crdt_stats(self, host, port, bdb, bdb_dict, service_check_tags):
+    def _get_crdt_stats(self, host, port, bdb, db_tags, service_check_tags):
         """Collect CRDT stats from the BDB endpoint"""
-        crdt_stats = {
-            "egress_bytes": "crdt_egress_bytes",
-            "egress_bytes_decompressed": "crdt_egress_bytes_decompressed",
-            "ingress_bytes": "crdt_ingress_bytes",
-            "ingress_bytes_decompressed": "crdt_ingress_bytes_decompressed",
-            "local_ingress_lag_time": "crdt_local_lag",
-            "pending_local_writes_max": "crdt_pending_max",
-            "pending_local_writes_min": "crdt_pending_min",
-        }
-
         params = {
             "stime": self.last_event_timestamp_seen.strftime("%Y-%m-%dT%H:%M:%SZ"),
             "interval": "10sec",
         }
         peer_stats = self._api_fetch_json('bdbs/{}/peer_stats'.format(bdb), service_check_tags, params=params)
         for z in peer_stats['peer_stats']:
-            tgs = []
-            tgs.append('database:{}'.format(bdb_dict[int(bdb)]['name']))
-            for k, v in crdt_stats.items():
+            tgs = db_tags[int(bdb)] + ['crdt_peerid:{}'.format(z.get('uid'))]
+            for k, v in CRDT_STATS.items():
                 try:
-                    self.gauge(
-                        'redis_enterprise.{}'.format(v),
-                        z['intervals'][-1][k],
-                        tags=tgs + ['crdt_peerid:{}'.format(z.get('uid'))] + service_check_tags,
-                    )
+                    self.gauge(v, z['intervals'][-1][k], tags=tgs)
                 except Exception as e:
                     self.log.debug(str(e))
 
-    def _get_bdb_stats(self, host, port, bdb_dict, service_check_tags):
+    def _get_bdb_stats(self, host, port, bdb_dict, db_tags, service_check_tags):
         """Collect Enterprise database related stats"""
-        gauges = [
-            'avg_latency',
-            'avg_latency_max',
-            'avg_other_latency',
-            'avg_read_latency',
-            'avg_write_latency',
-            'conns',
-            'egress_bytes',
-            'evicted_objects',
-            'expired_objects',
-            'fork_cpu_system',
-            'ingress_bytes',
-            'listener_acc_latency',
-            'main_thread_cpu_system',
-            'main_thread_cpu_system_max',
-            'memory_limit',
-            'no_of_keys',
-            'other_req',
-            'read_hits',
-            'read_misses',
-            'read_req',
-            'shard_cpu_system',
-            'shard_cpu_system_max',
-            'total_req',
-            'total_req_max',
-            'used_memory',
-            'write_hits',
-            'write_misses',
-            'write_req',
-            'bigstore_objs_ram',
-            'bigstore_objs_flash',
-            'bigstore_io_reads',
-            'bigstore_io_writes',
-            'bigstore_throughput',
-            'big_write_ram',
-            'big_write_flash',
-            'big_del_ram',
-            'big_del_flash',
-        ]
-
         # If there are no databases created the following link will 404, so we need to handle this
         try:
             stats = self._api_fetch_json("bdbs/stats/last", service_check_tags)
@@ -284,64 +404,42 @@ class RedisenterpriseCheck(AgentCheck):
             else:
                 raise e
         self.gauge('redisenterprise.database_count', len(stats), tags=service_check_tags, hostname=host)
-        for i in stats:
-            tgs = []
-            tgs.append('database:{}'.format(bdb_dict[int(i)]['name']))
+        for i, db_stats in stats.items():
+            bdb = bdb_dict[int(i)]
+            tgs = db_tags[int(i)]
             # add the stats only available from the bdb_dict
-            self.gauge(
-                'redisenterprise.endpoints', bdb_dict[int(i)]['endpoints'], tags=tgs + service_check_tags, hostname=host
-            )
-            self.gauge(
-                'redisenterprise.memory_limit',
-                bdb_dict[int(i)]['limit'],
-                tags=tgs + service_check_tags,
-                hostname=host,
-            )
+            self.gauge('redisenterprise.endpoints', bdb['endpoints'], tags=tgs, hostname=host)
+            self.gauge('redisenterprise.memory_limit', bdb['limit'], tags=tgs, hostname=host)
             # derive our own stats from others
             self.gauge(
                 'redisenterprise.used_memory_percent',
-                100 * stats[i]['used_memory'] / bdb_dict[int(i)]['limit'],
-                tags=tgs + service_check_tags,
+                100 * db_stats['used_memory'] / bdb['limit'],
+                tags=tgs,
                 hostname=host,
             )
             # derive our cache hit rate - be sure not to divide by 0
-            if (
-                stats[i]['read_hits'] + stats[i]['read_misses'] + stats[i]['write_hits'] + stats[i]['write_misses']
-            ) == 0:
-                self.gauge(
-                    'redisenterprise.cache_hit_rate',
-                    0.0,
-                    tags=tgs + service_check_tags,
-                    hostname=host,
-                )
-            else:
+            hits = db_stats['read_hits'] + db_stats['write_hits']
+            total = hits + db_stats['read_misses'] + db_stats['write_misses']
+            self.gauge(
+                'redisenterprise.cache_hit_rate',
+                100 * hits / total if total else 0.0,
+                tags=tgs,
+                hostname=host,
+            )
+            # derive flash object percentage being sure that the key exists and is not 0
+            if db_stats.get('bigstore_objs_flash', 0) > 0:
                 self.gauge(
-                    'redisenterprise.cache_hit_rate',
+                    'redisenterprise.bigstore_objs_percent',
                     100
-                    * (stats[i]['read_hits'] + stats[i]['write_hits'])
-                    / (
-                        stats[i]['read_hits']
-                        + stats[i]['read_misses']
-                        + stats[i]['write_hits']
-                        + stats[i]['write_misses']
-                    ),
-                    tags=tgs + service_check_tags,
-                    hostname=host,
+                    * db_stats['bigstore_objs_ram']
+                    / (db_stats['bigstore_objs_ram'] + db_stats['bigstore_objs_flash']),
+                    tags=tgs,
                 )
-            # derive flash object percentage being sure that the key exists and is not 0
-            if 'bigstore_objs_flash' in stats[i].keys():
-                if stats[i]['bigstore_objs_flash'] > 0:
-                    self.gauge(
-                        'redisenterprise.bigstore_objs_percent',
-                        100
-                        * stats[i]['bigstore_objs_ram']
-                        / (stats[i]['bigstore_objs_ram'] + stats[i]['bigstore_objs_flash']),
-                        tags=tgs + service_check_tags,
-                    )
-
-            for j in stats[i].keys():
-                if j in gauges:
-                    self.gauge('redisenterprise.{}'.format(j), stats[i][j], tags=tgs + service_check_tags)
+
+            for j, value in db_stats.items():
+                metric = BDB_GAUGES.get(j)
+                if metric:
+                    self.gauge(metric, value, tags=tgs)
         return 0
 
     def _get_license(self, host, port, service_check_tags):
@@ -386,3 +484,4 @@ class RedisenterpriseCheck(AgentCheck):
 
         for x in res.keys():
             self.gauge('redisenterprise.{}'.format(x), res[x], tags=service_check_tags, hostname=host)
+        return stats
@@ -0,0 +1,82 @@
+import pytest
+
+from datadog_checks.redisenterprise import RedisenterpriseCheck
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+RUNS = 10000
+WARMUP_RUNS = 1000
+
+API_RESPONSES = {
+    'cluster': {'name': 'demo.local'},
+    'license': {'expiration_date': '2099-01-01T00:00:00Z', 'shards_limit': 4, 'expired': False},
+    'nodes': [{'uid': 1, 'addr': '10.0.0.1', 'cores': 4, 'total_memory': 8000000000, 'status': 'active'}],
+    'bdbs': [
+        {
+            'uid': uid,
+            'name': 'db{:02d}'.format(uid),
+            'shards_count': 1,
+            'replication': True,
+            'memory_size': 100000000,
+            'crdt': False,
+            'endpoints': [{'addr': ['10.0.0.1']}],
+        }
+        for uid in range(1, 11)
+    ],
+    'bdbs/stats/last': {
+        str(uid): {
+            'avg_latency': 0.1,
+            'conns': 2.0,
+            'no_of_keys': 10.0,
+            'read_hits': 5.0,
+            'read_misses': 1.0,
+            'write_hits': 3.0,
+            'write_misses': 1.0,
+            'used_memory': 5000000.0,
+            'total_req': 10.0,
+        }
+        for uid in range(1, 11)
+    },
+    'logs': [],
+    'bootstrap': {'local_node_info': {'software_version': '6.2.4-55'}},
+}
+
+
+def _api_fetch_json(endpoint, service_check_tags, params=None):
+    return API_RESPONSES[endpoint]
+
+
+@pytest.mark.skipif(tracemalloc is None, reason='tracemalloc is only available on Python 3')
+@pytest.mark.benchmark(group='check-memory')
+def test_bench_check_memory_is_flat(benchmark, aggregator, instance):
+    instance['tags'] = ['team:cache']
+    check = RedisenterpriseCheck('redisenterprise', {}, [instance])
+    check._api_fetch_json = _api_fetch_json
+    # a plain function, a mock would record every call
+    check._check_not_follower = lambda *args: True
+
+    def run(runs):
+        for _ in range(runs):
+            check.check(instance)
+            aggregator.reset()
+
+    def memory_growth():
+        tracemalloc.start()
+        try:
+            run(WARMUP_RUNS)
+            start_memory = tracemalloc.get_traced_memory()[0]
+            run(RUNS - WARMUP_RUNS)
+            return tracemalloc.get_traced_memory()[0] - start_memory
+        finally:
+            tracemalloc.stop()
+
+    growth = benchmark.pedantic(memory_growth, rounds=1)
+    benchmark.extra_info['memory_growth'] = growth
+
+    assert instance['tags'] == ['team:cache']
+    assert check.instance['tags'] == ['team:cache']
+    # a handful of bytes per run would already be tens of kilobytes
+    assert growth < 16 * 1024
@@ -1,5 +1,6 @@
 from time import sleep
 
+import mock
 import pytest
 
 from datadog_checks.redisenterprise import RedisenterpriseCheck
@@ -32,3 +33,61 @@ def test_version(aggregator, instance):
     aggregator.assert_metric('redisenterprise.total_node_count', 1.0)
     aggregator.assert_metric('redisenterprise.total_active_nodes', 1.0)
     assert len(aggregator._events) > 3
+
+
+@pytest.mark.unit
+def test_shard_node_stats(aggregator, instance):
+    instance.update({'shard_stats': True, 'node_stats': True})
+    check = RedisenterpriseCheck('redisenterprise', {}, [instance])
+    responses = {
+        'bdbs': [
+            {'uid': 1, 'name': 'db01', 'shards_count': 1, 'replication': False, 'memory_size': 100, 'crdt': False}
+        ],
+        'shards': [{'uid': '1', 'bdb_uid': 1, 'node_uid': '1'}],
+        'shards/stats/last': {'1': {'used_memory': 42, 'no_of_keys': 7, 'interval': '1sec'}},
+        'nodes/stats/last': {'1': {'cpu_user': 0.5, 'free_memory': 1024}},
+    }
+    fetched = []
+
+    def api_fetch_json(endpoint, service_check_tags, params=None):
+        fetched.append(endpoint)
+        return responses[endpoint]
+
+    check._api_fetch_json = api_fetch_json
+    nodes = [{'uid': 1, 'addr': '10.0.0.1'}]
+
+    for _ in range(2):
+        bdb_dict = check._get_bdb_dict('localhost', 9443, [])
+        check._get_shard_node_stats('localhost', check._get_db_tags(bdb_dict, ['foo:bar']), nodes, ['foo:bar'])
+
+    aggregator.assert_metric(
+        'redisenterprise.shard.used_memory', 42, tags=['shard:1', 'database:db01', 'foo:bar'], count=2
+    )
+    aggregator.assert_metric('redisenterprise.shard.no_of_keys', 7, count=2)
+    aggregator.assert_metric(
+        'redisenterprise.node.free_memory', 1024, tags=['node:1', 'node_address:10.0.0.1', 'foo:bar'], count=2
+    )
+    aggregator.assert_metric('redisenterprise.node.cpu_user', 0.5, count=2)
+    # the shard mapping is only fetched again once the databases change
+    assert fetched.count('shards') == 1
+    responses['bdbs'][0]['shards_count'] = 2
+    bdb_dict = check._get_bdb_dict('localhost', 9443, [])
+    check._get_shard_node_stats('localhost', check._get_db_tags(bdb_dict, []), nodes, [])
+    assert fetched.count('shards') == 2
+
+
+@pytest.mark.unit
+def test_leader_check_cached(instance):
+    check = RedisenterpriseCheck('redisenterprise', {}, [instance])
+    response = mock.MagicMock(status_code=307)
+    with mock.patch('datadog_checks.base.utils.http.RequestsWrapper.get', return_value=response) as get:
+        with mock.patch('datadog_checks.redisenterprise.check.time.time', return_value=1000):
+            assert not check._check_not_follower('localhost', 9443, None, None, None, False)
+            assert not check._check_not_follower('localhost', 9443, None, None, None, False)
+        assert get.call_count == 1
+        assert get.call_args[1]['allow_redirects'] is False
+
+        response.status_code = 200
+        with mock.patch('datadog_checks.redisenterprise.check.time.time', return_value=1061):
+            assert check._check_not_follower('localhost', 9443, None, None, None, False)
+        assert get.call_count == 2
@@ -0,0 +1,125 @@
+# (C) Datadog, Inc. 2010-2016
+# All rights reserved
+# Licensed under Simplified BSD License (see LICENSE)
+import json
+import re
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+NUMBER = re.compile(r'[-+0-9.eE]*')
+NUMBER_START = '-0123456789'
+
+
+class JSONStreamReader(object):
+    """Incremental reader for a JSON document split across text chunks.
+
+    Only the top level object is walked by hand: the arrays under `stream_keys` are decoded one record at a time
+    and the values under `skip_keys` are decoded and dropped, so that the whole response body never has to be
+    held in memory next to the decoded data.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        # Each decoded value gets its own key cache, share one across records instead like `json.loads` does
+        self._keys = {}
+        self._decoder = json.JSONDecoder(object_pairs_hook=self._object)
+        self._buffer = u''
+        self._pos = 0
+
+    def _object(self, pairs):
+        keys = self._keys
+        return {keys.setdefault(key, key): value for key, value in pairs}
+
+    def _fill(self):
+        """Append the next chunk to the buffer, dropping what was already consumed.
+
+        :return: False when there is no chunk left
+        :rtype: bool
+        """
+        for chunk in self._chunks:
+            if chunk:
+                consumed = self._pos
+                self._buffer = self._buffer[consumed:] + chunk
+                self._pos = 0
+                return True
+        return False
+
+    def _peek(self):
+        """Skip whitespaces and return the next character without consuming it."""
+        while True:
+            self._pos = WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON document")
+
+    def _next(self):
+        """Skip whitespaces and consume the next character."""
+        char = self._peek()
+        self._pos += 1
+        return char
+
+    def _expect(self, expected):
+        char = self._next()
+        if char != expected:
+            raise ValueError("Expected '{}' at position {}, got '{}'".format(expected, self._pos - 1, char))
+
+    def _value(self):
+        """Decode the next complete JSON value."""
+        self._peek()
+        while True:
+            # A number at the very end of the buffer could continue in the next chunk
+            if self._buffer[self._pos] in NUMBER_START:
+                if NUMBER.match(self._buffer, self._pos).end() == len(self._buffer) and self._fill():
+                    continue
+            try:
+                value, self._pos = self._decoder.raw_decode(self._buffer, self._pos)
+                return value
+            except ValueError:
+                # The value is not complete yet
+                if not self._fill():
+                    raise
+
+    def _array(self):
+        """Decode the next JSON array, one item at a time."""
+        self._expect('[')
+        items = []
+        if self._peek() == ']':
+            self._pos += 1
+            return items
+        while True:
+            items.append(self._value())
+            char = self._next()
+            if char == ']':
+                return items
+            if char != ',':
+                raise ValueError("Expected ',' or ']' at position {}, got '{}'".format(self._pos - 1, char))
+
+    def read(self, stream_keys=(), skip_keys=()):
+        """Decode the whole document.
+
+        :param stream_keys: top level keys whose array values are decoded one item at a time
+        :param skip_keys: top level keys to leave out of the result
+        :return: decoded document
+        """
+        if self._peek() != '{':
+            return self._value()
+
+        self._pos += 1
+        result = {}
+        if self._peek() == '}':
+            self._pos += 1
+            return result
+        while True:
+            key = self._value()
+            self._expect(':')
+            if key in stream_keys and self._peek() == '[':
+                value = self._array()
+            else:
+                value = self._value()
+            if key not in skip_keys:
+                result[key] = value
+            char = self._next()
+            if char == '}':
+                return result
+            if char != ',':
+                raise ValueError("Expected ',' or '}}' at position {}, got '{}'".format(self._pos - 1, char))
@@ -2,12 +2,23 @@
 # All rights reserved
 # Licensed under Simplified BSD License (see LICENSE)
 import json
+import logging
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 
 import requests
 from six import PY3
 
 from datadog_checks.base import AgentCheck
 
+from .json_stream import JSONStreamReader
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
+
 if PY3:
     long = int
     basestring = str
@@ -192,6 +203,200 @@ def _get_dict(stat_map, *components):
     return val
 
 
+def _flag(v):
+    """Convert to a 1/0 flag
+
+    :param v: value
+    :rtype: int
+    """
+    return 1 if _bool(v) else 0
+
+
+def _list(v):
+    """Return the value if it is a list, an empty tuple otherwise
+
+    :param v: value
+    :rtype: list | tuple
+    """
+    return v if isinstance(v, list) else ()
+
+
+def _compile_getter(default, func, components):
+    """Precompile a `_g` lookup into a function of a single stat map.
+
+    The components are classified as list indices or map keys once, so the returned function
+    only has to walk the stat map. It returns the same values as `_g(stat_map, default, func, *components)`.
+
+    :param default: default value
+    :param func: function to apply after getting the value.
+    :param components: components in order to traverse
+    :return: getter
+    :rtype: callable
+    """
+
+    def _coerce(value):
+        if value is None or value == '':
+            return default
+        if func is None:
+            return value
+        try:
+            return func(value)
+        except Exception:
+            return default
+
+    if len(components) == 1 and not isinstance(components[0], (int, long)):
+        key = components[0]
+
+        def getter(stat_map):
+            if key not in stat_map:
+                return default
+            return _coerce(stat_map[key])
+
+        return getter
+
+    steps = tuple((isinstance(component, (int, long)), component) for component in components)
+
+    def getter(stat_map):
+        value = stat_map
+        for is_index, component in steps:
+            if is_index:
+                if isinstance(value, (list, tuple)) and len(value) > component:
+                    value = value[component]
+                else:
+                    return default
+            elif component in value:
+                value = value[component]
+            else:
+                return default
+        return _coerce(value)
+
+    return getter
+
+
+def _compile_plan(metrics):
+    """Precompile a metric extraction table.
+
+    :param metrics: tuples of (metric name suffix, default value, coercion function, components)
+    :type metrics: tuple
+    :return: tuples of (metric name suffix, getter)
+    :rtype: tuple
+    """
+    return tuple((name, _compile_getter(default, func, components)) for name, default, func, components in metrics)
+
+
+# Metric extraction tables: (metric name suffix, default value, coercion function, components)
+TOPOLOGY_METRICS = (
+    ('acked', 0, _long, ('topologyStats', 0, 'acked')),
+    ('assignedCpu', 0.0, _float, ('assignedCpu',)),
+    ('assignedMemOffHeap', 0, _long, ('assignedMemOffHeap',)),
+    ('assignedMemOnHeap', 0, _long, ('assignedMemOnHeap',)),
+    ('assignedTotalMem', 0, _long, ('assignedTotalMem',)),
+    ('completeLatency', 0.0, _float, ('topologyStats', 0, 'completeLatency')),
+    ('debug', 0, _flag, ('debug',)),
+    ('emitted', 0, _long, ('topologyStats', 0, 'emitted')),
+    ('executorsTotal', 0, _long, ('executorsTotal',)),
+    ('failed', 0, _long, ('topologyStats', 0, 'failed')),
+    ('msgTimeout', 0, _long, ('msgTimeout',)),
+    ('numBolts', 0, len, ('bolts',)),
+    ('numSpouts', 0, len, ('spouts',)),
+    ('replicationCount', 0, _long, ('replicationCount',)),
+    ('requestedCpu', 0.0, _float, ('requestedCpu',)),
+    ('requestedMemOffHeap', 0.0, _float, ('requestedMemOffHeap',)),
+    ('requestedMemOnHeap', 0.0, _float, ('requestedMemOnHeap',)),
+    ('samplingPct', 0.0, _float, ('samplingPct',)),
+    ('tasksTotal', 0, _long, ('tasksTotal',)),
+    ('transferred', 0, _long, ('topologyStats', 0, 'transferred')),
+    ('uptimeSeconds', 0, _long, ('uptimeSeconds',)),
+    ('workersTotal', 0, _long, ('workersTotal',)),
+)
+
+BOLT_METRICS = (
+    tuple(
+        (name, 0, _long, (name,))
+        for name in (
+            'acked',
+            'emitted',
+            'executed',
+            'executors',
+            'failed',
+            'requestedMemOffHeap',
+            'requestedMemOnHeap',
+            'tasks',
+            'transferred',
+        )
+    )
+    + tuple((name, 0, _float, (name,)) for name in ('capacity', 'executeLatency', 'processLatency', 'requestedCpu'))
+    + (('errorLapsedSecs', 1e10, _float, ('errorLapsedSecs',)),)
+)
+
+SPOUT_METRICS = (
+    tuple(
+        (name, 0, _long, (name,))
+        for name in (
+            'acked',
+            'emitted',
+            'executors',
+            'failed',
+            'requestedMemOffHeap',
+            'requestedMemOnHeap',
+            'tasks',
+            'transferred',
+        )
+    )
+    + tuple((name, 0, _float, (name,)) for name in ('completeLatency', 'requestedCpu'))
+    + (('errorLapsedSecs', 1e10, _float, ('errorLapsedSecs',)),)
+)
+
+WORKER_METRICS = (
+    ('assignedCpu', 0, _float, ('assignedCpu',)),
+    ('assignedMemOffHeap', 0, _long, ('assignedMemOffHeap',)),
+    ('assignedMemOnHeap', 0, _long, ('assignedMemOnHeap',)),
+    ('executorsTotal', 0, _long, ('executorsTotal',)),
+    ('uptimeSeconds', 0, _long, ('uptimeSeconds',)),
+)
+
+STREAM_STATS = tuple(
+    (name, (), _list, (name,))
+    for name in (
+        'acked',
+        'complete_ms_avg',
+        'emitted',
+        'executed',
+        'executed_ms_avg',
+        'failed',
+        'process_ms_avg',
+        'transferred',
+    )
+)
+
+# Topology, bolt and spout metrics of the topology info which depend on the requested window
+WINDOWED_METRICS = frozenset(
+    (
+        'acked',
+        'capacity',
+        'completeLatency',
+        'emitted',
+        'executeLatency',
+        'executed',
+        'failed',
+        'processLatency',
+        'transferred',
+    )
+)
+
+TOPOLOGY_PLAN = _compile_plan(TOPOLOGY_METRICS)
+BOLT_PLAN = _compile_plan(BOLT_METRICS)
+SPOUT_PLAN = _compile_plan(SPOUT_METRICS)
+WORKER_PLAN = _compile_plan(WORKER_METRICS)
+TOPOLOGY_STATIC_PLAN = _compile_plan(tuple(m for m in TOPOLOGY_METRICS if m[0] not in WINDOWED_METRICS))
+BOLT_STATIC_PLAN = _compile_plan(tuple(m for m in BOLT_METRICS if m[0] not in WINDOWED_METRICS))
+SPOUT_STATIC_PLAN = _compile_plan(tuple(m for m in SPOUT_METRICS if m[0] not in WINDOWED_METRICS))
+STREAM_STATS_PLAN = _compile_plan(STREAM_STATS)
+
+_get_stream_id = _compile_getter('unknown', str, ('stream_id',))
+_get_stream_value = _compile_getter(0.0, _float, ('value',))
+
+
 class StormCheck(AgentCheck):
     """
     Apache Storm 1.x.x Topology Execution Stats
@@ -200,6 +405,24 @@ class StormCheck(AgentCheck):
     DEFAULT_STORM_SERVER = 'http://localhost:9005'
     DEFAULT_STORM_ENVIRONMENT = 'dev'
     DEFAULT_STORM_INTERVALS = [60]
+    DEFAULT_MAX_CONCURRENT_REQUESTS = 1
+    DEFAULT_FETCH_TOPOLOGY_INFO_ONCE = False
+    DEFAULT_TRACE_TAG_ALLOCATIONS = False
+    DEFAULT_SKIP_IDLE_TOPOLOGIES = False
+    DEFAULT_FULL_REFRESH_INTERVAL = 10
+    DEFAULT_STREAM_RESPONSES = False
+    STREAM_CHUNK_SIZE = 64 * 1024
+    # Topology arrays decoded one record at a time when streaming responses
+    STREAMED_KEYS = ('bolts', 'spouts', 'workers')
+
+    def __init__(self, *args, **kwargs):
+        super(StormCheck, self).__init__(*args, **kwargs)
+        # (metric prefix, plan, interval) -> tuple of (metric name, getter)
+        self._metric_plans = {}
+        # topology id -> state of the topology at its last collection, used to skip idle topologies
+        self._topology_states = {}
+        self._runs_since_full_refresh = 0
+        self._warned_fetch_topology_info_once = False
 
     class StormVersion(object):
         @classmethod
@@ -245,17 +468,37 @@ class StormCheck(AgentCheck):
                     return self.patch < other.patch
             return True
 
+    def read_response_json(self, resp):
+        """Decode a JSON response, incrementally if `stream_responses` is enabled.
+
+        When streaming, the `bolts`, `spouts` and `workers` arrays are decoded one record at a time and the
+        `configuration` section, which is not used by the check, is dropped.
+
+        :param resp: response
+        :type resp: requests.Response
+        :return: decoded response
+        :rtype: dict
+        """
+        if not self.stream_responses:
+            return resp.json()
+        try:
+            chunks = resp.iter_content(chunk_size=StormCheck.STREAM_CHUNK_SIZE, decode_unicode=True)
+            return JSONStreamReader(chunks).read(stream_keys=StormCheck.STREAMED_KEYS, skip_keys=('configuration',))
+        finally:
+            resp.close()
+
     def get_request_json(self, url_part, error_message, params=None):
         url = "{}{}".format(self.nimbus_server, url_part)
         try:
             self.log.debug("Fetching url %s", url)
             if params:
                 self.log.debug("Request params: %s", params)
-            resp = self.http.get(url, params=params)
+            resp = self.http.get(url, params=params, stream=self.stream_responses)
             resp.encoding = 'utf-8'
-            data = resp.json()
-            # Log response data excluding configuration section
-            self.log.debug("Response data: %s", json.dumps({x: data[x] for x in data if x != 'configuration'}))
+            data = self.read_response_json(resp)
+            if self.log.isEnabledFor(logging.DEBUG):
+                # Log response data excluding configuration section
+                self.log.debug("Response data: %s", json.dumps({x: data[x] for x in data if x != 'configuration'}))
             if 'error' in data:
                 self.log.warning("Error message returned in JSON response")
                 raise Exception(data['error'])
@@ -321,6 +564,16 @@ class StormCheck(AgentCheck):
             params=params,
         )
 
+    @staticmethod
+    def has_metrics_endpoint(storm_version):
+        """Check if the Storm UI exposes the dedicated topology metrics endpoint (added in 1.2.0).
+
+        :param storm_version: storm version
+        :type storm_version: StormCheck.StormVersion | None
+        :rtype: bool
+        """
+        return bool(storm_version) and not storm_version < '1.2.0'
+
     def get_topology_metrics(self, topology_id, interval=60, storm_version=None):
         """Make the storm topology metrics request.
 
@@ -334,7 +587,7 @@ class StormCheck(AgentCheck):
 
         # try 1.2 by default
         endpoint = "/api/v1/topology/{}/metrics"
-        if not storm_version or storm_version < '1.2.0':
+        if not self.has_metrics_endpoint(storm_version):
             endpoint = "/api/v1/topology/{}"
 
         params = {'window': interval}
@@ -467,283 +720,79 @@ class StormCheck(AgentCheck):
                         additional_tags=self.additional_tags,
                     )
 
-    def process_topology_stats(self, topology_stats, interval):
+    def get_metric_plan(self, prefix, plan, interval):
+        """Get a compiled metric extraction plan with the metric names resolved for an interval.
+
+        :param prefix: metric name prefix, e.g. `bolt`
+        :type prefix: str
+        :param plan: compiled extraction plan
+        :type plan: tuple
+        :param interval: Interval of metrics reported
+        :type interval: int
+        :return: tuples of (metric name, getter)
+        :rtype: tuple
+        """
+        key = (prefix, plan, interval)
+        metric_plan = self._metric_plans.get(key)
+        if metric_plan is None:
+            metric_plan = tuple(('storm.{}.last_{}.{}'.format(prefix, interval, name), getter) for name, getter in plan)
+            self._metric_plans[key] = metric_plan
+        return metric_plan
+
+    def process_topology_stats(self, topology_stats, interval, windowed=True):
         """Process Topology Stats Response
 
         :param topology_stats: Supervisor stats response
         :type topology_stats: dict
         :param interval: Interval of metrics reported
         :type interval: int
+        :param windowed: Whether the response was requested for this interval, only the metrics which do not
+            depend on the window are reported otherwise
+        :type windowed: bool
         """
-
-        def _mts(metric_name):
-            return 'storm.topologyStats.last_{}.{}'.format(interval, metric_name)
-
         if topology_stats:
             name = _get_string(topology_stats, 'unknown', 'name').replace('.', '_').replace(':', '_')
-            debug_mode = _get_bool(topology_stats, False, 'debug')
             tags = ['topology:{}'.format(name)]
 
-            self.report_histogram(
-                _mts('acked'),
-                _get_long(topology_stats, 0, 'topologyStats', 0, 'acked'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('assignedCpu'),
-                _get_float(topology_stats, 0.0, 'assignedCpu'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('assignedMemOffHeap'),
-                _get_long(topology_stats, 0, 'assignedMemOffHeap'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('assignedMemOnHeap'),
-                _get_long(topology_stats, 0, 'assignedMemOnHeap'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('assignedTotalMem'),
-                _get_long(topology_stats, 0, 'assignedTotalMem'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('completeLatency'),
-                _get_float(topology_stats, 0.0, 'topologyStats', 0, 'completeLatency'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('debug'), 1 if debug_mode else 0, tags=tags, additional_tags=self.additional_tags
-            )
-            self.report_histogram(
-                _mts('emitted'),
-                _get_long(topology_stats, 0, 'topologyStats', 0, 'emitted'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('executorsTotal'),
-                _get_long(topology_stats, 0, 'executorsTotal'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('failed'),
-                _get_long(topology_stats, 0, 'topologyStats', 0, 'failed'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('msgTimeout'),
-                _get_long(topology_stats, 0, 'msgTimeout'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('numBolts'),
-                _get_length(topology_stats, 0, 'bolts'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('numSpouts'),
-                _get_length(topology_stats, 0, 'spouts'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('replicationCount'),
-                _get_long(topology_stats, 0, 'replicationCount'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('requestedCpu'),
-                _get_float(topology_stats, 0.0, 'requestedCpu'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('requestedMemOffHeap'),
-                _get_float(topology_stats, 0.0, 'requestedMemOffHeap'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('requestedMemOnHeap'),
-                _get_float(topology_stats, 0.0, 'requestedMemOnHeap'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('samplingPct'),
-                _get_float(topology_stats, 0.0, 'samplingPct'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('tasksTotal'),
-                _get_long(topology_stats, 0, 'tasksTotal'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('transferred'),
-                _get_long(topology_stats, 0, 'topologyStats', 0, 'transferred'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('uptimeSeconds'),
-                _get_long(topology_stats, 0, 'uptimeSeconds'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
-            self.report_histogram(
-                _mts('workersTotal'),
-                _get_long(topology_stats, 0, 'workersTotal'),
-                tags=tags,
-                additional_tags=self.additional_tags,
-            )
+            topology_plan = TOPOLOGY_PLAN if windowed else TOPOLOGY_STATIC_PLAN
+            for metric_name, getter in self.get_metric_plan('topologyStats', topology_plan, interval):
+                self.report_histogram(
+                    metric_name, getter(topology_stats), tags=tags, additional_tags=self.additional_tags
+                )
 
             # Bolt Stats
-            def _mb(metric_name):
-                return 'storm.bolt.last_{}.{}'.format(interval, metric_name)
-
+            bolt_plan = self.get_metric_plan('bolt', BOLT_PLAN if windowed else BOLT_STATIC_PLAN, interval)
             for b in _get_list(topology_stats, 'bolts'):
                 bolt_name = _get_string(b, 'unknown', 'boltId').replace('.', '_').replace(':', '_')
                 bolt_tags = tags + ['bolt:{}'.format(bolt_name)]
-
-                # Longs:
-                for metric_name in [
-                    'acked',
-                    'emitted',
-                    'executed',
-                    'executors',
-                    'failed',
-                    'requestedMemOffHeap',
-                    'requestedMemOnHeap',
-                    'tasks',
-                    'transferred',
-                ]:
-                    self.report_histogram(
-                        _mb(metric_name),
-                        _get_long(b, 0, metric_name),
-                        tags=bolt_tags,
-                        additional_tags=self.additional_tags,
-                    )
-                # Floats
-                for metric_name in ['capacity', 'executeLatency', 'processLatency', 'requestedCpu']:
-                    self.report_histogram(
-                        _mb(metric_name),
-                        _get_float(b, 0, metric_name),
-                        tags=bolt_tags,
-                        additional_tags=self.additional_tags,
-                    )
-
-                self.report_histogram(
-                    _mb('errorLapsedSecs'),
-                    _get_float(b, 1e10, 'errorLapsedSecs'),
-                    tags=bolt_tags,
-                    additional_tags=self.additional_tags,
-                )
+                for metric_name, getter in bolt_plan:
+                    self.report_histogram(metric_name, getter(b), tags=bolt_tags, additional_tags=self.additional_tags)
 
             # Process Spout stats
-            def _ms(metric_name):
-                return 'storm.spout.last_{}.{}'.format(interval, metric_name)
-
+            spout_plan = self.get_metric_plan('spout', SPOUT_PLAN if windowed else SPOUT_STATIC_PLAN, interval)
             for s in _get_list(topology_stats, 'spouts'):
                 spout_name = _get_string(s, 'unknown', 'spoutId').replace('.', '_').replace(':', '_')
                 spout_tags = tags + ['spout:{}'.format(spout_name)]
-
-                # Longs:
-                for metric_name in [
-                    'acked',
-                    'emitted',
-                    'executors',
-                    'failed',
-                    'requestedMemOffHeap',
-                    'requestedMemOnHeap',
-                    'tasks',
-                    'transferred',
-                ]:
-                    self.report_histogram(
-                        _ms(metric_name),
-                        _get_long(s, 0, metric_name),
-                        tags=spout_tags,
-                        additional_tags=self.additional_tags,
-                    )
-                # Floats
-                for metric_name in ['completeLatency', 'requestedCpu']:
-                    self.report_histogram(
-                        _ms(metric_name),
-                        _get_float(s, 0, metric_name),
-                        tags=spout_tags,
-                        additional_tags=self.additional_tags,
-                    )
-
-                self.report_histogram(
-                    _ms('errorLapsedSecs'),
-                    _get_float(s, 1e10, 'errorLapsedSecs'),
-                    tags=spout_tags,
-                    additional_tags=self.additional_tags,
-                )
+                for metric_name, getter in spout_plan:
+                    self.report_histogram(metric_name, getter(s), tags=spout_tags, additional_tags=self.additional_tags)
 
             # Process worker stats
-            def _mw(metric_name):
-                return 'storm.worker.last_{}.{}'.format(interval, metric_name)
-
+            worker_plan = self.get_metric_plan('worker', WORKER_PLAN, interval)
+            component_num_tasks_metric = 'storm.worker.last_{}.componentNumTasks'.format(interval)
             for w in _get_list(topology_stats, 'workers'):
-                worker_stat = {}
                 host = _get_string(w, 'unknown', 'host')
                 port = _get_long(w, 0, 'port')
                 supervisor_id = _get_string(w, 'unknown', 'supervisorId')
                 worker_tags = tags + ['worker:{}:{}'.format(host, port), 'supervisor:{}'.format(supervisor_id)]
+                for metric_name, getter in worker_plan:
+                    self.report_histogram(
+                        metric_name, getter(w), tags=worker_tags, additional_tags=self.additional_tags
+                    )
 
-                self.report_histogram(
-                    _mw('assignedCpu'),
-                    _get_float(w, 0, 'assignedCpu'),
-                    tags=worker_tags,
-                    additional_tags=self.additional_tags,
-                )
-                self.report_histogram(
-                    _mw('assignedMemOffHeap'),
-                    _get_long(w, 0, 'assignedMemOffHeap'),
-                    tags=worker_tags,
-                    additional_tags=self.additional_tags,
-                )
-                self.report_histogram(
-                    _mw('assignedMemOnHeap'),
-                    _get_long(w, 0, 'assignedMemOnHeap'),
-                    tags=worker_tags,
-                    additional_tags=self.additional_tags,
-                )
-                self.report_histogram(
-                    _mw('executorsTotal'),
-                    _get_long(w, 0, 'executorsTotal'),
-                    tags=worker_tags,
-                    additional_tags=self.additional_tags,
-                )
-                self.report_histogram(
-                    _mw('uptimeSeconds'),
-                    _get_long(w, 0, 'uptimeSeconds'),
-                    tags=worker_tags,
-                    additional_tags=self.additional_tags,
-                )
-
-                worker_stat[_mw('componentNumTasks')] = []
                 for cn, cv in _get_dict(w, 'componentNumTasks').items():
                     worker_component_tags = worker_tags + ['component:{}'.format(cn)]
                     self.report_histogram(
-                        _mw('componentNumTasks'),
+                        component_num_tasks_metric,
                         _long(cv or 0),
                         tags=worker_component_tags,
                         additional_tags=self.additional_tags,
@@ -763,37 +812,90 @@ class StormCheck(AgentCheck):
             name = topology_name.replace('.', '_').replace(':', '_')
             tags = ['topology:{}'.format(name)]
             for k in ('bolts', 'spouts'):
+                # will make stats like these two examples
+                # storm.topologyStats.metrics.spouts.last_60.emitted
+                # storm.topologyStatus.metrics.bolts.last_60.acked
+                metric_plan = self.get_metric_plan('topologyStats.metrics.{}'.format(k), STREAM_STATS_PLAN, interval)
                 for s in _get_list(topology_stats, k):
                     k_name = _get_string(s, 'unknown', 'id').replace('.', '_').replace(':', '_')
                     k_tags = tags + ['{}:{}'.format(k, k_name)]
-                    for sc in [
-                        'acked',
-                        'complete_ms_avg',
-                        'emitted',
-                        'executed',
-                        'executed_ms_avg',
-                        'failed',
-                        'process_ms_avg',
-                        'transferred',
-                    ]:
-                        for ks in _get_list(s, sc):
-                            stream_id = _get_string(ks, 'unknown', 'stream_id')
-                            ks_tags = k_tags + ['stream:{}'.format(stream_id)]
+                    for metric_name, getter in metric_plan:
+                        for ks in getter(s):
+                            ks_tags = k_tags + ['stream:{}'.format(_get_stream_id(ks))]
                             component_id = ks.get('component_id')
                             if component_id:
                                 ks_tags.append('component:{}'.format(component_id))
 
-                            component_value = _get_float(ks, 0.0, 'value')
-                            if component_value is not None:
-                                # will make stats like these two examples
-                                # storm.topologyStats.metrics.spouts.last_60.emitted
-                                # storm.topologyStatus.metrics.bolts.last_60.acked
-                                self.report_histogram(
-                                    'storm.topologyStats.metrics.{}.last_{}.{}'.format(k, interval, sc),
-                                    component_value,
-                                    tags=ks_tags,
-                                    additional_tags=self.additional_tags,
-                                )
+                            self.report_histogram(
+                                metric_name,
+                                _get_stream_value(ks),
+                                tags=ks_tags,
+                                additional_tags=self.additional_tags,
+                            )
+
+    def reset_tag_cache(self):
+        """Reset the per run tag cache and its counters.
+
+        :return: None
+        """
+        self._tag_cache = {}
+        self.tag_cache_hits = 0
+        self.tag_cache_misses = 0
+
+    def get_all_tags(self, tags, additional_tags):
+        """Get the full, deduplicated tag list for a metric, built once per run for each combination of tags.
+
+        :param tags: metric tags
+        :type tags: list
+        :param additional_tags: tags shared by all metrics
+        :type additional_tags: list
+        :return: all tags, shared between calls and must not be modified
+        :rtype: tuple
+        """
+        key = (tuple(tags), tuple(additional_tags))
+        all_tags = self._tag_cache.get(key)
+        if all_tags is None:
+            self.tag_cache_misses += 1
+            all_tags = set(tags)
+            all_tags.add('stormEnvironment:{}'.format(self.environment_name))
+            all_tags.update(additional_tags)
+            all_tags = tuple(sorted(all_tags))
+            self._tag_cache[key] = all_tags
+        else:
+            self.tag_cache_hits += 1
+        return all_tags
+
+    @contextmanager
+    def trace_tag_allocations(self):
+        """Log the tag cache counters and, on Python 3, the memory allocated during the run.
+
+        Enabled with the `trace_tag_allocations` option, only meant for debugging.
+        """
+        if not self.trace_allocations:
+            yield
+            return
+
+        started_tracing = False
+        if tracemalloc is not None:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            elif hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+        try:
+            yield
+        finally:
+            self.log.debug("Tag cache: %d hits, %d misses", self.tag_cache_hits, self.tag_cache_misses)
+            if tracemalloc is not None:
+                current_memory, peak_memory = tracemalloc.get_traced_memory()
+                self.log.debug(
+                    "Traced memory: %d bytes allocated during the run, %d bytes peak",
+                    current_memory - start_memory,
+                    peak_memory - start_memory,
+                )
+                if started_tracing:
+                    tracemalloc.stop()
 
     def report_gauge(self, metric, value, tags, additional_tags):
         """Report the Gauge Metric.
@@ -804,10 +906,7 @@ class StormCheck(AgentCheck):
         :param additional_tags:
         :return:
         """
-        all_tags = set(tags)
-        all_tags.add('stormEnvironment:{}'.format(self.environment_name))
-        all_tags.update(additional_tags)
-        self.gauge(metric, value=value, tags=all_tags)
+        self.gauge(metric, value=value, tags=self.get_all_tags(tags, additional_tags))
 
     def report_histogram(self, metric, value, tags, additional_tags):
         """Report the Histogram Metric.
@@ -818,10 +917,7 @@ class StormCheck(AgentCheck):
         :param additional_tags:
         :return:
         """
-        all_tags = set(tags)
-        all_tags.add('stormEnvironment:{}'.format(self.environment_name))
-        all_tags.update(additional_tags)
-        self.histogram(metric, value=value, tags=all_tags)
+        self.histogram(metric, value=value, tags=self.get_all_tags(tags, additional_tags))
 
     def update_from_config(self, instance):
         """Update Configuration tunables from instance configuration.
@@ -844,6 +940,193 @@ class StormCheck(AgentCheck):
             raise AssertionError("Expected intervals to be a list of integers with at least 1 value")
         self.intervals.extend(intervals)
 
+        max_concurrent_requests = instance.get(
+            'max_concurrent_requests',
+            self.init_config.get('max_concurrent_requests', StormCheck.DEFAULT_MAX_CONCURRENT_REQUESTS),
+        )
+        try:
+            self.max_concurrent_requests = int(max_concurrent_requests)
+        except (TypeError, ValueError):
+            raise AssertionError("Expected max_concurrent_requests to be a positive integer")
+        if self.max_concurrent_requests < 1:
+            raise AssertionError("Expected max_concurrent_requests to be a positive integer")
+
+        self.trace_allocations = _bool(
+            instance.get(
+                'trace_tag_allocations',
+                self.init_config.get('trace_tag_allocations', StormCheck.DEFAULT_TRACE_TAG_ALLOCATIONS),
+            )
+        )
+        self.reset_tag_cache()
+
+        self.skip_idle_topologies = _bool(
+            instance.get(
+                'skip_idle_topologies',
+                self.init_config.get('skip_idle_topologies', StormCheck.DEFAULT_SKIP_IDLE_TOPOLOGIES),
+            )
+        )
+        full_refresh_interval = instance.get(
+            'full_refresh_interval',
+            self.init_config.get('full_refresh_interval', StormCheck.DEFAULT_FULL_REFRESH_INTERVAL),
+        )
+        try:
+            self.full_refresh_interval = int(full_refresh_interval)
+        except (TypeError, ValueError):
+            raise AssertionError("Expected full_refresh_interval to be a positive integer")
+        if self.full_refresh_interval < 1:
+            raise AssertionError("Expected full_refresh_interval to be a positive integer")
+
+        self.stream_responses = _bool(
+            instance.get(
+                'stream_responses', self.init_config.get('stream_responses', StormCheck.DEFAULT_STREAM_RESPONSES)
+            )
+        )
+
+        self.fetch_topology_info_once = _bool(
+            instance.get(
+                'fetch_topology_info_once',
+                self.init_config.get('fetch_topology_info_once', StormCheck.DEFAULT_FETCH_TOPOLOGY_INFO_ONCE),
+            )
+        )
+
+    def collect_topology(self, topology_id, topology_name, interval, storm_version, fetch_info=True):
+        """Fetch the topology info and topology metrics responses for one topology and interval.
+
+        Before Storm 1.2.0 the topology metrics are read from the topology info endpoint, so the
+        topology info response is reused instead of being requested a second time.
+
+        Errors are logged rather than raised so that a failing topology does not affect the others.
+
+        :param topology_id: Topology Id
+        :type topology_id: str
+        :param topology_name: Topology Name
+        :type topology_name: str
+        :param interval: Interval in seconds
+        :type interval: int|long
+        :param storm_version: Storm version reported by the cluster summary
+        :type storm_version: StormCheck.StormVersion
+        :param fetch_info: Whether to request the topology info for this interval
+        :type fetch_info: bool
+        :return: Topology info and topology metrics responses, None for any that could not be retrieved
+        :rtype: tuple
+        """
+        stats = None
+        metric_stats = None
+        try:
+            if fetch_info:
+                stats = self.get_topology_info(topology_id=topology_id, interval=interval)
+            if self.has_metrics_endpoint(storm_version):
+                metric_stats = self.get_topology_metrics(
+                    topology_id=topology_id, interval=interval, storm_version=storm_version
+                )
+            else:
+                metric_stats = stats
+        except Exception:  # noqa
+            self.log.exception(
+                "unable to collect topology stats for topology_id:%s, topology_name:%s",
+                topology_id,
+                topology_name,
+            )
+        return stats, metric_stats
+
+    @staticmethod
+    def get_topology_fingerprint(topology):
+        """Get the part of a topology summary that changes when a topology is redeployed or rebalanced.
+
+        :param topology: topology summary entry
+        :type topology: dict
+        :rtype: tuple
+        """
+        return (
+            _get_string(topology, 'unknown', 'status').upper(),
+            _get_long(topology, 0, 'workersTotal'),
+            _get_long(topology, 0, 'executorsTotal'),
+            _get_long(topology, 0, 'tasksTotal'),
+        )
+
+    def should_collect_topology(self, topology_id, topology, full_refresh):
+        """Check if a topology must be fully collected, or can be skipped because it was idle at its last collection.
+
+        :param topology_id: Topology Id
+        :type topology_id: str
+        :param topology: topology summary entry
+        :type topology: dict
+        :param full_refresh: Whether every topology is collected on this run
+        :type full_refresh: bool
+        :rtype: bool
+        """
+        if not self.skip_idle_topologies or full_refresh:
+            return True
+        state = self._topology_states.get(topology_id)
+        if state is None or not state['idle']:
+            return True
+        # A restarted, redeployed or rebalanced topology must be collected again
+        if _get_long(topology, 0, 'uptimeSeconds') < state['uptime']:
+            return True
+        return self.get_topology_fingerprint(topology) != state['fingerprint']
+
+    def update_topology_state(self, topology_id, topology, stats):
+        """Record the counters of a collected topology to detect if it is idle on the next runs.
+
+        :param topology_id: Topology Id
+        :type topology_id: str
+        :param topology: topology summary entry
+        :type topology: dict
+        :param stats: topology info response
+        :type stats: dict
+        """
+        counters = (
+            _get_long(stats, 0, 'topologyStats', 0, 'emitted'),
+            _get_long(stats, 0, 'topologyStats', 0, 'transferred'),
+        )
+        state = self._topology_states.get(topology_id)
+        self._topology_states[topology_id] = {
+            'uptime': _get_long(topology, 0, 'uptimeSeconds'),
+            'fingerprint': self.get_topology_fingerprint(topology),
+            'counters': counters,
+            'idle': state is not None and state['counters'] == counters,
+        }
+
+    def report_topology_status(self, topology_name, topology_status):
+        """Report the topology service check.
+
+        :param topology_name: Topology Name
+        :type topology_name: str
+        :param topology_status: Topology status, e.g. `ACTIVE`
+        :type topology_status: str
+        """
+        check_status = AgentCheck.CRITICAL if topology_status != 'ACTIVE' else AgentCheck.OK
+        topology_message = '{} topology status marked as: {}'.format(topology_name, topology_status)
+        self.service_check(
+            'topology_check.{}'.format(topology_name),
+            status=check_status,
+            message=topology_message if check_status != AgentCheck.OK else "",
+            tags=['stormEnvironment:{}'.format(self.environment_name)] + self.additional_tags,
+        )
+
+    def imap_requests(self, func, jobs):
+        """Apply `func` to each job, using up to `max_concurrent_requests` worker threads.
+
+        Results are yielded in the same order as `jobs`, as soon as they are available.
+
+        :param func: function taking a single job argument
+        :param jobs: list of jobs
+        :type jobs: list
+        :return: generator of results
+        """
+        if self.max_concurrent_requests <= 1 or len(jobs) <= 1:
+            for job in jobs:
+                yield func(job)
+            return
+
+        pool = ThreadPool(min(self.max_concurrent_requests, len(jobs)))
+        try:
+            for result in pool.imap(func, jobs):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+
     def check(self, instance):
         """Perform the agent check.
 
@@ -853,59 +1136,98 @@ class StormCheck(AgentCheck):
         # Setup
         self.update_from_config(instance)
 
-        # Cluster Stats - these must query!
-        cluster_stats = self.get_storm_cluster_summary()
-        storm_version = self.process_cluster_stats(cluster_stats)
+        with self.trace_tag_allocations():
+            # Cluster Stats - these must query!
+            cluster_stats = self.get_storm_cluster_summary()
+            storm_version = self.process_cluster_stats(cluster_stats)
 
-        # Nimbus Stats
-        nimbus_stats = {}
-        try:
-            nimbus_stats = self.get_storm_nimbus_summary()
-            self.process_nimbus_stats(nimbus_stats)
-        except Exception:  # noqa
-            self.log.exception("Error recording nimbus stats")
+            # Nimbus Stats
+            nimbus_stats = {}
+            try:
+                nimbus_stats = self.get_storm_nimbus_summary()
+                self.process_nimbus_stats(nimbus_stats)
+            except Exception:  # noqa
+                self.log.exception("Error recording nimbus stats")
 
-        # Supervisor Stats
-        supervisor_stats = {}
-        try:
-            supervisor_stats = self.get_storm_supervisor_summary()
-            self.process_supervisor_stats(supervisor_stats)
-        except Exception:  # noqa
-            self.log.exception("Error recording supervisor stats")
-
-        # Topology Stats
-        summary = self.get_storm_topology_summary()
-        for topology in _get_list(summary, 'topologies'):
-            topology_id = topology.get('id')
-            if topology_id in (None, ''):
-                self.log.warning("Ignoring topology without id.")
-                continue
-            topology_name = _get_string(topology, 'unknown', 'name')
-            topology_status = None
-            if topology_name not in self.excluded_topologies:
-                for interval in self.intervals:
-                    try:
-                        stats = self.get_topology_info(topology_id=topology_id, interval=interval)
-                        self.process_topology_stats(topology_stats=stats, interval=interval)
-                        metric_stats = self.get_topology_metrics(
-                            topology_id=topology_id, interval=interval, storm_version=storm_version
-                        )
-                        self.process_topology_metrics(topology_name, metric_stats, interval=interval)
-
-                        # only report this once.
-                        if topology_status is None:
-                            topology_status = _get_string(stats, 'unknown', 'status').upper()
-                            check_status = AgentCheck.CRITICAL if topology_status != 'ACTIVE' else AgentCheck.OK
-                            topology_message = '{} topology status marked as: {}'.format(topology_name, topology_status)
-                            self.service_check(
-                                'topology_check.{}'.format(topology_name),
-                                status=check_status,
-                                message=topology_message if check_status != AgentCheck.OK else "",
-                                tags=['stormEnvironment:{}'.format(self.environment_name)] + self.additional_tags,
-                            )
-                    except Exception:  # noqa
-                        self.log.exception(
-                            "unable to collect topology stats for topology_id:%s, topology_name:%s",
-                            topology_id,
-                            topology_name,
-                        )
+            # Supervisor Stats
+            supervisor_stats = {}
+            try:
+                supervisor_stats = self.get_storm_supervisor_summary()
+                self.process_supervisor_stats(supervisor_stats)
+            except Exception:  # noqa
+                self.log.exception("Error recording supervisor stats")
+
+            # Topology Stats
+            summary = self.get_storm_topology_summary()
+            full_refresh = self._runs_since_full_refresh % self.full_refresh_interval == 0
+            self._runs_since_full_refresh += 1
+            topologies = {}
+            jobs = []
+            # Before Storm 1.2.0 the windowed metrics are only in the topology info, needed for every interval then
+            fetch_info_once = self.fetch_topology_info_once and self.has_metrics_endpoint(storm_version)
+            if self.fetch_topology_info_once and not fetch_info_once and not self._warned_fetch_topology_info_once:
+                self._warned_fetch_topology_info_once = True
+                self.log.warning(
+                    "Ignoring fetch_topology_info_once, Storm %s has no topology metrics endpoint", storm_version
+                )
+            for topology in _get_list(summary, 'topologies'):
+                topology_id = topology.get('id')
+                if topology_id in (None, ''):
+                    self.log.warning("Ignoring topology without id.")
+                    continue
+                topology_name = _get_string(topology, 'unknown', 'name')
+                if topology_name in self.excluded_topologies:
+                    continue
+                topologies[topology_id] = topology
+                if not self.should_collect_topology(topology_id, topology, full_refresh):
+                    self.log.debug("Skipping idle topology_id:%s, topology_name:%s", topology_id, topology_name)
+                    self.report_topology_status(topology_name, _get_string(topology, 'unknown', 'status').upper())
+                    continue
+                for i, interval in enumerate(self.intervals):
+                    # The window independent part of the topology info only needs to be fetched once.
+                    fetch_info = i == 0 or not fetch_info_once
+                    jobs.append((topology_id, topology_name, interval, fetch_info))
+
+            def _collect(job):
+                topology_id, topology_name, interval, fetch_info = job
+                return self.collect_topology(topology_id, topology_name, interval, storm_version, fetch_info=fetch_info)
+
+            topology_statuses = {}
+            reported_topologies = set()
+            # topology id -> topology info requested for the first interval
+            topology_infos = {}
+            for (topology_id, topology_name, interval, fetch_info), (stats, metric_stats) in zip(
+                jobs, self.imap_requests(_collect, jobs)
+            ):
+                try:
+                    if fetch_info:
+                        if stats is not None:
+                            topology_infos[topology_id] = stats
+                            self.process_topology_stats(topology_stats=stats, interval=interval)
+                    else:
+                        stats = topology_infos.get(topology_id)
+                        if stats is not None:
+                            self.process_topology_stats(topology_stats=stats, interval=interval, windowed=False)
+                    if stats is not None:
+                        if topology_id not in topology_statuses:
+                            topology_statuses[topology_id] = _get_string(stats, 'unknown', 'status').upper()
+                            self.update_topology_state(topology_id, topologies[topology_id], stats)
+                    if metric_stats is None:
+                        continue
+                    self.process_topology_metrics(topology_name, metric_stats, interval=interval)
+
+                    # only report this once.
+                    if topology_id in topology_statuses and topology_id not in reported_topologies:
+                        reported_topologies.add(topology_id)
+                        self.report_topology_status(topology_name, topology_statuses[topology_id])
+                except Exception:  # noqa
+                    self.log.exception(
+                        "unable to collect topology stats for topology_id:%s, topology_name:%s",
+                        topology_id,
+                        topology_name,
+                    )
+
+            # Forget about topologies that were killed
+            for topology_id in list(self._topology_states):
+                if topology_id not in topologies:
+                    del self._topology_states[topology_id]
@@ -2,6 +2,7 @@
 # All rights reserved
 # Licensed under Simplified BSD License (see LICENSE)
 # flake8: noqa E501
+import copy
 
 from datadog_checks.dev import get_docker_hostname
 
@@ -566,3 +567,24 @@ TEST_STORM_TOPOLOGY_METRICS_RESP = {
         },
     ],
 }
+
+
+def make_large_topology_resp(num_bolts=2000, num_spouts=500, num_workers=200):
+    """Scale the recorded topology response up to a large topology for benchmarks."""
+    resp = copy.deepcopy(TEST_STORM_TOPOLOGY_RESP)
+    bolts = TEST_STORM_TOPOLOGY_RESP['bolts']
+    spouts = TEST_STORM_TOPOLOGY_RESP['spouts']
+    worker = {
+        "host": "worker01.example.com",
+        "supervisorId": "11111111-2222-3333-4444-555555555555",
+        "assignedCpu": 0,
+        "assignedMemOffHeap": 0,
+        "assignedMemOnHeap": 832,
+        "executorsTotal": 6,
+        "uptimeSeconds": 1525788,
+        "componentNumTasks": {"Bolt1": 1, "Bolt4": 1, "source": 2},
+    }
+    resp['bolts'] = [dict(bolts[i % len(bolts)], boltId='Bolt{}'.format(i)) for i in range(num_bolts)]
+    resp['spouts'] = [dict(spouts[i % len(spouts)], spoutId='spout{}'.format(i)) for i in range(num_spouts)]
+    resp['workers'] = [dict(worker, port=6700 + i) for i in range(num_workers)]
+    return resp
@@ -0,0 +1,115 @@
+# (C) Datadog, Inc. 2010-2016
+# All rights reserved
+# Licensed under Simplified BSD License (see LICENSE)
+import io
+import json
+
+import mock
+import pytest
+import requests
+
+from datadog_checks.storm import StormCheck
+from datadog_checks.storm.storm import BOLT_PLAN, _float, _g, _long
+
+from .common import make_large_topology_resp
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+CHECK_NAME = 'storm'
+STORM_CHECK_CONFIG = {'server': 'http://localhost:8080', 'environment': 'test'}
+
+LARGE_TOPOLOGY_RESP = make_large_topology_resp()
+
+BOLT_LONGS = (
+    'acked',
+    'emitted',
+    'executed',
+    'executors',
+    'failed',
+    'requestedMemOffHeap',
+    'requestedMemOnHeap',
+    'tasks',
+    'transferred',
+)
+BOLT_FLOATS = ('capacity', 'executeLatency', 'processLatency', 'requestedCpu')
+
+
+def _extract_bolts_g(bolts):
+    values = []
+    for b in bolts:
+        for metric_name in BOLT_LONGS:
+            values.append(_g(b, 0, _long, metric_name))
+        for metric_name in BOLT_FLOATS:
+            values.append(_g(b, 0, _float, metric_name))
+        values.append(_g(b, 1e10, _float, 'errorLapsedSecs'))
+    return values
+
+
+def _extract_bolts_plan(bolts):
+    return [getter(b) for b in bolts for _, getter in BOLT_PLAN]
+
+
+@pytest.mark.benchmark(group='bolt-extraction')
+def test_bench_bolt_extraction_g(benchmark):
+    values = benchmark(_extract_bolts_g, LARGE_TOPOLOGY_RESP['bolts'])
+    assert values == _extract_bolts_plan(LARGE_TOPOLOGY_RESP['bolts'])
+
+
+@pytest.mark.benchmark(group='bolt-extraction')
+def test_bench_bolt_extraction_plan(benchmark):
+    values = benchmark(_extract_bolts_plan, LARGE_TOPOLOGY_RESP['bolts'])
+    assert values == _extract_bolts_g(LARGE_TOPOLOGY_RESP['bolts'])
+
+
+@pytest.mark.benchmark(group='topology-stats')
+def test_bench_process_large_topology_stats(benchmark):
+    check = StormCheck(CHECK_NAME, {}, {})
+    check.update_from_config(STORM_CHECK_CONFIG)
+    count = [0]
+
+    def report_histogram(metric, value, tags, additional_tags):
+        count[0] += 1
+
+    check.report_histogram = report_histogram
+
+    benchmark(check.process_topology_stats, LARGE_TOPOLOGY_RESP, 60)
+    assert count[0] > 0
+
+
+def _get_topology_info_peak_memory(stream_responses, body):
+    """Return the peak memory traced while fetching and decoding a topology info response."""
+    check = StormCheck(CHECK_NAME, {}, {})
+    check.update_from_config(dict(STORM_CHECK_CONFIG, stream_responses=stream_responses))
+
+    def get(*args, **kwargs):
+        resp = requests.Response()
+        resp.status_code = 200
+        resp.raw = io.BytesIO(body)
+        return resp
+
+    with mock.patch('datadog_checks.base.utils.http.RequestsWrapper.get', side_effect=get):
+        tracemalloc.start()
+        try:
+            start_memory = tracemalloc.get_traced_memory()[0]
+            check.get_topology_info('my_topology-1-1489183263')
+            return tracemalloc.get_traced_memory()[1] - start_memory
+        finally:
+            tracemalloc.stop()
+
+
+@pytest.mark.skipif(tracemalloc is None, reason='tracemalloc is only available on Python 3')
+@pytest.mark.benchmark(group='topology-response-memory')
+def test_bench_topology_response_peak_memory(benchmark):
+    # Peak RSS cannot be reset within a process, so the peak memory traced by tracemalloc is compared instead
+    body = json.dumps(make_large_topology_resp(num_bolts=125000, num_spouts=12500, num_workers=2000)).encode('utf-8')
+    assert len(body) > 50 * 1024 * 1024
+
+    peak_memory = _get_topology_info_peak_memory(False, body)
+    streamed_peak_memory = benchmark.pedantic(_get_topology_info_peak_memory, args=(True, body), rounds=1)
+    benchmark.extra_info['peak_memory'] = peak_memory
+    benchmark.extra_info['streamed_peak_memory'] = streamed_peak_memory
+
+    assert streamed_peak_memory < peak_memory
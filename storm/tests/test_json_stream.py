@@ -0,0 +1,52 @@
+# (C) Datadog, Inc. 2010-2016
+# All rights reserved
+# Licensed under Simplified BSD License (see LICENSE)
+import json
+
+import pytest
+
+from datadog_checks.storm.json_stream import JSONStreamReader
+
+from .common import TEST_STORM_CLUSTER_SUMMARY, TEST_STORM_TOPOLOGY_METRICS_RESP, TEST_STORM_TOPOLOGY_RESP
+
+
+def _chunks(text, size):
+    return [text[i : i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 64, 1024 * 1024])
+@pytest.mark.parametrize(
+    'document', [TEST_STORM_CLUSTER_SUMMARY, TEST_STORM_TOPOLOGY_RESP, TEST_STORM_TOPOLOGY_METRICS_RESP]
+)
+def test_read(document, chunk_size):
+    text = json.dumps(document, indent=2)
+    result = JSONStreamReader(_chunks(text, chunk_size)).read(stream_keys=('bolts', 'spouts', 'workers'))
+    assert result == document
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 1024])
+def test_read_skip_keys(chunk_size):
+    text = json.dumps(TEST_STORM_TOPOLOGY_RESP)
+    result = JSONStreamReader(_chunks(text, chunk_size)).read(stream_keys=('bolts',), skip_keys=('configuration',))
+    expected = dict(TEST_STORM_TOPOLOGY_RESP)
+    del expected['configuration']
+    assert result == expected
+
+
+@pytest.mark.parametrize(
+    'text, expected',
+    [
+        ('{}', {}),
+        (' { "bolts" : [ ] } ', {'bolts': []}),
+        ('{"bolts": [12345, 6.5e3], "n": 123456}', {'bolts': [12345, 6.5e3], 'n': 123456}),
+        ('[1, 2]', [1, 2]),
+    ],
+)
+def test_read_edge_cases(text, expected):
+    assert JSONStreamReader(_chunks(text, 2)).read(stream_keys=('bolts',)) == expected
+
+
+@pytest.mark.parametrize('text', ['', '{"bolts": [1, 2}', '{"a": 1', '{"a" 1}', '<html>Error</html>'])
+def test_read_invalid(text):
+    with pytest.raises(ValueError):
+        JSONStreamReader(_chunks(text, 3)).read(stream_keys=('bolts',))
@@ -1,6 +1,8 @@
 # (C) Datadog, Inc. 2010-2016
 # All rights reserved
 # Licensed under Simplified BSD License (see LICENSE)
+import copy
+import logging
 import time
 from collections import defaultdict
 
@@ -32,6 +34,7 @@ def test_load_from_config():
     assert check.additional_tags == []
     assert check.excluded_topologies == []
     assert check.intervals == [60]
+    assert check.max_concurrent_requests == 1
 
 
 def test_get_storm_cluster_summary():
@@ -259,8 +262,9 @@ def test_process_topology_metrics():
     assert results['storm.topologyStats.metrics.spouts.last_60.complete_ms_avg'][0][0] == 920.497
 
 
+@pytest.mark.parametrize('stream_responses', [False, True])
 @responses.activate
-def test_check(aggregator):
+def test_check(aggregator, stream_responses):
     """
     Testing Storm check.
     """
@@ -291,7 +295,7 @@ def test_check(aggregator):
         status=200,
     )
 
-    check.check(STORM_CHECK_CONFIG)
+    check.check(dict(STORM_CHECK_CONFIG, stream_responses=stream_responses))
 
     topology_tags = ['topology:my_topology']
     env_tags = ['stormEnvironment:test']
@@ -462,6 +466,185 @@ def test_check(aggregator):
     aggregator.assert_all_metrics_covered()
 
 
+def _add_storm_responses(cluster_summary=None, topology_summary=None):
+    responses.add(
+        responses.GET,
+        'http://localhost:8080/api/v1/cluster/summary',
+        json=cluster_summary or TEST_STORM_CLUSTER_SUMMARY,
+        status=200,
+    )
+    responses.add(
+        responses.GET, 'http://localhost:8080/api/v1/nimbus/summary', json=TEST_STORM_NIMBUSES_SUMMARY, status=200
+    )
+    responses.add(
+        responses.GET, 'http://localhost:8080/api/v1/supervisor/summary', json=TEST_STORM_SUPERVISOR_SUMMARY, status=200
+    )
+    responses.add(
+        responses.GET,
+        'http://localhost:8080/api/v1/topology/summary',
+        json=topology_summary or TEST_STORM_TOPOLOGY_SUMMARY,
+        status=200,
+    )
+    responses.add(
+        responses.GET,
+        'http://localhost:8080/api/v1/topology/my_topology-1-1489183263',
+        json=TEST_STORM_TOPOLOGY_RESP,
+        status=200,
+    )
+    responses.add(
+        responses.GET,
+        'http://localhost:8080/api/v1/topology/my_topology-1-1489183263/metrics',
+        json=TEST_STORM_TOPOLOGY_METRICS_RESP,
+        status=200,
+    )
+
+
+def _count_calls(path):
+    return len([c for c in responses.calls if c.request.path_url.split('?')[0] == path])
+
+
+@responses.activate
+def test_check_concurrent_requests(aggregator):
+    check = StormCheck(CHECK_NAME, {}, {})
+
+    topology_summary = copy.deepcopy(TEST_STORM_TOPOLOGY_SUMMARY)
+    broken_topology = copy.deepcopy(topology_summary['topologies'][0])
+    broken_topology.update({'id': 'broken_topology-2-1489183263', 'name': 'broken_topology'})
+    topology_summary['topologies'].insert(0, broken_topology)
+
+    _add_storm_responses(topology_summary=topology_summary)
+    responses.add(
+        responses.GET, 'http://localhost:8080/api/v1/topology/broken_topology-2-1489183263', json={}, status=500
+    )
+
+    config = dict(STORM_CHECK_CONFIG, intervals=[60, 600], max_concurrent_requests=4)
+    check.check(config)
+
+    test_tags = ['topology:my_topology', 'stormEnvironment:test', 'stormVersion:1.2.0']
+    aggregator.assert_service_check('topology_check.my_topology', count=1, status=AgentCheck.OK)
+    aggregator.assert_service_check('topology_check.broken_topology', count=0)
+    for interval in ('last_60', 'last_600'):
+        aggregator.assert_metric('storm.topologyStats.{}.emitted'.format(interval), count=1, tags=test_tags)
+        aggregator.assert_metric('storm.topologyStats.metrics.spouts.{}.emitted'.format(interval), at_least=1)
+    for metric in aggregator.metric_names:
+        for m in aggregator.metrics(metric):
+            assert 'topology:broken_topology' not in m.tags
+
+
+@responses.activate
+def test_check_fetch_topology_info_once(aggregator):
+    check = StormCheck(CHECK_NAME, {}, {})
+    _add_storm_responses()
+
+    config = dict(STORM_CHECK_CONFIG, intervals=[60, 600, 3600], fetch_topology_info_once=True)
+    check.check(config)
+
+    assert _count_calls('/api/v1/topology/my_topology-1-1489183263') == 1
+    assert _count_calls('/api/v1/topology/my_topology-1-1489183263/metrics') == 3
+
+    aggregator.assert_service_check('topology_check.my_topology', count=1, status=AgentCheck.OK)
+    aggregator.assert_metric('storm.topologyStats.last_60.emitted', count=1)
+    aggregator.assert_metric('storm.bolt.last_60.emitted', count=6)
+    for interval in ('last_600', 'last_3600'):
+        # the window dependent metrics of the topology info are only reported for the first interval
+        aggregator.assert_metric('storm.topologyStats.{}.emitted'.format(interval), count=0)
+        aggregator.assert_metric('storm.bolt.{}.emitted'.format(interval), count=0)
+        aggregator.assert_metric('storm.spout.{}.completeLatency'.format(interval), count=0)
+    for interval in ('last_60', 'last_600', 'last_3600'):
+        aggregator.assert_metric('storm.topologyStats.{}.uptimeSeconds'.format(interval), count=1)
+        aggregator.assert_metric('storm.bolt.{}.tasks'.format(interval), count=6)
+        aggregator.assert_metric('storm.spout.{}.tasks'.format(interval), at_least=1)
+        aggregator.assert_metric('storm.topologyStats.metrics.spouts.{}.emitted'.format(interval), at_least=1)
+
+
+@responses.activate
+def test_check_fetch_topology_info_once_before_storm_1_2(aggregator):
+    check = StormCheck(CHECK_NAME, {}, {})
+    _add_storm_responses(cluster_summary=dict(TEST_STORM_CLUSTER_SUMMARY, stormVersion='1.1.0'))
+
+    check.check(dict(STORM_CHECK_CONFIG, intervals=[60, 600], fetch_topology_info_once=True))
+
+    # the windowed metrics are only in the topology info, the option is ignored
+    assert _count_calls('/api/v1/topology/my_topology-1-1489183263') == 2
+    for interval in ('last_60', 'last_600'):
+        aggregator.assert_metric('storm.topologyStats.{}.emitted'.format(interval), count=1)
+
+
+@responses.activate
+def test_check_reuses_topology_info_before_storm_1_2(aggregator):
+    check = StormCheck(CHECK_NAME, {}, {})
+    _add_storm_responses(cluster_summary=dict(TEST_STORM_CLUSTER_SUMMARY, stormVersion='1.1.0'))
+
+    check.check(dict(STORM_CHECK_CONFIG, intervals=[60, 600]))
+
+    assert _count_calls('/api/v1/topology/my_topology-1-1489183263') == 2
+    assert _count_calls('/api/v1/topology/my_topology-1-1489183263/metrics') == 0
+    aggregator.assert_service_check('topology_check.my_topology', count=1, status=AgentCheck.OK)
+
+
+def test_tag_cache():
+    check = StormCheck(CHECK_NAME, {}, {})
+    check.update_from_config(dict(STORM_CHECK_CONFIG, tags=['foo:bar']))
+
+    tags = check.get_all_tags(['topology:my_topology', 'bolt:Bolt1'], check.additional_tags)
+    assert tags == ('bolt:Bolt1', 'foo:bar', 'stormEnvironment:test', 'topology:my_topology')
+    assert check.get_all_tags(['topology:my_topology', 'bolt:Bolt1'], check.additional_tags) is tags
+    assert check.get_all_tags(['topology:my_topology'], check.additional_tags) is not tags
+    assert (check.tag_cache_hits, check.tag_cache_misses) == (1, 2)
+
+    check.update_from_config(dict(STORM_CHECK_CONFIG, tags=['foo:bar']))
+    assert (check.tag_cache_hits, check.tag_cache_misses) == (0, 0)
+
+
+@responses.activate
+def test_check_trace_tag_allocations(aggregator, caplog):
+    check = StormCheck(CHECK_NAME, {}, {})
+    _add_storm_responses()
+
+    with caplog.at_level(logging.DEBUG):
+        check.check(dict(STORM_CHECK_CONFIG, trace_tag_allocations=True))
+
+    assert check.tag_cache_hits > check.tag_cache_misses
+    assert 'Tag cache: {} hits'.format(check.tag_cache_hits) in caplog.text
+    assert 'Traced memory:' in caplog.text
+
+
+@responses.activate
+def test_check_skip_idle_topologies(aggregator):
+    check = StormCheck(CHECK_NAME, {}, {})
+    _add_storm_responses()
+    config = dict(STORM_CHECK_CONFIG, skip_idle_topologies=True, full_refresh_interval=3)
+    topology_path = '/api/v1/topology/my_topology-1-1489183263'
+
+    # First two runs always collect, the counters did not move between them
+    check.check(config)
+    check.check(config)
+    assert _count_calls(topology_path) == 2
+
+    # The topology is idle, only the service check is reported
+    aggregator.reset()
+    check.check(config)
+    assert _count_calls(topology_path) == 2
+    aggregator.assert_service_check('topology_check.my_topology', count=1, status=AgentCheck.OK)
+    aggregator.assert_metric('storm.topologyStats.last_60.emitted', count=0)
+    aggregator.assert_metric('storm.cluster.executorsTotal', count=1)
+
+    # Full refresh
+    check.check(config)
+    assert _count_calls(topology_path) == 3
+
+    # Restarted topology
+    check.check(config)
+    assert _count_calls(topology_path) == 3
+    restarted_summary = copy.deepcopy(TEST_STORM_TOPOLOGY_SUMMARY)
+    restarted_summary['topologies'][0]['uptimeSeconds'] = 10
+    responses.replace(
+        responses.GET, 'http://localhost:8080/api/v1/topology/summary', json=restarted_summary, status=200
+    )
+    check.check(config)
+    assert _count_calls(topology_path) == 4
+
+
 @pytest.mark.integration
 def test_integration_with_ci_cluster(dd_environment, aggregator):
     check = StormCheck(CHECK_NAME, {}, {})
@@ -0,0 +1,88 @@
+import socket
+import ssl
+
+UNBOUND_CONTROL_PORT = 8953
+# Magic sent before every command, unbound rejects the connection otherwise
+UNBOUND_CONTROL_VERSION = 'UBCT1'
+BUFFER_SIZE = 65536
+
+
+class UnboundControlError(Exception):
+    pass
+
+
+class UnboundControlClient(object):
+    """Client for the remote control protocol unbound-control speaks to unbound.
+
+    The control interface is either an address (ip[@port]) reached over TLS with the unbound-control key and
+    certificate, or over plain TCP when unbound is configured with `control-use-cert: no`, or the absolute path
+    of a local socket.
+    """
+
+    def __init__(
+        self,
+        control_interface,
+        use_cert=True,
+        key_file='/etc/unbound/unbound_control.key',
+        cert_file='/etc/unbound/unbound_control.pem',
+        server_cert_file='/etc/unbound/unbound_server.pem',
+        timeout=5,
+    ):
+        self.control_interface = control_interface
+        self.use_cert = use_cert
+        self.key_file = key_file
+        self.cert_file = cert_file
+        self.server_cert_file = server_cert_file
+        self.timeout = timeout
+        self._ssl_context = None
+
+    def _get_ssl_context(self):
+        if self._ssl_context is None:
+            context = ssl.create_default_context(cafile=self.server_cert_file)
+            # unbound-control-setup issues a self signed server certificate, named "unbound" whatever the host
+            context.check_hostname = False
+            context.load_cert_chain(self.cert_file, self.key_file)
+            self._ssl_context = context
+        return self._ssl_context
+
+    def _connect(self):
+        if self.control_interface.startswith('/'):
+            # unbound never uses TLS on local sockets
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.control_interface)
+            except Exception:
+                sock.close()
+                raise
+            return sock
+
+        host, _, port = self.control_interface.partition('@')
+        sock = socket.create_connection((host, int(port) if port else UNBOUND_CONTROL_PORT), self.timeout)
+        if not self.use_cert:
+            return sock
+        try:
+            return self._get_ssl_context().wrap_socket(sock)
+        except Exception:
+            sock.close()
+            raise
+
+    def send_command(self, command):
+        """Runs a command, e.g. `stats_noreset`, and returns its output"""
+        sock = self._connect()
+        try:
+            sock.sendall('{} {}\n'.format(UNBOUND_CONTROL_VERSION, command).encode('ascii'))
+            # unbound closes the connection once the whole output is sent
+            chunks = []
+            while True:
+                chunk = sock.recv(BUFFER_SIZE)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        finally:
+            sock.close()
+
+        output = b''.join(chunks).decode('utf-8', 'replace')
+        if output.startswith('error'):
+            raise UnboundControlError(output.strip())
+        return output
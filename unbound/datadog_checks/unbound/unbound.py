@@ -5,22 +5,118 @@ import socket
 from datadog_checks.base import AgentCheck, ConfigurationError, is_affirmative
 from datadog_checks.base.utils.subprocess_output import get_subprocess_output
 
+from .control import UnboundControlClient
+
 EVENT_TYPE = 'unbound'
 
+COUNT = 'count'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+# Prefixes of the stats whose name holds a tag, and the method extracting it
+TAG_HANDLERS = (
+    ('thread', 'thread_handler'),
+    ('num.query.type', 'query_type_handler'),
+    ('num.query.class', 'query_class_handler'),
+    ('num.query.opcode', 'query_opcode_handler'),
+    ('num.query.flags', 'query_flags_handler'),
+    ('num.answer.rcode', 'answer_rcode_handler'),
+)
+
 
 class UnboundCheck(AgentCheck):
     # Stats info https://unbound.net/documentation/unbound-control.html
 
     SERVICE_CHECK_NAME = 'unbound.can_get_stats'
 
+    _control_client = None
+    _control_client_config = None
+    _parsed_stats = None
+    _parsed_stats_tags = None
+
     def check(self, instance):
 
+        stats_command = instance.get('stats_command', 'stats')
+        control_interface = instance.get('control_interface')
+        tags = instance.get('tags', [])
+
+        if control_interface:
+            ub_out = self.query_control_interface(instance, control_interface, stats_command, tags)
+        else:
+            # Call unbound-control in a separate method to facilitate mocking during testing.
+            # Without this, it's difficult to mock the multiple get_subprocess_output calls
+            # independently.
+            ub_out = self.call_unbound_control(self.build_command(instance, stats_command), tags)
+
+        # Example of unbound stats outpout:
+        # total.num.queries=12
+        # mem.cache.rrset=0
+        # num.query.type.A=4
+        # unwanted.queries=3
+
+        # [(u'thread0.num.queries', u'12'), (u'thread0.num.queries_ip_ratelimited', u'45')...]
+        data = re.findall(r'(\S+)=(.*\d)', ub_out)
+
+        if not data:
+            self.service_check(self.SERVICE_CHECK_NAME, AgentCheck.CRITICAL, message="unable to parse stats", tags=tags)
+            raise Exception("unable to parse output '{}'".format(ub_out))
+
+        self.service_check(self.SERVICE_CHECK_NAME, AgentCheck.OK, tags=tags)
+
+        # unbound resets its counters on `stats`, histogram buckets only keep growing with e.g. `stats_noreset`
+        monotonic = stats_command != 'stats'
+
+        # The stats reported by unbound barely change from one run to the other, parse their names once
+        if self._parsed_stats_tags != tags:
+            self._parsed_stats = {}
+            self._parsed_stats_tags = tags
+
+        for stat_name, value in data:
+            parsed_stat = self._parsed_stats.get(stat_name)
+            if parsed_stat is None:
+                parsed_stat = self._parsed_stats[stat_name] = self.parse_stat(stat_name, tags)
+            metric_type, unbound_metric_name, all_tags, bounds = parsed_stat
+
+            if metric_type == HISTOGRAM:
+                self.submit_histogram_bucket(
+                    unbound_metric_name, int(value), bounds[0], bounds[1], monotonic, None, all_tags
+                )
+            elif metric_type == COUNT:
+                self.count(unbound_metric_name, value, tags=all_tags)
+            else:
+                self.gauge(unbound_metric_name, float(value), tags=all_tags)
+
+    def parse_stat(self, stat_name, tags):
+        """Returns a tuple (metric_type, metric_name, all_tags, bounds) for a stat reported by unbound,
+        bounds being the (lower, upper) bounds in seconds of histogram buckets
+        """
+        if stat_name.startswith('histogram.'):
+            # e.g. histogram.000000.000128.to.000000.000256
+            bounds = tuple(parse_histogram_bound(bound) for bound in stat_name.split('.', 1)[1].split('.to.'))
+            all_tags = tags + ['lower_bound:{:.6f}'.format(bounds[0]), 'upper_bound:{:.6f}'.format(bounds[1])]
+            self.log.debug('histogram bucket: %s', stat_name)
+            return HISTOGRAM, 'unbound.histogram', all_tags, bounds
+
+        # Some metric names from unbound make more sense to record as name + tag in datadog.
+        metric_name, all_tags = self.metric_name_to_tags(stat_name, tags)
+
+        if any(count in metric_name for count in ['num.', 'unwanted', '.count']):
+            self.log.debug('count: %s', stat_name)
+            metric_type = COUNT
+        elif 'time.' in metric_name:
+            self.log.debug('gauge (time): %s', stat_name)
+            metric_type = GAUGE
+        else:
+            self.log.debug('gauge: %s', stat_name)
+            metric_type = GAUGE
+
+        return metric_type, 'unbound.{}'.format(metric_name), all_tags, None
+
+    def build_command(self, instance, stats_command):
         use_sudo = is_affirmative(instance.get('use_sudo', False))
         unbound_control = instance.get('unbound_control', 'unbound-control')
-        stats_command = instance.get('stats_command', 'stats')
         host = instance.get('host')
         config_file = instance.get('config_file')
-        tags = instance.get('tags', [])
 
         command = []
         if use_sudo:
@@ -38,46 +134,35 @@ class UnboundCheck(AgentCheck):
         if config_file:
             command.extend(('-c', config_file))
 
-        # Call unbound-control in a separate method to facilitate mocking during testing.
-        # Without this, it's difficult to mock the multiple get_subprocess_output calls
-        # independently.
-        ub_out = self.call_unbound_control(command, tags)
-
-        # Example of unbound stats outpout:
-        # total.num.queries=12
-        # mem.cache.rrset=0
-        # num.query.type.A=4
-        # unwanted.queries=3
-
-        # [(u'thread0.num.queries', u'12'), (u'thread0.num.queries_ip_ratelimited', u'45')...]
-        data = re.findall(r'(\S+)=(.*\d)', ub_out)
-
-        if not data:
-            self.service_check(self.SERVICE_CHECK_NAME, AgentCheck.CRITICAL, message="unable to parse stats", tags=tags)
-            raise Exception("unable to parse output '{}'".format(ub_out))
-
-        self.service_check(self.SERVICE_CHECK_NAME, AgentCheck.OK, tags=tags)
-
-        for stat in data:
-            self.log.debug('processing %s', stat)
+        return command
+
+    def query_control_interface(self, instance, control_interface, stats_command, tags):
+        # Talk to unbound directly instead of running unbound-control, the client is kept to reuse its TLS context
+        client_config = (
+            control_interface,
+            is_affirmative(instance.get('control_use_cert', True)),
+            instance.get('control_key_file', '/etc/unbound/unbound_control.key'),
+            instance.get('control_cert_file', '/etc/unbound/unbound_control.pem'),
+            instance.get('server_cert_file', '/etc/unbound/unbound_server.pem'),
+            float(instance.get('timeout', 5)),
+        )
+        if self._control_client_config != client_config:
+            self._control_client = UnboundControlClient(*client_config)
+            self._control_client_config = client_config
 
-            # Some metric names from unbound make more sense to record as name + tag in datadog.
-            metric_name, all_tags = self.metric_name_to_tags(stat[0], tags)
+        try:
+            ub_out = self._control_client.send_command(stats_command)
+        except Exception as e:
+            self.service_check(
+                self.SERVICE_CHECK_NAME, AgentCheck.CRITICAL, message="exception collecting stats", tags=tags
+            )
+            raise Exception("Unable to get unbound stats: {}".format(str(e)))
 
-            unbound_metric_name = 'unbound.{}'.format(metric_name)
+        if not ub_out:
+            self.service_check(self.SERVICE_CHECK_NAME, AgentCheck.CRITICAL, message="no stats", tags=tags)
+            raise Exception('no output from "{}"'.format(control_interface))
 
-            if 'histogram' in metric_name:  # dont send histogram metrics
-                self.log.debug('unbound.%s:%s', unbound_metric_name, stat[1])
-            else:
-                if any(count in metric_name for count in ['num.', 'unwanted', '.count']):
-                    self.log.debug('count: %s', stat)
-                    self.count(unbound_metric_name, stat[1], tags=all_tags)
-                elif 'time.' in metric_name:
-                    self.log.debug('gauge (time): %s', stat)
-                    self.gauge(unbound_metric_name, float(stat[1]), tags=all_tags)
-                else:
-                    self.log.debug('gauge: %s', stat)
-                    self.gauge(unbound_metric_name, float(stat[1]), tags=all_tags)
+        return ub_out
 
     def call_unbound_control(self, command, tags):
         try:
@@ -107,22 +192,13 @@ class UnboundCheck(AgentCheck):
         return ub_out
 
     def tag_handler(self, metric_name):
-        TAG_HANDLERS = {
-            'thread': self.thread_handler,
-            'num.query.type': self.query_type_handler,
-            'num.query.class': self.query_class_handler,
-            'num.query.opcode': self.query_opcode_handler,
-            'num.query.flags': self.query_flags_handler,
-            'num.answer.rcode': self.answer_rcode_handler,
-        }
-
-        handlers = [TAG_HANDLERS[prefix] for prefix in TAG_HANDLERS.keys() if metric_name.startswith(prefix)]
+        handlers = [getattr(self, handler) for prefix, handler in TAG_HANDLERS if metric_name.startswith(prefix)]
         num_handlers = len(handlers)
         if num_handlers == 0:
             return None
         if num_handlers == 1:
             return handlers[0]
-        raise Exception("more than one handler for '" + metric_name + "': " + handlers)
+        raise Exception("more than one handler for '{}': {}".format(metric_name, handlers))
 
     def query_type_handler(self, metric_name, tags):
         # Split out the query type from the rest of the metric name
@@ -275,6 +351,14 @@ def which(program, use_sudo, log):
     return None
 
 
+def parse_histogram_bound(bound):
+    # e.g. 000000.000128, seconds and microseconds
+    try:
+        return float(bound)
+    except ValueError:
+        return float('inf')
+
+
 def hostname_to_ip(hostname):
     if '@' not in hostname:
         # gethostbyname() handles both hostnames & IPv4 addresses. If the
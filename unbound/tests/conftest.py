@@ -1,5 +1,9 @@
 import logging
 import os
+import socket
+import ssl
+import subprocess
+import threading
 
 import mock
 import pytest
@@ -70,3 +74,81 @@ def env_setup(monkeypatch):
     log.debug('env_setup: no_sbin_path: %s', no_sbin_path)
     monkeypatch.setenv('PATH', no_sbin_path)
     log.debug('env_setup: after: PATH: %s', os.environ['PATH'])
+
+
+class ControlServer(threading.Thread):
+    """Stand-in for the unbound remote control interface, answering a single connection"""
+
+    def __init__(self, sock, response, ssl_context=None):
+        super(ControlServer, self).__init__()
+        self.daemon = True
+        self.sock = sock
+        self.response = response
+        self.ssl_context = ssl_context
+        self.requests = []
+
+    def run(self):
+        conn, _ = self.sock.accept()
+        try:
+            if self.ssl_context is not None:
+                conn = self.ssl_context.wrap_socket(conn, server_side=True)
+            request = b''
+            while not request.endswith(b'\n'):
+                chunk = conn.recv(1024)
+                if not chunk:
+                    break
+                request += chunk
+            self.requests.append(request)
+            conn.sendall(self.response.encode('utf-8'))
+        finally:
+            conn.close()
+
+
+@pytest.fixture
+def control_server(tmpdir):
+    servers = []
+
+    def start(response, unix_socket=False, ssl_context=None):
+        if unix_socket:
+            address = str(tmpdir.join('unbound.ctl'))
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.bind(address)
+            control_interface = address
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.bind(('127.0.0.1', 0))
+            control_interface = '127.0.0.1@{}'.format(sock.getsockname()[1])
+        sock.listen(1)
+        server = ControlServer(sock, response, ssl_context)
+        server.start()
+        servers.append(server)
+        return control_interface, server
+
+    yield start
+
+    for server in servers:
+        server.sock.close()
+        server.join(5)
+
+
+@pytest.fixture
+def control_certs(tmpdir):
+    """Server and client keys as made by unbound-control-setup, self signed"""
+    certs = {}
+    for name in ('server', 'control'):
+        key_file = str(tmpdir.join('unbound_{}.key'.format(name)))
+        cert_file = str(tmpdir.join('unbound_{}.pem'.format(name)))
+        command = ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1']
+        command += ['-keyout', key_file, '-out', cert_file, '-subj', '/CN=unbound-{}'.format(name)]
+        try:
+            subprocess.check_call(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except (OSError, subprocess.CalledProcessError):
+            pytest.skip('openssl is required to generate the control certificates')
+        certs[name] = (key_file, cert_file)
+
+    ssl_context = ssl.SSLContext(getattr(ssl, 'PROTOCOL_TLS_SERVER', ssl.PROTOCOL_SSLv23))
+    ssl_context.load_cert_chain(certs['server'][1], certs['server'][0])
+    ssl_context.verify_mode = ssl.CERT_REQUIRED
+    ssl_context.load_verify_locations(certs['control'][1])
+    certs['ssl_context'] = ssl_context
+    return certs
@@ -148,6 +148,48 @@ def test_extended_stats_1_9_2(aggregator, mock_which, mock_extended_stats_1_9_2)
     aggregator.assert_all_metrics_covered()
 
 
+@pytest.mark.parametrize('stats_command, monotonic', [('stats', False), ('stats_noreset', True)])
+def test_extended_stats_histogram(aggregator, mock_which, mock_extended_stats_1_9_2, stats_command, monotonic):
+    check = UnboundCheck('unbound', {}, {})
+    check.check({'tags': ['foo:bar'], 'stats_command': stats_command})
+
+    assert len(aggregator.histogram_bucket('unbound.histogram')) == 40
+    aggregator.assert_histogram_bucket(
+        'unbound.histogram',
+        0,
+        0.000128,
+        0.000256,
+        monotonic,
+        None,
+        ['foo:bar', 'lower_bound:0.000128', 'upper_bound:0.000256'],
+    )
+    aggregator.assert_histogram_bucket(
+        'unbound.histogram',
+        0,
+        262144.0,
+        524288.0,
+        monotonic,
+        None,
+        ['foo:bar', 'lower_bound:262144.000000', 'upper_bound:524288.000000'],
+    )
+
+
+def test_stat_names_parsed_once(aggregator, mock_which, mock_extended_stats_1_9_2):
+    check = UnboundCheck('unbound', {}, {})
+    with mock.patch.object(check, 'parse_stat', wraps=check.parse_stat) as parse_stat:
+        check.check({'tags': ['foo:bar']})
+        stats_count = parse_stat.call_count
+        check.check({'tags': ['foo:bar']})
+        assert parse_stat.call_count == stats_count
+
+        # the tags changed, the names have to be parsed again
+        check.check({'tags': ['foo:baz']})
+        assert parse_stat.call_count == 2 * stats_count
+
+    aggregator.assert_metric('unbound.thread.num.queries', tags=['foo:bar', 'thread:0'], count=2)
+    aggregator.assert_metric('unbound.thread.num.queries', tags=['foo:baz', 'thread:0'], count=1)
+
+
 def test_hostname_with_port(aggregator, mock_which, mock_basic_stats_1_4_22):
     instance = {"host": "localhost@53"}
     check = UnboundCheck('unbound', {}, [instance])
@@ -166,6 +208,59 @@ def test_hostname_without_port(aggregator, mock_which, mock_basic_stats_1_4_22):
     aggregator.assert_service_check(UnboundCheck.SERVICE_CHECK_NAME, status=AgentCheck.OK)
 
 
+def _read_fixture(name):
+    with open(os.path.join(os.path.dirname(__file__), 'fixtures', name), 'r') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('unix_socket', [False, True], ids=['tcp', 'unix_socket'])
+def test_control_interface(aggregator, control_server, unix_socket):
+    control_interface, server = control_server(_read_fixture('stats.basic.1.9.2'), unix_socket=unix_socket)
+    instance = {
+        'control_interface': control_interface,
+        'control_use_cert': False,
+        'stats_command': 'stats_noreset',
+        'tags': ['foo:bar'],
+    }
+    check = UnboundCheck('unbound', {}, [instance])
+    with mock.patch('datadog_checks.unbound.unbound.get_subprocess_output') as get_subprocess_output:
+        check.check(instance)
+
+    # no process is spawned, neither for sudo nor for unbound-control
+    get_subprocess_output.assert_not_called()
+    assert server.requests == [b'UBCT1 stats_noreset\n']
+    aggregator.assert_service_check(UnboundCheck.SERVICE_CHECK_NAME, status=AgentCheck.OK)
+    assert_basic_stats_1_9_2(aggregator, ['foo:bar'])
+    aggregator.assert_all_metrics_covered()
+
+
+def test_control_interface_tls(aggregator, control_server, control_certs):
+    control_interface, server = control_server(
+        _read_fixture('stats.basic.1.9.2'), ssl_context=control_certs['ssl_context']
+    )
+    instance = {
+        'control_interface': control_interface,
+        'control_key_file': control_certs['control'][0],
+        'control_cert_file': control_certs['control'][1],
+        'server_cert_file': control_certs['server'][1],
+    }
+    check = UnboundCheck('unbound', {}, [instance])
+    check.check(instance)
+
+    assert server.requests == [b'UBCT1 stats\n']
+    aggregator.assert_service_check(UnboundCheck.SERVICE_CHECK_NAME, status=AgentCheck.OK)
+    assert_basic_stats_1_9_2(aggregator, [])
+
+
+def test_control_interface_error(aggregator, control_server):
+    control_interface, _ = control_server('error unknown command \'stats_foo\'\n')
+    instance = {'control_interface': control_interface, 'control_use_cert': False, 'stats_command': 'stats_foo'}
+    check = UnboundCheck('unbound', {}, [instance])
+    with pytest.raises(Exception, match="Unable to get unbound stats: error unknown command"):
+        check.check(instance)
+    aggregator.assert_service_check(UnboundCheck.SERVICE_CHECK_NAME, status=AgentCheck.CRITICAL)
+
+
 def assert_basic_stats_1_9_2(aggregator, tags):
     thread0_tags = tags + ['thread:0']
     aggregator.assert_metric(